@@ -1,3 +1,352 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import router
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.signals import template_rendered
+from django.urls import reverse
+from django.utils import timezone
+
+from finsight_project.db_routing import replica_reads
+from transactions.budgets import save_budgets
+from transactions.forecaster import SpendingForecaster, store_forecast
+from transactions.models import Budget, Category, DailySpend, DataVersion, ForecastJob, ForecastResult, Transaction
+from transactions.rollups import verify_daily_spend
+
+from .views import AsyncDashboardView
+
+# The manifest storage needs collectstatic, which the tests don't run
+TEST_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES, FORECAST_WORKER=False)
+class DashboardTestCase(TestCase):
+    """An account with two months of transactions and two standing budgets, logged in to its dashboard."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='secret-password')
+        # As for anyone who has seen the dashboard before
+        DataVersion.for_user(cls.user.pk)
+        now = timezone.now()
+        categories = [Category.objects.create(user=cls.user, name=name) for name in ('Food', 'Bills', 'Travel')]
+        for category in categories[:2]:
+            Budget.objects.create(user=cls.user, category=category, amount=Decimal('500.00'))
+        for i in range(60):
+            Transaction.objects.create(
+                user=cls.user,
+                category=categories[i % 3] if i % 4 else None,
+                amount=Decimal('12.50') + i,
+                transaction_type='income' if i % 10 == 0 else 'expense',
+                description=f'purchase {i}',
+                date=now - timedelta(days=i),
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def render_afresh(self):
+        # As after a change the forecast doesn't depend on: the cached sections are out of date
+        DataVersion.bump(self.user.pk)
+
+
+class DashboardQueryBudgetTests(DashboardTestCase):
+    """
+    The dashboard must not issue more queries as the account grows. If one of these fails,
+    a change has added a query (or an N+1 loop) to the dashboard.
+    """
+    # Session, user, data version, spending totals, budgets, recent transactions
+    QUERY_BUDGET = 6
+
+    def test_dashboard_stays_within_query_budget(self):
+        # The first view fits and caches the forecast
+        self.client.get(reverse('dashboard'))
+        self.render_afresh()
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['transactions']), 10)
+        self.assertEqual(len(response.context['budget_progress']), 2)
+
+    def test_query_count_does_not_grow_with_transactions(self):
+        self.client.get(reverse('dashboard'))
+        Transaction.objects.bulk_create(
+            Transaction(user=self.user, amount=Decimal('1.00'), transaction_type='expense', description='bulk')
+            for _ in range(200)
+        )
+        # The bulk insert skipped the rollup signals, so the fingerprint is unchanged and the cache still hits
+        self.render_afresh()
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('dashboard'))
+
+    @override_settings(FORECAST_WORKER=True)
+    def test_dashboard_with_stored_forecast_stays_within_query_budget(self):
+        ForecastResult.objects.create(user=self.user, amount=Decimal('123.45'), computed_at=timezone.now())
+        # The first view computes and caches the budget projections
+        self.client.get(reverse('dashboard'))
+        self.render_afresh()
+        # The stored forecast, with its "stale" flag, is read in one extra query
+        with self.assertNumQueries(self.QUERY_BUDGET + 1):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['forecasted_spending'], Decimal('123.45'))
+
+
+class DashboardBudgetTests(DashboardTestCase):
+    """Budget progress shows this month's spending against the budget in effect for this month."""
+    def test_budget_progress_uses_month_to_date_spending(self):
+        response = self.client.get(reverse('dashboard'))
+        start_of_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        food = Category.objects.get(user=self.user, name='Food')
+        expected = sum(
+            t.amount for t in Transaction.objects.filter(
+                user=self.user, category=food, transaction_type='expense', date__gte=start_of_month)
+        )
+        progress = {item['category_name']: item for item in response.context['budget_progress']}
+        self.assertEqual(progress['Food']['spent_amount'], expected)
+
+    def test_budget_for_this_month_replaces_standing_budget(self):
+        food = Category.objects.get(user=self.user, name='Food')
+        this_month = timezone.localdate().replace(day=1)
+        Budget.objects.create(user=self.user, category=food, amount=Decimal('75.00'), month=this_month)
+        # A budget for another month changes nothing now
+        Budget.objects.create(user=self.user, category=food, amount=Decimal('1.00'), month=this_month.replace(year=2000))
+        progress = {item['category_name']: item for item in self.client.get(reverse('dashboard')).context['budget_progress']}
+        self.assertEqual(progress['Food']['budget_amount'], Decimal('75.00'))
+        self.assertEqual(progress['Bills']['budget_amount'], Decimal('500.00'))
+
+    def test_moving_a_transaction_to_another_month_moves_its_spending(self):
+        food = Category.objects.get(user=self.user, name='Food')
+        purchase = Transaction.objects.create(user=self.user, category=food, amount=Decimal('250.00'),
+                                              transaction_type='expense', description='groceries', date=timezone.now())
+        def spent():
+            progress = self.client.get(reverse('dashboard')).context['budget_progress']
+            return {item['category_name']: item['spent_amount'] for item in progress}
+
+        before = spent()
+        purchase.date = timezone.now() - timedelta(days=62)
+        purchase.save()
+        self.assertEqual(spent()['Food'], before['Food'] - Decimal('250.00'))
+        self.assertEqual(verify_daily_spend(self.user.pk), {})
+
+
+class DashboardForecastTests(DashboardTestCase):
+    """Month-end projections and forecasts, computed in the request or read from what the worker stored."""
+    def test_budget_progress_includes_month_end_projection(self):
+        response = self.client.get(reverse('dashboard'))
+        for item in response.context['budget_progress']:
+            self.assertGreaterEqual(item['projected_amount'], item['spent_amount'])
+            self.assertEqual(item['projected_overrun'], max(item['projected_amount'] - item['budget_amount'], 0))
+
+        # Far more spent than budgeted is always projected as an overrun
+        food = Category.objects.get(user=self.user, name='Food')
+        Transaction.objects.create(user=self.user, category=food, amount=Decimal('5000.00'),
+                                   transaction_type='expense', description='big purchase', date=timezone.now())
+        progress = {item['category_name']: item for item in self.client.get(reverse('dashboard')).context['budget_progress']}
+        self.assertGreater(progress['Food']['projected_overrun'], 0)
+
+    @override_settings(FORECAST_WORKER=True)
+    def test_dashboard_reads_projections_stored_by_the_worker(self):
+        store_forecast(self.user.pk)
+        stored = ForecastResult.objects.get(user=self.user).projections_for(timezone.localdate())
+        with mock.patch.object(SpendingForecaster, 'month_end_projections_for_user', side_effect=AssertionError):
+            progress = self.client.get(reverse('dashboard')).context['budget_progress']
+        for item in progress:
+            category = Category.objects.get(user=self.user, name=item['category_name'])
+            self.assertEqual(item['projected_amount'], max(stored[category.pk], item['spent_amount']))
+
+        # Ones from another day are shown while they are redone
+        ForecastResult.objects.filter(user=self.user).update(projected_on=timezone.localdate() - timedelta(days=1))
+        self.render_afresh()
+        self.client.get(reverse('dashboard'))
+        self.assertTrue(ForecastJob.objects.filter(user=self.user).exists())
+
+    def test_worker_backs_off_and_then_gives_up_on_a_failing_forecast(self):
+        ForecastJob.enqueue(self.user.pk)
+
+        def work():
+            call_command('forecast_worker', '--once', '--max-attempts', '2', stdout=io.StringIO(), stderr=io.StringIO())
+
+        with mock.patch('transactions.management.commands.forecast_worker.store_forecast',
+                        side_effect=RuntimeError('boom')) as fit:
+            work()
+            job = ForecastJob.objects.get(user=self.user)
+            self.assertEqual((fit.call_count, job.attempts, job.started_at), (1, 1, None))
+            self.assertGreater(job.retry_at, timezone.now())
+            work()
+            self.assertEqual(fit.call_count, 1)
+
+            ForecastJob.objects.filter(user=self.user).update(retry_at=timezone.now())
+            work()
+            ForecastJob.objects.filter(user=self.user).update(retry_at=None)
+            work()
+            self.assertEqual(fit.call_count, 2)
+            job = ForecastJob.objects.get(user=self.user)
+            self.assertEqual(job.attempts, 2)
+            self.assertIsNotNone(job.failed_at)
+
+        # The dashboard says so instead of "updating", and doesn't queue it again
+        with self.settings(FORECAST_WORKER=True):
+            context = self.client.get(reverse('dashboard')).context
+            self.assertEqual((context['forecast_stale'], context['forecast_failed']), (False, True))
+            self.assertContains(self.client.get(reverse('dashboard')), "couldn't be calculated")
+            ForecastResult.objects.create(user=self.user, amount=Decimal('99.00'), computed_at=timezone.now())
+            self.render_afresh()
+            context = self.client.get(reverse('dashboard')).context
+            self.assertEqual((context['forecasted_spending'], context['forecast_stale']), (Decimal('99.00'), False))
+        self.assertIsNotNone(ForecastJob.objects.get(user=self.user).failed_at)
+
+        # Until the data changes again
+        ForecastJob.enqueue(self.user.pk)
+        work()
+        self.assertFalse(ForecastJob.objects.filter(user=self.user).exists())
+        self.assertTrue(ForecastResult.objects.filter(user=self.user).exists())
+
+
+class DashboardConditionalTests(DashboardTestCase):
+    """Unchanged dashboards are answered with 304, and cached sections are reused until the user's data changes."""
+    def test_cached_sections_are_not_computed_again(self):
+        self.client.get(reverse('dashboard'))
+        # Without the budgets, or their projections
+        with self.assertNumQueries(DashboardQueryBudgetTests.QUERY_BUDGET - 1):
+            response = self.client.get(reverse('dashboard'))
+        self.assertNotIn('budget_progress', response.context)
+        self.assertContains(response, '/ ₹500.00')
+        food = Category.objects.get(user=self.user, name='Food')
+        save_budgets(self.user, [(food.pk, None, Decimal('650.00'))])
+        self.assertContains(self.client.get(reverse('dashboard')), '/ ₹650.00')
+
+    def test_unchanged_dashboard_is_not_modified(self):
+        # The first page sets the CSRF cookie, which is part of the ETag
+        self.client.get(reverse('dashboard'))
+        etag = self.client.get(reverse('dashboard'))['ETag']
+        # Session, user, data version, and nothing else
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        Transaction.objects.create(user=self.user, amount=Decimal('9.99'), transaction_type='expense', description='coffee')
+        response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_first_visit_is_neither_conditional_nor_cached(self):
+        # The data version is created on the first visit, and nothing is keyed on it before then
+        self.client.force_login(User.objects.create_user(username='erin'))
+        self.assertNotIn('ETag', self.client.get(reverse('dashboard')))
+        response = self.client.get(reverse('dashboard'))
+        self.assertIn('ETag', response)
+        self.assertIn('budget_progress', response.context)
+
+    def test_budgets_saved_anywhere_change_the_dashboard(self):
+        self.client.get(reverse('dashboard'))
+        budget = Budget.objects.get(user=self.user, category__name='Food')
+        budget.amount = Decimal('650.00')
+        budget.save()
+        self.assertContains(self.client.get(reverse('dashboard')), '/ ₹650.00')
+        budget.delete()
+        self.assertNotContains(self.client.get(reverse('dashboard')), '/ ₹650.00')
+
+
+class AsyncDashboardTests(DashboardTestCase):
+    """The async dashboard renders the same page as the sync one."""
+    async def async_dashboard(self, user):
+        """The async dashboard's response and template context, with its work run on the test's thread."""
+        request = AsyncRequestFactory().get(reverse('dashboard'))
+        async def auser():
+            return user
+        request.auser = auser
+        contexts = []
+        def rendered(sender, context, **kwargs):
+            contexts.append(context)
+        template_rendered.connect(rendered)
+        try:
+            with self.settings(ASYNC_QUERY_THREADS=0, ASYNC_FORECAST_THREADS=0):
+                response = await AsyncDashboardView.as_view()(request)
+        finally:
+            template_rendered.disconnect(rendered)
+        return response, contexts[0] if contexts else None
+
+    async def test_async_dashboard_matches_sync_dashboard(self):
+        await self.async_client.aforce_login(self.user)
+        expected = (await self.async_client.get(reverse('dashboard'))).context
+        # So the async view computes every section too
+        await cache.aclear()
+        response, context = await self.async_dashboard(self.user)
+        self.assertEqual(response.status_code, 200)
+        for key in ('transactions', 'chart_labels', 'chart_data', 'budget_progress', 'forecasted_spending'):
+            self.assertEqual(context[key], expected[key], key)
+
+    async def test_async_dashboard_requires_login(self):
+        response, _ = await self.async_dashboard(AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('login')))
+
+
+@override_settings(STORAGES=TEST_STORAGES, FORECAST_WORKER=False, METRICS_TOKEN='scrape-token')
+class MetricsViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bob', password='secret-password')
+
+    def test_metrics_require_staff_or_token(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    def test_metrics_report_requests_by_view(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('dashboard'))
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('finsight_request_duration_seconds_count{view="dashboard"}', body)
+        self.assertIn('finsight_requests_total{view="dashboard",status="200"}', body)
+        self.assertIn('finsight_request_db_queries_bucket{view="dashboard",le="+Inf"}', body)
+
+
+@override_settings(DATABASE_ROUTERS=['finsight_project.db_routing.ReplicaRouter'])
+class ReplicaRouterTests(SimpleTestCase):
+    """Only analytic reads go to the replica, and never reads that could miss the caller's own writes."""
+    def test_reads_inside_replica_reads_go_to_the_replica(self):
+        self.assertEqual(router.db_for_read(Transaction), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Transaction), 'replica')
+            # Sessions and users are always read from the primary
+            self.assertEqual(router.db_for_read(User), 'default')
+            self.assertEqual(router.db_for_write(Transaction), 'default')
+            # Read-your-writes: the model just written to is read from the primary from now on
+            self.assertEqual(router.db_for_read(Transaction), 'default')
+            self.assertEqual(router.db_for_read(DailySpend), 'replica')
+        self.assertEqual(router.db_for_read(DailySpend), 'default')
+
+    def test_forecast_worker_reads_the_primary(self):
+        # Its forecast is stored as current, so it must see the write that queued its job
+        seen = []
+        def forecast(forecaster):
+            seen.append(router.db_for_read(DailySpend))
+            raise RuntimeError('Nothing to store')
+        with mock.patch.object(SpendingForecaster, 'forecast_next_30_days', forecast), replica_reads():
+            with self.assertRaises(RuntimeError):
+                store_forecast(user_id=1)
+            self.assertEqual(router.db_for_read(DailySpend), 'replica')
+        self.assertEqual(seen, ['default'])
+
+    def test_replica_gets_no_migrations(self):
+        self.assertTrue(router.allow_migrate('default', 'transactions'))
+        self.assertFalse(router.allow_migrate('replica', 'transactions'))
+
+
+@override_settings(DATABASE_ROUTERS=['finsight_project.db_routing.ReplicaRouter'])
+class ReplicaRouterTransactionTests(TestCase):
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        # Each test runs in a transaction on the primary, which the replica can't see into
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Transaction), 'default')
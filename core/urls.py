@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import DashboardView, SignUpView
+from finsight_project.async_views import choose_view
+from .views import AsyncDashboardView, DashboardView, MetricsView, SignUpView
 
 urlpatterns = [
-    path('', DashboardView.as_view(), name='dashboard'),
+    path('', choose_view(DashboardView, AsyncDashboardView), name='dashboard'),
     path('signup/', SignUpView.as_view(), name='signup'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -1,15 +1,41 @@
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from django.utils.safestring import mark_safe
 from django.urls import reverse_lazy
 from django.views import View
 from django.contrib.auth.forms import UserCreationForm
 from django.views.generic.edit import CreateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from transactions.models import Transaction
-from django.db.models import Sum
+from django.db.models import Count, Exists, Max, OuterRef, Sum
+import asyncio
 import json
-from django.utils import timezone
-from transactions.models import Budget
-from transactions.forecaster import SpendingForecaster
+from transactions.budgets import budgets_for_month
+from transactions.conditional import ConditionalGetMixin
+from transactions.models import DailySpend, ForecastJob, ForecastResult
+from transactions.forecaster import SpendingForecaster, format_fingerprint, rollup_checksum
+from finsight_project import metrics
+from finsight_project.async_views import AsyncLoginRequiredMixin, run_forecast, run_query
+from finsight_project.db_routing import ReplicaReadsMixin
+
+DEFAULT_DASHBOARD_FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+def fragment_cache():
+    # The one the {% cache %} tag uses
+    try:
+        return caches['template_fragments']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+async def _cached(value):
+    # Stands in for a step whose section is already cached
+    return value
 
 
 class SignUpView(CreateView):
@@ -21,36 +47,166 @@ class SignUpView(CreateView):
         success_url = reverse_lazy('login')
         template_name = 'registration/signup.html'
 
-class DashboardView(LoginRequiredMixin, View):
+class DashboardView(ReplicaReadsMixin, LoginRequiredMixin, ConditionalGetMixin, View):
+    """
+    The dashboard. It answers 304 Not Modified while the user's data is unchanged (see
+    transactions/conditional.py), and the chart and budget sections are cached per data version,
+    so a section that is cached isn't computed again.
+    """
     def get(self, request):
-        transactions = Transaction.objects.filter(user=request.user)
+        user = request.user
+        fragments = self.cached_fragments(user)
+        spending, fingerprint = self.spending_totals(user) if self.needs_totals(fragments) else (None, None)
+        # This month's budgets with their spending, from the monthly counters in one query
+        budgets = budgets_for_month(user) if 'budgets' not in fragments else None
+        projections = self.projections(user, budgets, fingerprint)
+        forecast = self.forecast(user, fingerprint)
+        transactions = self.recent_transactions(user)
+        return self.render_dashboard(request, spending, budgets, projections, forecast, transactions, fragments)
 
-        # --- Chart Data ---
-        spending_by_category = (
-            Transaction.objects.filter(user=request.user, transaction_type='expense')
-            .values('category__name')
-            .annotate(total=Sum('amount'))
-            .order_by('-total')
+    def fragment_keys(self, user):
+        """The cache keys of the chart and budget sections, as the template's {% cache %} tags make them."""
+        return {
+            'chart': make_template_fragment_key('dashboard_chart', [user.pk, self.data_version]),
+            # This month's budgets and their projections depend on the date too
+            'budgets': make_template_fragment_key('dashboard_budgets', [user.pk, self.data_version, self.today]),
+        }
+
+    def cached_fragments(self, user):
+        """{section: HTML} for the sections already cached for this data version."""
+        if self.data_version is None:
+            return {}
+        keys = self.fragment_keys(user)
+        # Fetched here rather than left to the template, so they can't expire between the two
+        cached = fragment_cache().get_many(keys.values())
+        return {section: mark_safe(cached[key]) for section, key in keys.items() if key in cached}
+
+    def needs_totals(self, fragments):
+        # The chart shows them, and without a worker their fingerprint keys the projections and the forecast
+        return 'chart' not in fragments or not settings.FORECAST_WORKER
+
+    def spending_totals(self, user):
+        """(totals per category, fingerprint)"""
+        # --- Spending Totals ---
+        # One pass over the daily rollup gives the all-time totals for the chart and the summary
+        # the forecast cache is keyed on. Its cost depends on days and categories, not transactions.
+        spending = list(
+            DailySpend.objects.filter(user=user)
+            .values('category_id', 'category__name')
+            .annotate(
+                spent=Sum('total'),
+                expense_count=Sum('count'),
+                buckets=Count('id'),
+                last_date=Max('date'),
+                checksum=rollup_checksum(),
+            )
+            .order_by('-spent')
+        )
+        # Summarizes the expense data; cached forecasts and projections are keyed on it
+        fingerprint = format_fingerprint(
+            buckets=sum(item['buckets'] for item in spending),
+            count=sum(item['expense_count'] for item in spending),
+            total=sum(item['spent'] for item in spending),
+            last_date=max((item['last_date'] for item in spending), default=None),
+            checksum=sum(item['checksum'] or 0 for item in spending),
         )
-        chart_labels = [item['category__name'] if item['category__name'] else 'Uncategorized' for item in spending_by_category]
-        chart_data = [float(item['total']) for item in spending_by_category]
+        return spending, fingerprint
 
-        # --- Budget Data with Color Warning Logic ---
-        now = timezone.now()
-        start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        budgets = Budget.objects.filter(user=request.user, amount__gt=0).select_related('category')
-        
-        monthly_spending = (
-            Transaction.objects.filter(user=request.user, transaction_type='expense', date__gte=start_of_month)
-            .values('category__name')
-            .annotate(total_spent=Sum('amount'))
+    def projections(self, user, budgets, fingerprint):
+        """Month-end spending per category, projected for all categories at once."""
+        if not budgets:
+            return {}
+        if settings.FORECAST_WORKER:
+            # Stored with the forecast, so no model is fitted here; ones from an earlier day are
+            # shown until the worker has redone them
+            stored = self.stored_forecast(user)
+            projections = stored.projections_for(self.today) if stored else None
+            if stored and stored.projected_on != self.today and not stored.stale and not stored.failed:
+                ForecastJob.enqueue(user.pk)
+            return projections or {}
+        return SpendingForecaster.month_end_projections_for_user(user, fingerprint=fingerprint)
+
+    def stored_forecast(self, user):
+        """
+        The user's ForecastResult, with whether it is being recomputed as `stale` and whether the
+        worker gave up recomputing it as `failed`, read once per request.
+        """
+        if not hasattr(self, '_stored_forecast'):
+            jobs = ForecastJob.objects.filter(user=OuterRef('user'))
+            self._stored_forecast = (
+                ForecastResult.objects.filter(user=user)
+                .annotate(stale=Exists(jobs.filter(failed_at__isnull=True)),
+                          failed=Exists(jobs.filter(failed_at__isnull=False)))
+                .first()
+            )
+        return self._stored_forecast
+
+    def forecast(self, user, fingerprint):
+        """(forecasted spending, when it was computed, whether it is being recomputed, whether that failed)"""
+        # --- Forecasting Data ---
+        if settings.FORECAST_WORKER:
+            # The forecast_worker command keeps this up to date; we only read the stored result.
+            # If the worker gave up, the last stored one is shown as it is.
+            forecast = self.stored_forecast(user)
+            if forecast is None:
+                job = list(ForecastJob.objects.filter(user=user).values_list('failed_at', flat=True)[:1])
+                if not job:
+                    ForecastJob.enqueue(user.pk)
+                failed = bool(job and job[0])
+                return None, None, not failed, failed
+            return forecast.amount, forecast.computed_at, forecast.stale, forecast.failed
+        # Cached per user, and only recomputed when their expense data changes
+        return SpendingForecaster.forecast_for_user(user, fingerprint=fingerprint), None, False, False
+
+    def recent_transactions(self, user):
+        # --- Recent Transactions ---
+        # Limited in SQL, with the categories fetched in the same query
+        return list(
+            Transaction.objects.filter(user=user)
+            .select_related('category')
+            .order_by('-date', '-id')[:10]
         )
-        spending_map = {item['category__name']: item['total_spent'] for item in monthly_spending}
 
+    def render_dashboard(self, request, spending, budgets, projections, forecast, transactions, fragments):
+        """Renders the dashboard. `spending` and `budgets` are None when their sections are in `fragments`."""
+        forecasted_spending, forecast_updated_at, forecast_stale, forecast_failed = forecast
+
+        # --- Final Context ---
+        context = {
+            'transactions': transactions,
+            'forecasted_spending': forecasted_spending,
+            'forecast_updated_at': forecast_updated_at,
+            'forecast_stale': forecast_stale,
+            'forecast_failed': forecast_failed,
+            'fragments': fragments,
+            'data_version': self.data_version,
+            'today': self.today,
+            'fragment_timeout': self.fragment_timeout(),
+        }
+
+        # --- Chart Data ---
+        if spending is not None:
+            chart_labels = [item['category__name'] if item['category__name'] else 'Uncategorized' for item in spending]
+            chart_data = [float(item['spent']) for item in spending]
+            context['chart_labels'] = json.dumps(chart_labels)
+            context['chart_data'] = json.dumps(chart_data)
+
+        if budgets is not None:
+            context['budget_progress'] = self.budget_progress(budgets, projections)
+
+        return render(request, 'core/dashboard.html', context)
+
+    def fragment_timeout(self):
+        # Without a version to key them on, sections are rendered but not kept (0 never stores)
+        if self.data_version is None:
+            return 0
+        return getattr(settings, 'DASHBOARD_FRAGMENT_TIMEOUT', DEFAULT_DASHBOARD_FRAGMENT_TIMEOUT)
+
+    def budget_progress(self, budgets, projections):
+        # --- Budget Data with Color Warning Logic ---
         budget_progress = []
         for budget in budgets:
-            spent = spending_map.get(budget.category.name, 0)
+            spent = budget.spent
             percentage = (spent / budget.amount) * 100 if budget.amount > 0 else 0
             
             # THIS IS THE RESTORED LOGIC
@@ -61,26 +217,55 @@ class DashboardView(LoginRequiredMixin, View):
             else:
                 bar_color_class = 'success'
 
+            # The projection can't be below what has already been spent
+            projected = max(projections.get(budget.category_id, spent), spent)
             budget_progress.append({
                 'category_name': budget.category.name,
                 'budget_amount': budget.amount,
                 'spent_amount': spent,
                 'percentage': min(round(percentage, 2), 100),
-                'bar_color_class': bar_color_class # The class is correctly passed
+                'bar_color_class': bar_color_class, # The class is correctly passed
+                'projected_amount': projected,
+                'projected_overrun': max(projected - budget.amount, 0),
             })
+        return budget_progress
 
-        # --- Forecasting Data ---
-        forecaster = SpendingForecaster(transactions)
-        forecasted_spending = forecaster.forecast_next_30_days()
 
-        # --- Final Context ---
-        context = {
-            'transactions': transactions,
-            'chart_labels': json.dumps(chart_labels),
-            'chart_data': json.dumps(chart_data),
-            'budget_progress': budget_progress,
-            'forecasted_spending': forecasted_spending,
-        }
-        
-        return render(request, 'core/dashboard.html', context)
+class AsyncDashboardView(AsyncLoginRequiredMixin, DashboardView):
+    """
+    The dashboard for ASGI deployments. The spending totals, budgets and recent transactions
+    don't depend on each other and are fetched at the same time; the forecast and projections,
+    which need the totals' fingerprint, then run on the forecast pool, off the event loop
+    (or, with a forecast worker, are read from the row it stored).
+    """
+    async def get(self, request):
+        user = request.user
+        fragments = await run_query(self.cached_fragments, user)
+        (spending, fingerprint), budgets, transactions = await asyncio.gather(
+            run_query(self.spending_totals, user) if self.needs_totals(fragments) else _cached((None, None)),
+            run_query(budgets_for_month, user) if 'budgets' not in fragments else _cached(None),
+            run_query(self.recent_transactions, user),
+        )
+        if settings.FORECAST_WORKER:
+            # With a forecast worker, both come from the one stored forecast row
+            forecast = await run_query(self.forecast, user, fingerprint)
+            projections = await run_query(self.projections, user, budgets, fingerprint)
+        else:
+            projections, forecast = await asyncio.gather(
+                run_forecast(self.projections, user, budgets, fingerprint),
+                run_forecast(self.forecast, user, fingerprint),
+            )
+        return self.render_dashboard(request, spending, budgets, projections, forecast, transactions, fragments)
 
+
+class MetricsView(View):
+    """
+    Request, SQL and forecast metrics for this process, in the Prometheus text format.
+    Readable by staff users, or by a scraper sending METRICS_TOKEN as a bearer token.
+    """
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        authorization = request.headers.get('Authorization', '')
+        if not (request.user.is_staff or (token and constant_time_compare(authorization, f'Bearer {token}'))):
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
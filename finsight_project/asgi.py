@@ -3,6 +3,10 @@ ASGI config for finsight_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+To serve the app over ASGI with the async views, run it under uvicorn workers:
+
+    ASYNC_VIEWS=True gunicorn finsight_project.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -14,3 +18,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'finsight_project.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.FORECAST_PRELOAD:
+    # As in wsgi.py: under `gunicorn --preload` the forked workers share the forecasting libraries
+    from transactions.forecaster import preload_forecasting  # noqa: E402
+
+    preload_forecasting()
@@ -0,0 +1,100 @@
+"""
+Support for the async views served under ASGI (ASYNC_VIEWS=True, see asgi.py).
+
+Django's ORM is synchronous, so async views hand their queries to a bounded pool of threads
+with run_query(); independent queries can then run at the same time, each on its own database
+connection. Forecasts may fit a model for seconds, so run_forecast() gives them a separate, smaller
+pool: a burst of forecasts queues there without blocking the event loop or holding up queries.
+
+With a pool size of 0 the work runs on the request's own thread instead, one piece at a time.
+The tests use that, as other threads can't see the data of a test's open transaction.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import connections
+
+from . import metrics
+
+DEFAULT_ASYNC_QUERY_THREADS = 4
+DEFAULT_ASYNC_FORECAST_THREADS = 2
+
+# Created on first use, sized from the settings then
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(name, setting, default):
+    size = getattr(settings, setting, default)
+    if size <= 0:
+        return None
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'finsight-{name}')
+    return executor
+
+
+def _check_connections():
+    # Pool threads are few and long-lived, so they keep their connections from task to task,
+    # whatever CONN_MAX_AGE says, like a connection pool; one is only replaced once it fails
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None and connection.errors_occurred:
+            if connection.is_usable():
+                connection.errors_occurred = False
+            else:
+                connection.close()
+
+
+def _run(fn, args, kwargs):
+    _check_connections()
+    with metrics.collecting():
+        return fn(*args, **kwargs)
+
+
+async def _submit(executor, fn, args, kwargs):
+    if executor is None:
+        return await sync_to_async(fn)(*args, **kwargs)
+    # The context carries the request's metrics over to the pool thread
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _run, fn, args, kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def run_query(fn, *args, **kwargs):
+    """Runs fn(*args, **kwargs), which may use the ORM, on the query pool (ASYNC_QUERY_THREADS)."""
+    return await _submit(_executor('query', 'ASYNC_QUERY_THREADS', DEFAULT_ASYNC_QUERY_THREADS), fn, args, kwargs)
+
+
+async def run_forecast(fn, *args, **kwargs):
+    """Runs fn(*args, **kwargs), which may fit a forecast, on the forecast pool (ASYNC_FORECAST_THREADS)."""
+    return await _submit(_executor('forecast', 'ASYNC_FORECAST_THREADS', DEFAULT_ASYNC_FORECAST_THREADS), fn, args, kwargs)
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    """
+    LoginRequiredMixin for async views. Django 5.0's reads request.user synchronously, which
+    would load the session on the event loop; this loads the user with request.auser() first.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        return self._dispatch(request, *args, **kwargs)
+
+    async def _dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        response = super().dispatch(request, *args, **kwargs)
+        # A redirect to the login page, or the async handler's coroutine
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+
+def choose_view(sync_view, async_view, **initkwargs):
+    """The view to route: async_view when ASYNC_VIEWS is on, sync_view otherwise."""
+    view = async_view if getattr(settings, 'ASYNC_VIEWS', False) else sync_view
+    return view.as_view(**initkwargs)
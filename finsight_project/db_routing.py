@@ -0,0 +1,143 @@
+"""
+Optional read replica (DATABASE_REPLICA_URL) for the read-only analytic paths: the dashboard,
+with the forecasts it computes, the CSV export and search.
+
+Only reads inside replica_reads() go to the replica, and only for the apps in REPLICA_APPS, so
+sessions and users are always read from the primary. Everything else, and every write, uses the
+primary, as does work inside primary_reads(): the forecast worker and forecast_all store their
+results as current, so they must not read a lagging copy. A replica lags behind, so reads stay on the primary where they could miss a write:
+    - for the rest of a request or replica_reads() block, for models it has written to
+    - inside a transaction on the primary
+    - for DATABASE_REPLICA_PIN_SECONDS after a browser sent a change, which ReplicaPinMiddleware
+      remembers with a cookie
+
+Without a replica none of this is installed and everything uses the primary, as before.
+"""
+import asyncio
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA = 'replica'
+# Apps whose reads may go to the replica
+REPLICA_APPS = {'transactions'}
+PIN_COOKIE = 'finsight_db_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+DEFAULT_PIN_SECONDS = 10
+
+
+class RoutingState:
+    """Where the current request or replica_reads() block may read from. Shared with the async views' query threads."""
+    def __init__(self, pinned=False):
+        self.replica_reads = False
+        # Read everything from the primary, as the browser wrote recently
+        self.pinned = pinned
+        # Labels of the models written to so far
+        self.written = set()
+
+
+_state = contextvars.ContextVar('db_routing', default=None)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def _replica_reads(allowed):
+    state = _state.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = _state.set(state)
+    previous = state.replica_reads
+    state.replica_reads = allowed
+    try:
+        yield
+    finally:
+        state.replica_reads = previous
+        if token is not None:
+            _state.reset(token)
+
+
+def replica_reads():
+    """Lets the reads inside go to the replica, where it's safe to (see above)."""
+    return _replica_reads(True)
+
+
+def primary_reads():
+    """Keeps the reads inside on the primary, even within replica_reads()."""
+    return _replica_reads(False)
+
+
+class ReplicaRouter:
+    """Installed as DATABASE_ROUTERS when DATABASE_REPLICA_URL is set."""
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if (
+            state is not None and state.replica_reads and not state.pinned
+            and model._meta.app_label in REPLICA_APPS
+            and model._meta.label not in state.written
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA
+        # Said outright: otherwise Django falls back to the database an instance was read from
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.written.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary, by replication
+        return db != REPLICA
+
+
+class ReplicaPinMiddleware:
+    """
+    Keeps a browser's reads on the primary for DATABASE_REPLICA_PIN_SECONDS after it sends a
+    change (a POST, say) that writes to the replicated apps, so the user sees it straight away.
+    Not used without a replica.
+    """
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RoutingState(pinned=PIN_COOKIE in request.COOKIES)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        # GETs write too, e.g. forecast bookkeeping, but only what the user sends changes what they see
+        if request.method not in SAFE_METHODS and any(label.split('.')[0] in REPLICA_APPS for label in state.written):
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS),
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class ReplicaReadsMixin:
+    """Runs a class-based view, sync or async, inside replica_reads()."""
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._replica_dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+    async def _replica_dispatch(self, request, *args, **kwargs):
+        with replica_reads():
+            response = super().dispatch(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
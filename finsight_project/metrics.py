@@ -0,0 +1,239 @@
+"""
+In-process request metrics, exposed in the Prometheus text format at /metrics.
+
+Like the forecast cache counters, metrics are kept per process: with several workers, each
+one reports its own, and Prometheus should scrape (or sum over) every worker.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('finsight.slow_requests')
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# How many statements a slow-request log entry shows, and how much of each
+SLOW_LOG_MAX_QUERIES = 50
+SLOW_LOG_MAX_SQL_LENGTH = 500
+
+
+class Histogram:
+    """A Prometheus histogram with optional labels. Observations are O(buckets) under a lock."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(self.labels, label_values, le=bound)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}'
+            yield f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_values, value in sorted(snapshot.items()):
+            yield f'{self.name}{_labels(self.labels, label_values)} {value}'
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+REQUEST_SECONDS = Histogram('finsight_request_duration_seconds', 'Wall time per request, by view.', SECONDS_BUCKETS, ('view',))
+REQUESTS = Counter('finsight_requests_total', 'Requests, by view and status code.', ('view', 'status'))
+DB_SECONDS = Histogram('finsight_request_db_seconds', 'Time spent in SQL per request, by view.', SECONDS_BUCKETS, ('view',))
+DB_QUERIES = Histogram('finsight_request_db_queries', 'SQL queries per request, by view.', QUERY_COUNT_BUCKETS, ('view',))
+FORECAST_SECONDS = Histogram('finsight_forecast_duration_seconds', 'Time per forecast, by engine.', SECONDS_BUCKETS, ('engine',))
+FORECAST_ERRORS = Counter('finsight_forecast_errors_total', 'Forecasts that failed, by engine.', ('engine',))
+FORECAST_CACHE = Counter('finsight_forecast_cache_lookups_total', 'Forecast cache lookups, by view and result.',
+                         ('view', 'result'))
+SLOW_REQUESTS = Counter('finsight_slow_requests_total', 'Requests over METRICS_SLOW_REQUEST_SECONDS, by view.', ('view',))
+
+REGISTRY = [REQUEST_SECONDS, REQUESTS, DB_SECONDS, DB_QUERIES, FORECAST_SECONDS, FORECAST_ERRORS, FORECAST_CACHE, SLOW_REQUESTS]
+
+
+class RequestMetrics:
+    """
+    What one request spent its time on. Collected by MetricsMiddleware, and thread-safe, as
+    async views run a request's queries on several threads at once.
+    """
+    def __init__(self, capture_sql):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.forecast_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.capture_sql = capture_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper(), so it sees every query
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.queries += 1
+                self.db_seconds += elapsed
+                if self.capture_sql and len(self.statements) < SLOW_LOG_MAX_QUERIES:
+                    self.statements.append((elapsed, sql))
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def record_forecast(engine, seconds, failed=False):
+    """Called by the forecaster for every forecast, inside a request or not."""
+    FORECAST_SECONDS.observe(seconds, engine)
+    if failed:
+        FORECAST_ERRORS.inc(1, engine)
+    current = _current.get()
+    if current is not None:
+        current.add(forecast_seconds=seconds)
+
+
+def record_cache_lookup(hit):
+    """Called by the forecast cache on every lookup; counted per view at the end of the request."""
+    current = _current.get()
+    if current is not None:
+        if hit:
+            current.add(cache_hits=1)
+        else:
+            current.add(cache_misses=1)
+
+
+@contextmanager
+def collecting(metrics=None):
+    """
+    Counts the queries made on this thread towards `metrics`, by default the current request's
+    (none, outside a request). Database connections are per thread, so code that queries from
+    another thread on behalf of a request uses this there.
+    """
+    metrics = metrics or _current.get()
+    with ExitStack() as stack:
+        if metrics is not None:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(metrics))
+        yield metrics
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """
+    Records wall time, SQL query count and time, and forecast time for every request, by view.
+    Requests slower than METRICS_SLOW_REQUEST_SECONDS (off unless set) are logged with their SQL.
+
+    It is synchronous on purpose: under ASGI, Django runs it on the request's own thread, the one
+    that also serves the session and auth queries. Queries that async views run on the pools in
+    async_views.py are counted there.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        slow_after = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', None)
+        metrics = RequestMetrics(capture_sql=slow_after is not None)
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with collecting(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        REQUEST_SECONDS.observe(elapsed, view)
+        REQUESTS.inc(1, view, response.status_code)
+        DB_SECONDS.observe(metrics.db_seconds, view)
+        DB_QUERIES.observe(metrics.queries, view)
+        if metrics.cache_hits:
+            FORECAST_CACHE.inc(metrics.cache_hits, view, 'hit')
+        if metrics.cache_misses:
+            FORECAST_CACHE.inc(metrics.cache_misses, view, 'miss')
+        if slow_after is not None and elapsed >= slow_after:
+            SLOW_REQUESTS.inc(1, view)
+            self._log_slow(request, response, view, elapsed, metrics)
+        return response
+
+    def _log_slow(self, request, response, view, elapsed, metrics):
+        lines = [
+            f'Slow request: {request.method} {request.path} ({view}) -> {response.status_code} '
+            f'in {elapsed * 1000:.0f} ms: {metrics.queries} queries in {metrics.db_seconds * 1000:.0f} ms, '
+            f'forecasting {metrics.forecast_seconds * 1000:.0f} ms '
+            f'({metrics.cache_hits} cache hits, {metrics.cache_misses} misses)'
+        ]
+        for seconds, sql in metrics.statements:
+            lines.append(f'  {seconds * 1000:8.2f} ms  {sql[:SLOW_LOG_MAX_SQL_LENGTH]}')
+        if metrics.queries > len(metrics.statements):
+            lines.append(f'  ... {metrics.queries - len(metrics.statements)} more')
+        logger.warning('\n'.join(lines))
@@ -28,6 +28,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'finsight_project.metrics.MetricsMiddleware',
+    # Only used with a read replica (DATABASE_REPLICA_URL)
+    'finsight_project.db_routing.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -49,7 +53,55 @@ TEMPLATES = [
     },
 ]
 WSGI_APPLICATION = 'finsight_project.wsgi.application'
-DATABASES = {'default': dj_database_url.config(default=f'sqlite:///{BASE_DIR / "db.sqlite3"}')}
+# Connections are kept for this many seconds (0: one per request) and checked before each request reuses them
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DATABASES = {'default': dj_database_url.config(default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
+                                               conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True)}
+# An optional read replica of DATABASE_URL for the dashboard, CSV export and search (see db_routing.py)
+DATABASE_REPLICA_URL = config('DATABASE_REPLICA_URL', default='')
+if DATABASE_REPLICA_URL:
+    # Tests use the primary for both
+    DATABASES['replica'] = dj_database_url.parse(DATABASE_REPLICA_URL, conn_max_age=DB_CONN_MAX_AGE,
+                                                 conn_health_checks=True, test_options={'MIRROR': 'default'})
+    DATABASE_ROUTERS = ['finsight_project.db_routing.ReplicaRouter']
+# After a request writes, that browser reads from the primary for this many seconds, so it sees its own changes
+DATABASE_REPLICA_PIN_SECONDS = config('DATABASE_REPLICA_PIN_SECONDS', default=10, cast=int)
+
+# Cache used for forecasts. LocMemCache is per process; point this at a shared backend to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'finsight',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+FORECAST_CACHE_TIMEOUT = config('FORECAST_CACHE_TIMEOUT', default=6 * 60 * 60, cast=int)
+# The dashboard's chart and budget sections are cached per user and data version for this long
+DASHBOARD_FRAGMENT_TIMEOUT = config('DASHBOARD_FRAGMENT_TIMEOUT', default=24 * 60 * 60, cast=int)
+# When True, forecasts are computed by `manage.py forecast_worker` and the dashboard only reads the stored result
+FORECAST_WORKER = config('FORECAST_WORKER', default=False, cast=bool)
+# Without the worker, Apply Rules on the Smart Rules page checks at most this many transactions per run
+APPLY_RULES_MAX_SYNC_ROWS = config('APPLY_RULES_MAX_SYNC_ROWS', default=100_000, cast=int)
+# 'sarimax', 'fast' (NumPy exponential smoothing) or 'auto', which picks by history length
+FORECAST_ENGINE = config('FORECAST_ENGINE', default='auto')
+FORECAST_AUTO_SARIMAX_MIN_DAYS = config('FORECAST_AUTO_SARIMAX_MIN_DAYS', default=730, cast=int)
+# Saved SARIMAX models are extended with new days, and fully refitted after this many days
+FORECAST_FULL_REFIT_DAYS = config('FORECAST_FULL_REFIT_DAYS', default=7, cast=int)
+# Import the forecasting libraries when the WSGI app loads instead of on the first forecast (see wsgi.py)
+FORECAST_PRELOAD = config('FORECAST_PRELOAD', default=False, cast=bool)
+# Fall back to a classifier learned from each user's categorized transactions when no keyword rule matches
+CATEGORIZER_CLASSIFIER = config('CATEGORIZER_CLASSIFIER', default=True, cast=bool)
+# Log requests slower than this many seconds, with their SQL (unset: off)
+METRICS_SLOW_REQUEST_SECONDS = config('METRICS_SLOW_REQUEST_SECONDS', default='',
+                                      cast=lambda value: float(value) if value != '' else None)
+# Lets a scraper read /metrics with "Authorization: Bearer <token>"; staff users can always read it
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Serve the async views, which fetch independent data concurrently. For ASGI deployments (see asgi.py)
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+# Threads per process that async views run queries on; each can hold a database connection
+ASYNC_QUERY_THREADS = config('ASYNC_QUERY_THREADS', default=4, cast=int)
+# Threads per process that async views compute forecasts on, so at most this many fit at once
+ASYNC_FORECAST_THREADS = config('ASYNC_FORECAST_THREADS', default=2, cast=int)
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
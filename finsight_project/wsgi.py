@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'finsight_project.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.FORECAST_PRELOAD:
+    # Under `gunicorn --preload` this runs once in the master, and the forked workers share the memory
+    from transactions.forecaster import preload_forecasting  # noqa: E402
+
+    preload_forecasting()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TransactionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transactions'
+
+    def ready(self):
+        # Connect the model signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,178 @@
+"""
+Budgets by month. A month's budget for a category is the one set for that month, or else the
+standing one; spending comes from the MonthlySpend counters, never from transactions.
+"""
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Budget, Category, DataVersion, MonthlySpend
+from .rollups import month_start
+from .signals import bulk_writes
+
+DEFAULT_HISTORY_MONTHS = 12
+MAX_HISTORY_MONTHS = 36
+# Budget.amount has 10 digits, 2 of them after the point
+MAX_AMOUNT = Decimal('99999999.99')
+
+
+class BudgetPlanError(ValueError):
+    """Raised when budgets can't be saved. The message is safe to show to the user."""
+
+
+def add_months(month, months):
+    """The first day of the month `months` months after `month` (before, if negative)."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(value):
+    """'YYYY-MM' -> the first day of that month. Raises ValueError for anything else."""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def parse_amount(value):
+    """A budget amount from a form or JSON: a number from 0 to MAX_AMOUNT, rounded to cents."""
+    try:
+        amount = Decimal(str(value))
+        # NaN would pass quantize() and then fail the range check below with InvalidOperation
+        if not amount.is_finite():
+            raise InvalidOperation
+        amount = amount.quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise BudgetPlanError(f"'{value}' is not a valid amount.")
+    if not 0 <= amount <= MAX_AMOUNT:
+        raise BudgetPlanError(f'Amounts must be between 0 and {MAX_AMOUNT}.')
+    return amount
+
+
+def _in_effect(budgets):
+    """{category_id: budget}, preferring each category's budget for the month over the standing one."""
+    chosen = {}
+    for budget in budgets:
+        if budget.month is not None or budget.category_id not in chosen:
+            chosen[budget.category_id] = budget
+    return chosen
+
+
+def save_budgets(user, plan):
+    """
+    Saves many budgets in one go. `plan` is an iterable of (category_id, month, amount): month is
+    the first day of a month, or None for the standing budget, and amount a Decimal, or None to
+    remove that budget. A later entry for the same category and month wins.
+
+    The categories are checked in one query, and everything is written in one transaction with
+    a few statements: for removals one SELECT and a DELETE per 100 rows (Django
+    collects them for the delete signals), one INSERT ... ON CONFLICT DO UPDATE for month budgets,
+    and for standing budgets, whose NULL month can't be a conflict target, one bulk UPDATE and one
+    INSERT, plus one to bump the user's DataVersion. Returns (saved, removed).
+    """
+    entries = {(int(category_id), month): amount for category_id, month, amount in plan}
+    if not entries:
+        return 0, 0
+    category_ids = {category_id for category_id, _ in entries}
+    owned = set(Category.objects.filter(user=user, pk__in=category_ids).values_list('pk', flat=True))
+    if category_ids - owned:
+        raise BudgetPlanError(f'Unknown categories: {", ".join(map(str, sorted(category_ids - owned)))}.')
+
+    removals, months, standing = {}, [], {}
+    for (category_id, month), amount in entries.items():
+        if amount is None:
+            removals.setdefault(month, []).append(category_id)
+        elif month is None:
+            standing[category_id] = amount
+        else:
+            months.append(Budget(user=user, category_id=category_id, month=month, amount=amount))
+
+    removed = 0
+    try:
+        with transaction.atomic(), bulk_writes():
+            if removals:
+                # One condition per month rather than per entry, so the statement stays shallow
+                removed, _ = Budget.objects.filter(user=user).filter(reduce(or_, (
+                    Q(month=month, category_id__in=category_ids) for month, category_ids in removals.items()
+                ))).delete()
+            if months:
+                Budget.objects.bulk_create(months, update_conflicts=True, unique_fields=['user', 'category', 'month'],
+                                           update_fields=['amount'])
+            if standing:
+                existing = list(Budget.objects.select_for_update().filter(
+                    user=user, month__isnull=True, category_id__in=standing))
+                for budget in existing:
+                    budget.amount = standing.pop(budget.category_id)
+                Budget.objects.bulk_update(existing, ['amount'])
+                Budget.objects.bulk_create(
+                    Budget(user=user, category_id=category_id, amount=amount) for category_id, amount in standing.items()
+                )
+            DataVersion.bump(user.pk)
+    except IntegrityError:
+        # Another request created one of the standing budgets at the same time
+        raise BudgetPlanError('The budgets were changed while saving. Please try again.')
+    return sum(amount is not None for amount in entries.values()), removed
+
+
+def budgets_with_spending(user, month):
+    """
+    The query behind budgets_for_month(): the user's standing budgets and their budgets for
+    `month` (the first day of a month), by category name, each with that month's spending as `spent`.
+    """
+    spent = MonthlySpend.objects.filter(user=OuterRef('user'), category=OuterRef('category'), month=month).values('total')
+    return (
+        Budget.objects.filter(user=user).filter(Q(month=month) | Q(month__isnull=True))
+        .select_related('category')
+        .annotate(spent=Coalesce(Subquery(spent), Value(Decimal(0)), output_field=DecimalField()))
+        .order_by('category__name')
+    )
+
+
+def budgets_for_month(user, month=None):
+    """
+    The user's budgets in effect for `month` (default: this month), by category name, each with
+    that month's spending as `spent`. One query; budgets of 0 (not tracked that month) are left out.
+    """
+    budgets = budgets_with_spending(user, month_start(month or timezone.localdate()))
+    return [budget for budget in _in_effect(budgets).values() if budget.amount > 0]
+
+
+def budget_history(user, months=DEFAULT_HISTORY_MONTHS, until=None):
+    """
+    Budget versus actual spending for the `months` months up to `until` (default: this month),
+    oldest first, for every category with a budget in that time:
+    [{'month': date, 'categories': [{'category_id', 'category_name', 'budget', 'spent'}, ...]}, ...].
+    'budget' is None for months the category had no budget. Two queries, whatever the number of transactions.
+    """
+    last = month_start(until or timezone.localdate())
+    first = add_months(last, -(months - 1))
+    budgets = list(
+        Budget.objects.filter(user=user).filter(Q(month__range=(first, last)) | Q(month__isnull=True))
+        .select_related('category')
+    )
+    standing = {budget.category_id: budget.amount for budget in budgets if budget.month is None}
+    own = {(budget.category_id, budget.month): budget.amount for budget in budgets if budget.month is not None}
+    categories = sorted({(budget.category.name, budget.category_id) for budget in budgets if budget.amount > 0})
+    spent = {
+        (category_id, month): total
+        for category_id, month, total in MonthlySpend.objects.filter(
+            user=user, month__range=(first, last), category_id__in=[category_id for _, category_id in categories],
+        ).values_list('category_id', 'month', 'total')
+    }
+
+    history = []
+    for offset in range(months):
+        month = add_months(first, offset)
+        history.append({'month': month, 'categories': [
+            {
+                'category_id': category_id,
+                'category_name': name,
+                'budget': own.get((category_id, month), standing.get(category_id)) or None,
+                'spent': spent.get((category_id, month), Decimal('0.00')),
+            }
+            for name, category_id in categories
+        ]})
+    return history
@@ -1,3 +1,11 @@
+import threading
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import classifier as learned
+from .models import Category, Keyword, RulesVersion
+
 # This is our default, fallback dictionary
 DEFAULT_KEYWORD_TO_CATEGORY = {
         'zomato': 'Food', 'swiggy': 'Food', 'restaurant': 'Food',
@@ -9,7 +17,78 @@ DEFAULT_KEYWORD_TO_CATEGORY = {
         'pharmacy': 'Health', 'apollo': 'Health',
         'salary': 'Salary',
     }
-    
+
+# Rough cap on the total number of automaton states kept in the process-level cache.
+# A state costs a few hundred bytes, so the default keeps the cache in the tens of MB.
+DEFAULT_CACHE_MAX_STATES = 100_000
+
+_NO_MATCH = float('inf')
+
+
+class KeywordMatcher:
+        """
+        An Aho-Corasick automaton compiled from a list of (keyword, value) pairs.
+
+        The pairs are given in priority order. match() scans the text once and returns the
+        value of the highest-priority keyword found anywhere in it, so the cost depends on the
+        length of the text and not on how many keywords were compiled.
+        """
+        def __init__(self, keywords):
+            self._goto = [{}]
+            self._fail = [0]
+            self._values = []
+            own = [_NO_MATCH]
+
+            # --- STEP 1: Build the keyword trie, remembering the best priority ending at each state ---
+            for priority, (text, value) in enumerate(keywords):
+                state = 0
+                for char in text:
+                    next_state = self._goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(self._goto)
+                        self._goto[state][char] = next_state
+                        self._goto.append({})
+                        self._fail.append(0)
+                        own.append(_NO_MATCH)
+                    state = next_state
+                own[state] = min(own[state], priority)
+                self._values.append(value)
+
+            # --- STEP 2: Breadth-first pass to add failure links ---
+            # Each state's best priority also covers every keyword that is a suffix of it.
+            self._best = own[:]
+            queue = deque(self._goto[0].values())
+            for state in queue:
+                self._best[state] = min(own[state], self._best[0])
+            while queue:
+                state = queue.popleft()
+                for char, child in self._goto[state].items():
+                    fallback = self._fail[state]
+                    while fallback and char not in self._goto[fallback]:
+                        fallback = self._fail[fallback]
+                    self._fail[child] = self._goto[fallback].get(char, 0)
+                    self._best[child] = min(own[child], self._best[self._fail[child]])
+                    queue.append(child)
+
+        def __len__(self):
+            """The number of automaton states, used to size the cache."""
+            return len(self._goto)
+
+        def match(self, text):
+            goto, fail, best_at = self._goto, self._fail, self._best
+            state = 0
+            best = best_at[0]
+            for char in text:
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                if best_at[state] < best:
+                    best = best_at[state]
+                    if best == 0:
+                        break
+            return None if best == _NO_MATCH else self._values[best]
+
+
 class TransactionCategorizer:
         def __init__(self, user_categories, user_keywords):
             """
@@ -19,22 +98,119 @@ class TransactionCategorizer:
             self.category_map = {category.name.lower(): category.id for category in user_categories}
             # Note the structure: keyword text maps to the category NAME
             self.user_keyword_map = {keyword.text.lower(): keyword.category.name.lower() for keyword in user_keywords}
-    
-        def suggest_category(self, description):
-            description_lower = description.lower()
-    
-            # --- STEP 1: Check User's Custom Rules First ---
+            self.matcher = KeywordMatcher(self._compiled_rules())
+            # Set by for_user(); enables the learned fallback for descriptions no rule matches
+            self.user_id = None
+
+        def __len__(self):
+            """The number of automaton states, used to size the cache."""
+            return len(self.matcher)
+
+        @classmethod
+        def for_user(cls, user):
+            """
+            Returns the categorizer for a user, reusing the compiled one from the process-level
+            cache unless the user's rules version has moved on since it was built.
+            """
+            version = RulesVersion.current(user.pk)
+            categorizer = _categorizer_cache.get(user.pk, version)
+            if categorizer is None:
+                categorizer = cls(
+                    Category.objects.filter(user=user).only('id', 'name'),
+                    Keyword.objects.filter(user=user).select_related('category').only('text', 'category__name'),
+                )
+                categorizer.user_id = user.pk
+                _categorizer_cache.put(user.pk, version, categorizer)
+            return categorizer
+
+        def _compiled_rules(self):
+            """
+            Flattens both rule sets into one priority-ordered list of (keyword, category id).
+            Rules pointing at a category the user doesn't have can never match, so they are dropped.
+            """
+            # --- User's Custom Rules First ---
             for keyword, category_name in self.user_keyword_map.items():
-                if keyword in description_lower:
-                    if category_name in self.category_map:
-                        return self.category_map[category_name]
-    
-            # --- STEP 2: If no custom match, check Default Rules ---
+                if category_name in self.category_map:
+                    yield keyword, self.category_map[category_name]
+
+            # --- Then the Default Rules ---
             for keyword, category_name in DEFAULT_KEYWORD_TO_CATEGORY.items():
-                if keyword in description_lower:
-                    if category_name.lower() in self.category_map:
-                        return self.category_map[category_name.lower()]
-            
-            return None
-    
+                if category_name.lower() in self.category_map:
+                    yield keyword, self.category_map[category_name.lower()]
+
+        def suggest_category(self, description):
+            return self.suggest_categories([description])[0]
+
+        def suggest_categories(self, descriptions, use_classifier=True):
+            """
+            Suggests a category for every description in one pass over the batch.
+            Returns a list of category ids (or None) in the same order as the input.
+            Descriptions no rule matches go to the user's learned classifier, if they have one,
+            unless use_classifier is False.
+            """
+            match = self.matcher.match
+            suggestions = [match(description.lower()) for description in descriptions]
+            if use_classifier and None in suggestions and self.user_id is not None and learned.enabled():
+                classifier = learned.load_classifier(self.user_id)
+                if classifier is not None:
+                    allowed = set(self.category_map.values())
+                    for i, description in enumerate(descriptions):
+                        if suggestions[i] is None:
+                            suggestions[i] = classifier.predict(description, allowed)
+            return suggestions
+
+
+class CategorizerCache:
+        """
+        A thread-safe LRU cache of compiled categorizers, one per user, tagged with the rules
+        version it was built from. Least recently used users are evicted once the total number
+        of automaton states goes over `max_states`.
+
+        Anything with a len() can be cached the same way; the learned classifiers use a second
+        instance, sized in count cells.
+        """
+        def __init__(self, max_states=None, setting='CATEGORIZER_CACHE_MAX_STATES', default=DEFAULT_CACHE_MAX_STATES):
+            self.max_states = max_states
+            self.setting = setting
+            self.default = default
+            self._entries = OrderedDict()
+            self._states = 0
+            self._lock = threading.Lock()
+
+        def _limit(self):
+            if self.max_states is not None:
+                return self.max_states
+            return getattr(settings, self.setting, self.default)
+
+        def get(self, user_id, version):
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is None or entry[0] != version:
+                    return None
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        def put(self, user_id, version, categorizer):
+            with self._lock:
+                self._discard(user_id)
+                self._entries[user_id] = (version, categorizer)
+                self._states += len(categorizer)
+                limit = self._limit()
+                while self._states > limit and len(self._entries) > 1:
+                    self._discard(next(iter(self._entries)))
+
+        def clear(self):
+            with self._lock:
+                self._entries.clear()
+                self._states = 0
+
+        def _discard(self, user_id):
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self._states -= len(entry[1])
+
 
+_categorizer_cache = CategorizerCache()
+_classifier_cache = CategorizerCache(
+    setting='CLASSIFIER_CACHE_MAX_CELLS', default=learned.DEFAULT_CLASSIFIER_CACHE_MAX_CELLS,
+)
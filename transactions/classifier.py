@@ -0,0 +1,324 @@
+import json
+import math
+import re
+import struct
+import zlib
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .models import CategoryClassifier, ClassifierChange, Transaction
+
+# Character n-grams are hashed into this many buckets, so a model's size doesn't depend on the vocabulary
+N_BUCKETS = 1 << 14
+NGRAM_SIZES = (3, 4)
+# Additive smoothing for the per-category n-gram counts
+SMOOTHING = 0.1
+
+# A prediction is only made once the model has seen this many transactions...
+DEFAULT_CLASSIFIER_MIN_EXAMPLES = 20
+# ...and only returned when the best category is at least this likely...
+DEFAULT_CLASSIFIER_MIN_CONFIDENCE = 0.6
+# ...and has seen at least this share of the description's n-grams. Probabilities are relative,
+# so without this a description unlike anything seen before still gets a confident guess.
+DEFAULT_CLASSIFIER_MIN_OVERLAP = 0.1
+# Rough cap on the count cells (categories x N_BUCKETS, 4 bytes each) kept in the process-level cache
+DEFAULT_CLASSIFIER_CACHE_MAX_CELLS = 16_000_000
+# Saved transactions are queued as ClassifierChanges and folded into the stored model this many at a time
+DEFAULT_CLASSIFIER_FOLD_CHANGES = 100
+
+_DIGITS = re.compile(r'\d+')
+_SPACES = re.compile(r'\s+')
+_HEADER = struct.Struct('<I')
+
+
+def features(text):
+    """
+    The hashed character n-grams of a description, with their counts. Runs of digits are
+    collapsed, since reference numbers and dates say nothing about the category.
+    """
+    text = ' ' + _SPACES.sub(' ', _DIGITS.sub('0', text.lower())).strip() + ' '
+    encoded = text.encode()
+    return Counter(
+        zlib.crc32(encoded[i:i + n]) & (N_BUCKETS - 1)
+        for n in NGRAM_SIZES for i in range(len(encoded) - n + 1)
+    )
+
+
+class NaiveBayesClassifier:
+    """
+    A multinomial naive Bayes model over hashed character n-grams. Counts are kept as one
+    dense array per category, so learning and forgetting a transaction are a few increments
+    and the model serializes to one compact blob.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.totals = {}
+        self.documents = {}
+
+    def __len__(self):
+        """The number of count cells, used to size the cache."""
+        return len(self.counts) * N_BUCKETS
+
+    @property
+    def examples(self):
+        return sum(self.documents.values())
+
+    def learn(self, text, category_id, weight=1):
+        """Adds a categorized description to the model. A weight of -1 takes it out again."""
+        if category_id is None:
+            return
+        counts = self.counts.get(category_id)
+        if counts is None:
+            if weight < 0:
+                return
+            counts = self.counts[category_id] = array('I', bytes(4 * N_BUCKETS))
+            self.totals[category_id] = 0
+            self.documents[category_id] = 0
+        grams = features(text)
+        for bucket, n in grams.items():
+            counts[bucket] = max(counts[bucket] + weight * n, 0)
+        self.totals[category_id] = max(self.totals[category_id] + weight * sum(grams.values()), 0)
+        self.documents[category_id] = max(self.documents[category_id] + weight, 0)
+        if self.documents[category_id] == 0:
+            self.forget(category_id)
+
+    def with_changes(self, changes):
+        """
+        A copy of the model that has also learned `changes`, (description, category_id, weight)
+        tuples. Only the count arrays the changes touch are copied; this model is left as it is.
+        """
+        changes = list(changes)
+        copy = NaiveBayesClassifier()
+        copy.counts = dict(self.counts)
+        copy.totals = dict(self.totals)
+        copy.documents = dict(self.documents)
+        for category_id in {category_id for _, category_id, _ in changes} & copy.counts.keys():
+            copy.counts[category_id] = array('I', copy.counts[category_id])
+        for description, category_id, weight in changes:
+            copy.learn(description, category_id, weight)
+        return copy
+
+    def forget(self, category_id):
+        self.counts.pop(category_id, None)
+        self.totals.pop(category_id, None)
+        self.documents.pop(category_id, None)
+
+    def probabilities(self, text, allowed=None):
+        """{category_id: probability} over the categories the model knows (and, if given, `allowed`)."""
+        categories = [c for c in self.counts if self.documents[c] and (allowed is None or c in allowed)]
+        if not categories:
+            return {}
+        grams = features(text).items()
+        log = math.log
+        all_documents = sum(self.documents[c] for c in categories)
+        scores = {}
+        for category_id in categories:
+            counts = self.counts[category_id]
+            denominator = log(self.totals[category_id] + SMOOTHING * N_BUCKETS)
+            score = log(self.documents[category_id] / all_documents)
+            for bucket, n in grams:
+                score += n * (log(counts[bucket] + SMOOTHING) - denominator)
+            scores[category_id] = score
+        top = max(scores.values())
+        weights = {category_id: math.exp(score - top) for category_id, score in scores.items()}
+        total = sum(weights.values())
+        return {category_id: weight / total for category_id, weight in weights.items()}
+
+    def predict(self, text, allowed=None):
+        """The most likely category id, or None if the model isn't trained or confident enough."""
+        if self.examples < getattr(settings, 'CLASSIFIER_MIN_EXAMPLES', DEFAULT_CLASSIFIER_MIN_EXAMPLES):
+            return None
+        probabilities = self.probabilities(text, allowed)
+        if not probabilities:
+            return None
+        category_id, probability = max(probabilities.items(), key=lambda item: item[1])
+        if probability < getattr(settings, 'CLASSIFIER_MIN_CONFIDENCE', DEFAULT_CLASSIFIER_MIN_CONFIDENCE):
+            return None
+        grams = features(text)
+        counts = self.counts[category_id]
+        seen = sum(n for bucket, n in grams.items() if counts[bucket])
+        if seen < getattr(settings, 'CLASSIFIER_MIN_OVERLAP', DEFAULT_CLASSIFIER_MIN_OVERLAP) * sum(grams.values()):
+            return None
+        return category_id
+
+    def to_bytes(self):
+        """A header with the per-category totals, then the count arrays, all zlib-compressed."""
+        categories = list(self.counts)
+        header = json.dumps({
+            'buckets': N_BUCKETS,
+            'ngrams': NGRAM_SIZES,
+            'categories': categories,
+            'totals': [self.totals[c] for c in categories],
+            'documents': [self.documents[c] for c in categories],
+        }).encode()
+        body = b''.join(self.counts[c].tobytes() for c in categories)
+        # Level 1: the arrays are mostly zeros, which compress well even at the fastest level
+        return zlib.compress(_HEADER.pack(len(header)) + header + body, 1)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Loads a model saved by to_bytes(). A model saved with other settings loads as an empty one."""
+        classifier = cls()
+        if not data:
+            return classifier
+        raw = zlib.decompress(data)
+        (header_length,) = _HEADER.unpack_from(raw)
+        header = json.loads(raw[_HEADER.size:_HEADER.size + header_length])
+        if header['buckets'] != N_BUCKETS or tuple(header['ngrams']) != NGRAM_SIZES:
+            return classifier
+        offset = _HEADER.size + header_length
+        for category_id, total, documents in zip(header['categories'], header['totals'], header['documents']):
+            counts = array('I')
+            counts.frombytes(raw[offset:offset + 4 * N_BUCKETS])
+            offset += 4 * N_BUCKETS
+            classifier.counts[category_id] = counts
+            classifier.totals[category_id] = total
+            classifier.documents[category_id] = documents
+        return classifier
+
+
+# --- Storage ---
+
+def enabled():
+    return getattr(settings, 'CATEGORIZER_CLASSIFIER', True)
+
+
+def _queued_changes(user_id):
+    return list(
+        ClassifierChange.objects.filter(user_id=user_id).order_by('id')
+        .values_list('id', 'description', 'category_id', 'weight')
+    )
+
+
+def load_classifier(user_id):
+    """
+    Returns the user's classifier with their queued changes learned, or None if they don't have
+    one yet. The stored model is decoded once per version and kept in a process-level cache; the
+    queued changes are learned by a copy, and once there are CLASSIFIER_FOLD_CHANGES of them
+    they are folded into the stored model.
+    """
+    from .categorizer import _classifier_cache
+
+    version = CategoryClassifier.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+    queued = _queued_changes(user_id)
+    if len(queued) >= getattr(settings, 'CLASSIFIER_FOLD_CHANGES', DEFAULT_CLASSIFIER_FOLD_CHANGES):
+        version, classifier = _rewrite(user_id, [])
+        _classifier_cache.put(user_id, version, classifier)
+        return classifier
+    if version is None:
+        classifier = NaiveBayesClassifier() if queued else None
+    else:
+        classifier = _classifier_cache.get(user_id, version)
+        if classifier is None:
+            data = CategoryClassifier.objects.filter(user_id=user_id).values_list('data', flat=True).first()
+            classifier = NaiveBayesClassifier.from_bytes(bytes(data or b''))
+            _classifier_cache.put(user_id, version, classifier)
+    if queued:
+        classifier = classifier.with_changes(change[1:] for change in queued)
+    return classifier
+
+
+def _rewrite(user_id, changes):
+    """
+    One read-modify-write of the user's stored model, under its row lock: learns the queued
+    changes, then `changes`, and removes the queued changes it folded in. Returns (version, model).
+    """
+    with transaction.atomic():
+        stored, _ = CategoryClassifier.objects.select_for_update().get_or_create(user_id=user_id, defaults={'data': b''})
+        # Read once the lock is held, so no other rewrite can fold them in as well
+        queued = _queued_changes(user_id)
+        classifier = NaiveBayesClassifier.from_bytes(bytes(stored.data))
+        for _, description, category_id, weight in queued:
+            classifier.learn(description, category_id, weight)
+        for description, category_id, weight in changes:
+            classifier.learn(description, category_id, weight)
+        stored.data = classifier.to_bytes()
+        stored.version += 1
+        stored.save(update_fields=['data', 'version', 'updated_at'])
+        if queued:
+            ClassifierChange.objects.filter(user_id=user_id, id__lte=queued[-1][0]).delete()
+    return stored.version, classifier
+
+
+def update_classifier(user_id, changes):
+    """
+    Applies a batch of changes, e.g. from a bulk import, to the user's stored classifier in one
+    read-modify-write, along with any queued ones. `changes` is an iterable of
+    (description, category_id, weight): weight 1 learns a transaction, -1 unlearns it.
+    """
+    changes = [change for change in changes if change[1] is not None]
+    if changes:
+        _rewrite(user_id, changes)
+
+
+def learn_change(old, new):
+    """
+    Moves a transaction from what the model learned before to what it is now. `old` and `new` are
+    dicts with 'user_id', 'description' and 'category_id' (None unless the user chose the
+    category); `old` is None for a new transaction and `new` is None for a deleted one.
+
+    The change is only queued, with one INSERT, so saves neither lock nor rewrite the stored model.
+    """
+    if old and new and (old['description'], old['category_id']) == (new['description'], new['category_id']):
+        return
+    changes = []
+    if old:
+        changes.append((old['description'], old['category_id'], -1))
+    if new:
+        changes.append((new['description'], new['category_id'], 1))
+    ClassifierChange.objects.bulk_create(
+        ClassifierChange(user_id=(old or new)['user_id'], description=description, category_id=category_id, weight=weight)
+        for description, category_id, weight in changes if category_id is not None
+    )
+
+
+def learn_transactions(user_id, transactions):
+    """Learns a batch of new transactions, e.g. from bulk_create, in one update. Suggested categories are skipped."""
+    update_classifier(user_id, ((t.description, t.category_id, 1) for t in transactions if t.category_source == 'user'))
+
+
+def forget_category(category):
+    """
+    Drops a category from the user's model. Called when the category is deleted, which also
+    deletes its queued changes.
+    """
+    with transaction.atomic():
+        stored = CategoryClassifier.objects.select_for_update().filter(user_id=category.user_id).first()
+        if stored is None:
+            return
+        classifier = NaiveBayesClassifier.from_bytes(bytes(stored.data))
+        if category.pk in classifier.counts:
+            classifier.forget(category.pk)
+            stored.data = classifier.to_bytes()
+            stored.version += 1
+            stored.save(update_fields=['data', 'version', 'updated_at'])
+
+
+def train_classifier(user_id):
+    """
+    Replaces the user's classifier with one trained from scratch on the transactions whose
+    category the user chose, so it never learns from its own (or the rules') suggestions.
+    """
+    # Changes queued before the scan below are part of it, so they are dropped; later ones stay queued
+    scanned = ClassifierChange.objects.filter(user_id=user_id).aggregate(last=Max('id'))['last']
+    classifier = NaiveBayesClassifier()
+    labeled = (
+        Transaction.objects.filter(user_id=user_id, category__isnull=False, category_source='user')
+        .values_list('description', 'category_id')
+    )
+    for description, category_id in labeled.iterator(chunk_size=2000):
+        classifier.learn(description, category_id)
+    with transaction.atomic():
+        stored, created = CategoryClassifier.objects.select_for_update().get_or_create(
+            user_id=user_id, defaults={'data': classifier.to_bytes()})
+        if not created:
+            stored.data = classifier.to_bytes()
+            stored.version += 1
+            stored.save(update_fields=['data', 'version', 'updated_at'])
+        if scanned is not None:
+            ClassifierChange.objects.filter(user_id=user_id, id__lte=scanned).delete()
+    return classifier
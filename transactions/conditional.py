@@ -0,0 +1,99 @@
+"""
+Conditional GETs for the dashboard and the JSON data endpoints.
+
+Each user's DataVersion counter is bumped by every write to their transactions, budgets,
+categories, keywords or stored forecast. ConditionalGetMixin builds a view's ETag and
+Last-Modified from it, so a browser that asks again with If-None-Match gets a 304 Not Modified,
+after one small query and without the view running at all, for as long as nothing has changed.
+
+Besides the data, a response depends on:
+    - the date: this month's budgets, projections and the budget history move with it, so the
+      validators change daily
+    - the CSRF secret, as pages embed a token made from it: logging in again, which rotates it,
+      never reuses a page
+The version is read before the view reads anything, and from the database it reads its data from
+(the read replica under ReplicaReadsMixin), so what it renders is at least that new. A counter
+that database doesn't have yet is created on the primary, and until it has the row, responses
+carry no validators and the dashboard caches no fragments.
+"""
+import asyncio
+from calendar import timegm
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import salted_hmac
+from django.utils.http import http_date
+
+from finsight_project.async_views import run_query
+
+from .models import DataVersion
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+class ConditionalGetMixin:
+    """
+    Answers a GET with 304 Not Modified when the user's data hasn't changed since the response
+    the browser already has. Goes after LoginRequiredMixin. The view can read the version it was
+    checked against from self.data_version (None when there was none to check against), and the
+    date from self.today.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in CONDITIONAL_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._async_conditional_dispatch(request, *args, **kwargs)
+        validators = self._validators(request)
+        response = self._not_modified(request, validators)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self._add_validators(response, validators)
+
+    async def _async_conditional_dispatch(self, request, *args, **kwargs):
+        validators = await run_query(self._validators, request)
+        response = self._not_modified(request, validators)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        return self._add_validators(response, validators)
+
+    def _validators(self, request):
+        """
+        (ETag, Last-Modified as a timestamp) for the user's current data, or None when the
+        database the view reads from has no counter for them yet.
+        """
+        self.today = timezone.localdate()
+        # A plain read, so it is routed like the view's own reads (get_or_create always uses the primary)
+        counter = DataVersion.objects.filter(user_id=request.user.pk).only('version', 'updated_at').first()
+        if counter is None:
+            DataVersion.for_user(request.user.pk)
+            self.data_version = None
+            return None
+        self.data_version = counter.version
+        digest = salted_hmac(
+            'finsight.conditional', f"{request.user.pk}:{self.today}:{request.META.get('CSRF_COOKIE', '')}",
+        ).hexdigest()[:16]
+        # Weak: an unchanged page is the same page, but not byte for byte ("updated 5 minutes ago")
+        etag = f'W/"{counter.version}-{digest}"'
+        start_of_day = timezone.make_aware(datetime.combine(self.today, time.min))
+        # Only to the second, but browsers send If-None-Match as well, and it takes precedence
+        last_modified = timegm(max(counter.updated_at, start_of_day).utctimetuple())
+        return etag, last_modified
+
+    def _not_modified(self, request, validators):
+        if validators is None:
+            return None
+        etag, last_modified = validators
+        return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    def _add_validators(self, response, validators):
+        # Error responses get no validators, so they are never what a 304 stands for
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response.headers.setdefault('ETag', etag)
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+            # Per user, and always checked with us first rather than reused on a guess
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,112 @@
+import re
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Transaction
+
+TRANSACTION_TYPES = dict(Transaction.TRANSACTION_TYPE_CHOICES)
+
+# ASCII digits only: str.isdigit() also accepts ones like '²', which int() can't parse. Longer
+# numbers are out of range for every parameter anyway.
+DIGITS = re.compile(r'[0-9]{1,18}')
+
+
+class TransactionFilterError(ValueError):
+    """Raised when a query parameter can't be parsed. The message is safe to show to the user."""
+
+
+def parse_int(value, message, minimum=0, maximum=None):
+    """
+    `value` as an int from `minimum` to `maximum` (inclusive; None for no upper limit).
+    Raises TransactionFilterError with `message` for anything else.
+    """
+    if not DIGITS.fullmatch(value):
+        raise TransactionFilterError(message)
+    number = int(value)
+    if number < minimum or (maximum is not None and number > maximum):
+        raise TransactionFilterError(message)
+    return number
+
+
+def parse_bool(value, message):
+    """
+    `value` as a bool: '1', 'true', 'yes' or 'on' for True, '0', 'false', 'no', 'off' or empty for
+    False, in any case. Raises TransactionFilterError with `message` for anything else.
+    """
+    value = value.lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('', '0', 'false', 'no', 'off'):
+        return False
+    raise TransactionFilterError(message)
+
+
+def _date_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise TransactionFilterError(f"'{name}' must be a date in YYYY-MM-DD format.")
+    return parsed
+
+
+def _amount_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise TransactionFilterError(f"'{name}' must be a number.")
+    return amount
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_transactions(queryset, params):
+    """
+    Applies the optional filters shared by our list endpoints to a Transaction queryset:
+        start, end: YYYY-MM-DD, both inclusive
+        type: 'expense' or 'income'
+        category: a category id, or 'none' for uncategorized transactions
+        min_amount, max_amount: numbers, both inclusive
+    Dates are turned into a half-open datetime range so the filter can use an index on date.
+    """
+    start = _date_param(params, 'start')
+    end = _date_param(params, 'end')
+    if start:
+        queryset = queryset.filter(date__gte=_start_of_day(start))
+    if end:
+        queryset = queryset.filter(date__lt=_start_of_day(end + timedelta(days=1)))
+
+    transaction_type = params.get('type')
+    if transaction_type:
+        if transaction_type not in TRANSACTION_TYPES:
+            raise TransactionFilterError("'type' must be 'expense' or 'income'.")
+        queryset = queryset.filter(transaction_type=transaction_type)
+
+    category = params.get('category')
+    if category:
+        if category == 'none':
+            queryset = queryset.filter(category__isnull=True)
+        else:
+            queryset = queryset.filter(category_id=parse_int(category, "'category' must be a category id or 'none'."))
+
+    min_amount = _amount_param(params, 'min_amount')
+    max_amount = _amount_param(params, 'max_amount')
+    if min_amount is not None:
+        queryset = queryset.filter(amount__gte=min_amount)
+    if max_amount is not None:
+        queryset = queryset.filter(amount__lte=max_amount)
+    return queryset
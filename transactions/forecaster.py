@@ -1,38 +1,415 @@
-import pandas as pd
-import statsmodels.api as sm
+import calendar
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import Count, DecimalField, F, Max, Sum
 from django.utils import timezone
 import warnings
 
+from finsight_project.db_routing import primary_reads
+from finsight_project.metrics import record_cache_lookup, record_forecast
+
+from .models import DailySpend, DataVersion, ForecastModelState, ForecastResult
+
+logger = logging.getLogger(__name__)
+
 # Ignore warnings from statsmodels for cleaner output
 warnings.filterwarnings("ignore")
 
+# How long a cached forecast is kept, in seconds, if FORECAST_CACHE_TIMEOUT isn't set
+DEFAULT_FORECAST_CACHE_TIMEOUT = 6 * 60 * 60
+
+
+class ForecastCacheStats:
+        """
+        Hit/miss counters for the forecast cache. They are kept per process, like the rest of
+        our in-memory metrics, so a multi-worker deployment has one set per worker.
+        """
+        def __init__(self):
+            self.hits = 0
+            self.misses = 0
+            self._lock = threading.Lock()
+
+        def record(self, hit):
+            with self._lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            record_cache_lookup(hit)
+
+        def snapshot(self):
+            with self._lock:
+                total = self.hits + self.misses
+                return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+forecast_cache_stats = ForecastCacheStats()
+
+
+def _generation_key(user_id):
+    return f'forecast-generation:{user_id}'
+
+
+def _forecast_generation(user_id):
+    """
+    Returns the user's current forecast generation, which is part of every cache key.
+    A fresh generation is time based, so it can't collide with one that was evicted.
+    """
+    generation = cache.get(_generation_key(user_id))
+    if generation is None:
+        cache.add(_generation_key(user_id), time.time_ns(), timeout=None)
+        generation = cache.get(_generation_key(user_id))
+    return generation
+
+
+def invalidate_forecast(user_id):
+    """
+    Makes every cached forecast for the user unreachable in this process (or everywhere, with a
+    shared cache). Called when a transaction changes; other processes notice the change by the
+    expense fingerprint instead.
+    """
+    cache.set(_generation_key(user_id), time.time_ns(), timeout=None)
+
+
+def rollup_checksum():
+    """
+    An aggregate of the daily rollup rows weighted by their ids. Moving spending from one day or
+    category to another changes it, even when both rows already exist and the totals stay the same.
+    """
+    return Sum(F('total') * F('id'), output_field=DecimalField(max_digits=30, decimal_places=2))
+
+
+def expense_fingerprint(user_id):
+    """
+    A summary of the user's expense data, computed in a single aggregate query over the daily
+    rollup, which is all forecasts and projections are made from. It changes whenever the
+    rollup does, so a process sees a change made by any other, without a shared cache.
+    """
+    # Not aliased 'total', which would hide the column from the checksum
+    summary = DailySpend.objects.filter(user_id=user_id).aggregate(
+        buckets=Count('id'), count=Sum('count'), spent=Sum('total'), last_date=Max('date'), checksum=rollup_checksum(),
+    )
+    return format_fingerprint(total=summary.pop('spent'), **summary)
+
+
+def format_fingerprint(buckets, count, total, last_date, checksum):
+    """
+    Builds the fingerprint from rollup totals. Callers that already aggregate the rollup, like
+    the dashboard, use this directly to save the extra query.
+    """
+    last_date = last_date.isoformat() if last_date else ''
+    return f"{buckets}-{count or 0}-{(total or 0):.2f}-{last_date}-{(checksum or 0):.2f}"
+
+
+def store_forecast(user_id):
+    """
+    Computes a fresh forecast and month-end projections for the user and saves them as their
+    ForecastResult. Used by the forecast worker, off the request path.
+
+    The history is read from the primary: the result is stored as current and its job finished,
+    so a replica that hasn't caught up with the write that queued the job would leave a forecast
+    of the old data showing as fresh.
+    """
+    started = time.perf_counter()
+    today = timezone.localdate()
+    with primary_reads():
+        forecaster = SpendingForecaster(DailySpend.objects.filter(user_id=user_id), user_id=user_id)
+        forecast = forecaster.forecast_next_30_days()
+        projections = forecaster.month_end_projections(today)
+    result, _ = ForecastResult.objects.update_or_create(user_id=user_id, defaults={
+        'amount': None if forecast is None else round(float(forecast), 2),
+        'computed_at': timezone.now(),
+        'fit_seconds': time.perf_counter() - started,
+        'projections': ForecastResult.pack_projections(projections),
+        'projected_on': today,
+    })
+    # The dashboard shows it
+    DataVersion.bump(user_id)
+    return result
+
+
+# --- Scientific stack ---
+# NumPy, pandas and statsmodels take hundreds of milliseconds and tens of MB to import, and most
+# requests never forecast, so they are imported inside the functions that use them.
+
+def preload_forecasting():
+    """
+    Imports everything forecasting needs up front. Call it in a process that forks workers (e.g. the
+    gunicorn master with --preload, or before starting a process pool), so the workers share the memory.
+    """
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+    from statsmodels.tsa.statespace import sarimax  # noqa: F401
+
+
+# --- Forecasting engines ---
+# 'sarimax' fits a seasonal ARIMA model, 'fast' runs seasonal_smoothing_forecast() and 'auto'
+# picks one by series length (see SpendingForecaster.engine_for)
+FORECAST_ENGINES = ('sarimax', 'fast', 'auto')
+DEFAULT_FORECAST_ENGINE = 'auto'
+# In 'auto' mode, histories shorter than this use the fast engine. bench_forecast found it as accurate
+# as SARIMAX at every length at about 1% of the cost, so SARIMAX is kept for the longest histories only.
+DEFAULT_AUTO_SARIMAX_MIN_DAYS = 730
+
+# (alpha, gamma) pairs tried by the fast engine: level and weekly-pattern smoothing weights
+SMOOTHING_GRID = [(alpha, gamma) for alpha in (0.05, 0.1, 0.2, 0.3, 0.5) for gamma in (0.05, 0.1, 0.2)]
+# The fast engine only looks at the most recent days. With alpha >= 0.05, older days carry almost no weight anyway.
+SMOOTHING_HISTORY_DAYS = 365
+
+
+def seasonal_smoothing_forecast(values, steps=30, season=7):
+    """
+    Forecasts `steps` days with additive weekly-seasonal exponential smoothing (Holt-Winters
+    without a trend), using only NumPy. Every (alpha, gamma) pair in SMOOTHING_GRID is run at
+    once as arrays, and the one with the lowest one-step-ahead squared error is used.
+
+    `values` is one series, or a 2-D array with one series per row. Rows are fitted together in
+    the same pass over the days, so many series cost little more than one.
+    """
+    import numpy as np
+
+    y = np.asarray(values, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)[:, -SMOOTHING_HISTORY_DAYS:]
+    series, days = y.shape
+    alpha = np.array([a for a, _ in SMOOTHING_GRID])
+    gamma = np.array([g for _, g in SMOOTHING_GRID]) * (1 - alpha)
+
+    # Start from the first week: its mean as the level, and each day's difference from it as the pattern.
+    # level and sse are (series, grid); seasonal is (series, grid, season).
+    first_week = y[:, :season]
+    first_mean = first_week.mean(axis=1, keepdims=True)
+    level = np.repeat(first_mean, len(SMOOTHING_GRID), axis=1)
+    seasonal = np.repeat((first_week - first_mean)[:, None, :], len(SMOOTHING_GRID), axis=1)
+    sse = np.zeros((series, len(SMOOTHING_GRID)))
+    for t in range(season, days):
+        day = t % season
+        error = y[:, t, None] - level - seasonal[:, :, day]
+        sse += error * error
+        level += alpha * error
+        seasonal[:, :, day] += gamma * error
+
+    rows, best = np.arange(series), sse.argmin(axis=1)
+    forecast = level[rows, best][:, None] + seasonal[rows, best][:, (days + np.arange(steps)) % season]
+    # Spending can't be negative
+    forecast = np.clip(forecast, 0, None)
+    return forecast[0] if single else forecast
+
+
+# --- SARIMAX warm starts ---
+# Bumped when the SARIMAX orders or the saved state layout change, so old states are refitted
+MODEL_STATE_VERSION = 1
+# Saved states are discarded for a full refit after this many days
+DEFAULT_FULL_REFIT_DAYS = 7
+# A full refit also happens when the new days fit this much worse (mean log-likelihood per day) than the last full fit
+DEFAULT_REFIT_TOLERANCE = 1.0
+# Fewer new days than this are too noisy to judge fit quality on
+MIN_DAYS_FOR_QUALITY_CHECK = 7
+
+
+def _sarimax(data, **kwargs):
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    # The (7) at the end tells the model to look for a weekly (7-day) pattern.
+    return SARIMAX(data,
+                   order=(1, 1, 1),
+                   seasonal_order=(1, 1, 0, 7),
+                   enforce_stationarity=False,
+                   enforce_invertibility=False,
+                   **kwargs)
+
+
+def _model_state(daily_data, results, full_fit_at, quality):
+    """
+    What a later forecast needs to continue from `results` (see ForecastModelState): the parameters,
+    and the filter state before the last day, which is often still incomplete and is processed again.
+    The history before that day is summarized so that edits to it can be detected.
+    """
+    history = daily_data[:-1]
+    return {
+        'version': MODEL_STATE_VERSION,
+        'params': [float(value) for value in results.params],
+        'state': results.predicted_state[:, -2].tolist(),
+        'state_cov': results.predicted_state_cov[:, :, -2].tolist(),
+        'start': daily_data.index[0].date().isoformat(),
+        'history_days': len(history),
+        'history_total': round(float(history.sum()), 2),
+        'quality': quality,
+        'full_fit_at': full_fit_at.isoformat(),
+    }
+
+
+def daily_series(dates, totals):
+    """
+    Builds the daily spending series the models are fitted on from per-day totals in date order.
+    The days with no spending are filled in with 0.
+    """
+    if not dates:
+        return None
+    import pandas as pd
+
+    daily_spending = pd.Series([float(total) for total in totals], index=pd.DatetimeIndex(dates))
+    # .asfreq('D') adds the days with no spending, and fill_value=0 makes them 0 instead of NaN.
+    return daily_spending.asfreq('D', fill_value=0.0)
+
+
+def project_month_end(rows, today):
+    """
+    Projects each category's total spending for the month of `today` from its recent daily totals,
+    [(category_id, date, total)] for up to SMOOTHING_HISTORY_DAYS days up to and including today:
+    {category_id: Decimal}, as SpendingForecaster.month_end_projections() describes.
+    Needs no database access, so it can run in a worker process (see fit_forecasts).
+    """
+    import numpy as np
+
+    start_of_month = today.replace(day=1)
+    days_left = calendar.monthrange(today.year, today.month)[1] - today.day
+    if not rows:
+        return {}
+
+    # One row per category and one column per day, up to and including today
+    categories = list({category_id for category_id, _, _ in rows})
+    row_of = {category_id: row for row, category_id in enumerate(categories)}
+    first_day = min(day for _, day, _ in rows)
+    daily = np.zeros((len(categories), (today - first_day).days + 1))
+    for category_id, day, total in rows:
+        daily[row_of[category_id], (day - first_day).days] = float(total)
+
+    # Today isn't over, so fit on the days before it and take today's spending so far as a floor for today
+    history, spent_today = daily[:, :-1], daily[:, -1]
+    if history.shape[1] >= 14:
+        forecast = seasonal_smoothing_forecast(history, steps=days_left + 1)
+    else:
+        # Too little history for a weekly pattern: assume the average day so far
+        average_day = history.mean(axis=1) if history.shape[1] else spent_today
+        forecast = np.repeat(average_day[:, None], days_left + 1, axis=1)
+    month_to_date = daily[:, max((start_of_month - first_day).days, 0):].sum(axis=1)
+    projected = month_to_date - spent_today + np.maximum(spent_today, forecast[:, 0]) + forecast[:, 1:].sum(axis=1)
+    return {category_id: Decimal(f'{amount:.2f}') for category_id, amount in zip(categories, projected)}
+
+
+def fit_forecasts(batch, engine=None, today=None):
+    """
+    Forecasts a batch of users: [(user_id, dates, totals, model_state, recent_rows)] ->
+    [(user_id, forecast, fit_seconds, error, new_model_state, projections)], where recent_rows
+    are the user's project_month_end() rows for `today`, and new_model_state is None if the saved
+    one (which may be None) is still current.
+    Needs no database access, so it can run in a worker process (see the forecast_all command).
+    """
+    forecaster = SpendingForecaster(engine=engine)
+    today = today or timezone.localdate()
+    results = []
+    for user_id, dates, totals, model_state, recent_rows in batch:
+        started = time.perf_counter()
+        forecaster.model_state = model_state
+        try:
+            forecast, error = forecaster.forecast_series(daily_series(dates, totals), raise_errors=True), None
+            projections = project_month_end(recent_rows, today)
+        except Exception as e:
+            forecast, projections, error = None, None, f'{type(e).__name__}: {e}'
+        if forecast is not None:
+            forecast = round(float(forecast), 2)
+        new_state = forecaster.model_state if forecaster.model_state is not model_state else None
+        results.append((user_id, forecast, time.perf_counter() - started, error, new_state, projections))
+    return results
+
+
 class SpendingForecaster:
-        def __init__(self, transactions_queryset):
+        def __init__(self, daily_spend_queryset=None, engine=None, user_id=None):
+            """
+            Initializes the forecaster with the user's spending data.
+            'daily_spend_queryset' should be a queryset of the user's DailySpend rows,
+            the per-day expense totals that are kept up to date as transactions change.
+            It can be left out when series are passed to forecast_series() directly.
+            'engine' is one of FORECAST_ENGINES; it defaults to the FORECAST_ENGINE setting.
+            With 'user_id', forecast_next_30_days() saves the fitted SARIMAX model in the user's
+            ForecastModelState, and later forecasts continue from it instead of fitting from scratch.
+            """
+            self.daily_spend = daily_spend_queryset
+            self.user_id = user_id
+            # The saved SARIMAX model forecast_series() starts from, and replaces after a fit
+            self.model_state = None
+            self.engine = engine or getattr(settings, 'FORECAST_ENGINE', DEFAULT_FORECAST_ENGINE)
+            if self.engine not in FORECAST_ENGINES:
+                raise ValueError(f"Unknown forecast engine '{self.engine}'.")
+
+        @classmethod
+        def forecast_for_user(cls, user, fingerprint=None):
+            """
+            Returns forecast_next_30_days() for a user, served from Django's cache when neither the
+            user's expense fingerprint nor (in this process) their forecast generation has changed
+            since it was computed.
+            Pass `fingerprint` if it was already computed with format_fingerprint().
+            """
+            if fingerprint is None:
+                fingerprint = expense_fingerprint(user.pk)
+            forecaster = cls(DailySpend.objects.filter(user=user), user_id=user.pk)
+            key = f'forecast:{user.pk}:{_forecast_generation(user.pk)}:{forecaster.engine}:{fingerprint}'
+            cached = cache.get(key)
+            forecast_cache_stats.record(hit=cached is not None)
+            if cached is not None:
+                return cached['forecast']
+
+            forecast = forecaster.forecast_next_30_days()
+            if forecast is not None:
+                forecast = float(forecast)
+            # Wrapped in a dict so that "no forecast possible" is cached too
+            timeout = getattr(settings, 'FORECAST_CACHE_TIMEOUT', DEFAULT_FORECAST_CACHE_TIMEOUT)
+            cache.set(key, {'forecast': forecast}, timeout=timeout)
+            return forecast
+
+        @classmethod
+        def month_end_projections_for_user(cls, user, fingerprint=None):
+            """
+            Returns month_end_projections() for a user, cached like forecast_for_user() and
+            also keyed on the date, as projections move on every day.
+            """
+            if fingerprint is None:
+                fingerprint = expense_fingerprint(user.pk)
+            today = timezone.localdate()
+            key = f'projections:{user.pk}:{_forecast_generation(user.pk)}:{today.isoformat()}:{fingerprint}'
+            projections = cache.get(key)
+            if projections is None:
+                projections = cls(DailySpend.objects.filter(user=user)).month_end_projections(today)
+                timeout = getattr(settings, 'FORECAST_CACHE_TIMEOUT', DEFAULT_FORECAST_CACHE_TIMEOUT)
+                cache.set(key, projections, timeout=timeout)
+            return projections
+
+        def month_end_projections(self, today=None):
             """
-            Initializes the forecaster with the user's transaction data.
-            'transactions_queryset' should be a queryset of the user's Transaction objects.
+            Projects each category's total spending for the current month: {category_id: Decimal},
+            with None for uncategorized spending. This is the spending so far plus a forecast of the
+            rest of the month.
+
+            Every category's daily series comes from one query on the rollup, and they are all fitted
+            together by seasonal_smoothing_forecast(), so the cost grows very little with the number of
+            categories.
             """
-            # We only care about expenses for forecasting spending
-            self.expenses = transactions_queryset.filter(transaction_type='expense').order_by('date')
+            today = today or timezone.localdate()
+            rows = list(
+                self.daily_spend.filter(date__gt=today - timedelta(days=SMOOTHING_HISTORY_DAYS), date__lte=today)
+                .values_list('category_id', 'date', 'total')
+            )
+            return project_month_end(rows, today)
 
         def _prepare_daily_data(self):
             """
-            Transforms the raw transaction data into a daily spending time series using pandas.
+            Turns the daily rollup into a daily spending time series using pandas.
             """
-            if not self.expenses.exists():
+            # The rollup already holds one row per category and day; add up the categories
+            rows = list(self.daily_spend.values('date').annotate(day_total=Sum('total')).order_by('date')
+                        .values_list('date', 'day_total'))
+            if not rows:
                 return None
-
-            # Convert queryset to a pandas DataFrame
-            df = pd.DataFrame(list(self.expenses.values('date', 'amount')))
-            df['date'] = pd.to_datetime(df['date'])
-            df.set_index('date', inplace=True)
-            
-            # Resample the data into daily totals. 'D' means daily frequency.
-            # .sum() adds up all expenses for a given day.
-            # .fillna(0) fills in days with no spending with a 0 instead of NaN (Not a Number).
-            daily_spending = df['amount'].resample('D').sum().fillna(0)
-            
-            return daily_spending
+            dates, totals = zip(*rows)
+            return daily_series(dates, totals)
 
         def forecast_next_30_days(self):
             """
@@ -40,6 +417,32 @@ class SpendingForecaster:
             Returns a single number (the forecasted total) or None if not possible.
             """
             daily_data = self._prepare_daily_data()
+            if self.user_id is None or daily_data is None or self.engine_for(len(daily_data)) != 'sarimax':
+                return self.forecast_series(daily_data)
+
+            saved = ForecastModelState.objects.filter(user_id=self.user_id).values_list('state', flat=True).first()
+            self.model_state = saved
+            forecast = self.forecast_series(daily_data)
+            if self.model_state is not saved:
+                try:
+                    ForecastModelState.objects.update_or_create(user_id=self.user_id, defaults={'state': self.model_state})
+                except DatabaseError as e:
+                    # Only saves refitting next time, e.g. when workers fit the same user at once on SQLite
+                    logger.warning('Could not save the forecast model state for user %s: %s', self.user_id, e)
+            return forecast
+
+        def engine_for(self, days):
+            """The engine used for a series of `days` days. 'auto' only fits SARIMAX where it pays off."""
+            if self.engine != 'auto':
+                return self.engine
+            min_days = getattr(settings, 'FORECAST_AUTO_SARIMAX_MIN_DAYS', DEFAULT_AUTO_SARIMAX_MIN_DAYS)
+            return 'sarimax' if days >= min_days else 'fast'
+
+        def forecast_series(self, daily_data, raise_errors=False):
+            """
+            forecast_next_30_days() for an already prepared daily series (see daily_series()).
+            With raise_errors, a model that fails to fit raises instead of returning None.
+            """
 
             # --- Edge Case Handling ---
             # We need enough data to make a meaningful forecast.
@@ -51,18 +454,18 @@ class SpendingForecaster:
                     return avg_daily_spend * 30
                 return None # Not enough data to even calculate an average
 
+            engine = self.engine_for(len(daily_data))
+            started = time.perf_counter()
             try:
+                if engine == 'fast':
+                    forecast = seasonal_smoothing_forecast(daily_data.to_numpy(), steps=30).sum()
+                    record_forecast(engine, time.perf_counter() - started)
+                    return forecast
+
                 # --- The Time Series Model (SARIMA) ---
                 # SARIMA is a powerful model for data with a seasonal component (e.g., weekly spending patterns).
                 # We use some common default parameters. In a real data science project, these would be carefully tuned.
-                # The (7) at the end tells the model to look for a weekly (7-day) pattern.
-                model = sm.tsa.statespace.SARIMAX(daily_data,
-                                                  order=(1, 1, 1),
-                                                  seasonal_order=(1, 1, 0, 7),
-                                                  enforce_stationarity=False,
-                                                  enforce_invertibility=False)
-                
-                results = model.fit(disp=False)
+                results = self._fit_sarimax(daily_data)
                 
                 # --- Prediction ---
                 # Get the forecast for the next 30 days
@@ -73,10 +476,65 @@ class SpendingForecaster:
                 predicted_spending[predicted_spending < 0] = 0
                 
                 # Return the sum of the 30-day forecast
+                record_forecast(engine, time.perf_counter() - started)
                 return predicted_spending.sum()
 
             except Exception as e:
+                record_forecast(engine, time.perf_counter() - started, failed=True)
+                if raise_errors:
+                    raise
                 # If the model fails for any reason, return None
-                print(f"Forecasting error: {e}")
+                logger.warning('Forecasting error (%s): %s', engine, e)
+                return None
+
+        def _fit_sarimax(self, daily_data):
+            """
+            Returns SARIMAX results for the series and updates self.model_state.
+
+            With a saved model whose history is unchanged, only the days since then are run through
+            the Kalman filter, starting from the saved state with the saved parameters, so the cost
+            depends on the new days and not on the whole history. Otherwise, or when the saved model
+            is due for a refit or fits the new days badly, the model is fitted over the full history,
+            starting the optimizer from the saved parameters when there are any.
+            """
+            state = self.model_state
+            if state is not None and state.get('version') == MODEL_STATE_VERSION:
+                results = self._continue_sarimax(daily_data, state)
+                if results is not None:
+                    return results
+
+            model = _sarimax(daily_data)
+            start_params = None
+            if state is not None and len(state.get('params', ())) == len(model.start_params):
+                start_params = state['params']
+            results = model.fit(start_params=start_params, disp=False)
+            quality = float(results.llf_obs[results.loglikelihood_burn:].mean())
+            self.model_state = _model_state(daily_data, results, timezone.now(), quality)
+            return results
+
+        def _continue_sarimax(self, daily_data, state):
+            """Filters the days added since `state` was saved, or returns None if a full refit is needed."""
+            import numpy as np
+
+            refit_days = getattr(settings, 'FORECAST_FULL_REFIT_DAYS', DEFAULT_FULL_REFIT_DAYS)
+            full_fit_at = datetime.fromisoformat(state['full_fit_at'])
+            if timezone.now() - full_fit_at > timedelta(days=refit_days):
+                return None
+
+            # The history the state was built from must be unchanged: same first day, length and total
+            history_days = state['history_days']
+            if (len(daily_data) <= history_days
+                    or daily_data.index[0].date().isoformat() != state['start']
+                    or round(float(daily_data[:history_days].sum()), 2) != state['history_total']):
+                return None
+
+            new_days = daily_data[history_days:]
+            model = _sarimax(new_days, initialization='known',
+                             initial_state=np.array(state['state']), initial_state_cov=np.array(state['state_cov']))
+            results = model.filter(np.array(state['params']))
+
+            tolerance = getattr(settings, 'FORECAST_REFIT_TOLERANCE', DEFAULT_REFIT_TOLERANCE)
+            if len(new_days) >= MIN_DAYS_FOR_QUALITY_CHECK and results.llf / len(new_days) < state['quality'] - tolerance:
                 return None
-    
+            self.model_state = _model_state(daily_data, results, full_fit_at, state['quality'])
+            return results
@@ -43,5 +43,18 @@ class TransactionForm(forms.ModelForm):
             for field_name, field in self.fields.items():
                 field.widget.attrs.update({'class': 'form-control'})
 
-    
+        def save(self, commit=True):
+            # Whatever category the user saves is their choice, even one that was suggested
+            self.instance.category_source = 'user'
+            return super().save(commit)
+
 
+class ImportTransactionsForm(forms.Form):
+        """
+        Upload form for importing transactions from a bank statement CSV file.
+        """
+        csv_file = forms.FileField(
+            label='CSV file',
+            help_text='Needs Date, Description and Amount (or Debit/Credit) columns. Type and Category are optional.',
+            widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'}),
+        )
@@ -0,0 +1,252 @@
+import csv
+import io
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import classifier
+from .categorizer import TransactionCategorizer
+from .models import Category, Transaction
+from .rollups import add_transactions
+from .signals import transactions_changed
+
+# Other accepted date formats, tried in order after ISO 8601
+DATE_FORMATS = (
+    '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d %b %Y', '%d-%b-%Y',
+)
+
+# Header names we recognise (lower-cased) for each field
+COLUMN_ALIASES = {
+    'date': ('date', 'transaction date', 'txn date', 'value date'),
+    'description': ('description', 'narration', 'details', 'particulars'),
+    'category': ('category',),
+    'type': ('type', 'transaction type'),
+    'amount': ('amount',),
+    'debit': ('debit', 'withdrawal', 'withdrawal amt.'),
+    'credit': ('credit', 'deposit', 'deposit amt.'),
+}
+
+# Only the first few row errors are kept, so a badly broken file can't use unbounded memory
+MAX_REPORTED_ERRORS = 100
+
+MAX_AMOUNT = Decimal('99999999.99')
+DESCRIPTION_MAX_LENGTH = Transaction._meta.get_field('description').max_length
+TRANSACTION_TYPES = {choice for choice, _ in Transaction.TRANSACTION_TYPE_CHOICES}
+
+
+class CSVImportError(ValueError):
+    """Raised when a file can't be imported at all, e.g. required columns are missing."""
+
+
+class ImportResult:
+    """
+    Running totals for an import. Passed to the progress callback after every chunk.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+class TransactionImporter:
+    """
+    Imports a bank statement CSV for one user, streaming it row by row.
+
+    Rows are validated as they are read and collected into chunks of `chunk_size`. Each chunk
+    is de-duplicated against the database on a (day, amount, description) fingerprint,
+    auto-categorized in one batch and written with a single bulk_create inside its own
+    transaction, so memory use depends on the chunk size and not on the file size.
+    """
+    def __init__(self, user, chunk_size=2000, progress=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.category_ids = {
+            name.lower(): category_id
+            for category_id, name in Category.objects.filter(user=user).values_list('id', 'name')
+        }
+        self.categorizer = TransactionCategorizer.for_user(user)
+        # Looked up once, as timezone.localtime()/make_aware() per row add up on large files
+        self.timezone = timezone.get_current_timezone()
+
+    def import_file(self, binary_file, encoding='utf-8-sig'):
+        """Imports an uploaded (binary) file object."""
+        text = io.TextIOWrapper(binary_file, encoding=encoding, newline='')
+        try:
+            return self.import_rows(csv.reader(text))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise CSVImportError(f'Could not read the file: {e}')
+        finally:
+            # Leave the underlying file open for its owner
+            text.detach()
+
+    def import_rows(self, reader):
+        header = next(reader, None)
+        if header is None:
+            raise CSVImportError('The file is empty.')
+        columns = self._map_columns(header)
+
+        result = ImportResult()
+        chunk = []
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            result.rows += 1
+            try:
+                chunk.append(self._parse_row(row, columns))
+            except ValueError as e:
+                result.add_error(reader.line_num, str(e))
+            if len(chunk) >= self.chunk_size:
+                self._write_chunk(chunk, result)
+                chunk = []
+        if chunk:
+            self._write_chunk(chunk, result)
+        if result.created:
+            # bulk_create doesn't send post_save, so refresh the derived data ourselves
+            transactions_changed(self.user.pk)
+        return result
+
+    def _map_columns(self, header):
+        normalized = [name.strip().lower() for name in header]
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in normalized:
+                    columns[field] = normalized.index(alias)
+                    break
+
+        missing = [field for field in ('date', 'description') if field not in columns]
+        if 'amount' not in columns and 'debit' not in columns and 'credit' not in columns:
+            missing.append('amount (or debit/credit)')
+        if missing:
+            raise CSVImportError(f"Missing required column(s): {', '.join(missing)}.")
+        return columns
+
+    def _parse_row(self, row, columns):
+        def cell(field):
+            index = columns.get(field)
+            return row[index].strip() if index is not None and index < len(row) else ''
+
+        date = self._parse_date(cell('date'))
+        description = cell('description')[:DESCRIPTION_MAX_LENGTH]
+        if not description:
+            raise ValueError('Description is empty.')
+
+        transaction_type = cell('type').lower()
+        if transaction_type and transaction_type not in TRANSACTION_TYPES:
+            raise ValueError(f"Unknown transaction type '{cell('type')}'.")
+
+        if 'amount' in columns:
+            amount = self._parse_amount(cell('amount'))
+            # Signed statements: negative amounts are money going out
+            if not transaction_type:
+                transaction_type = 'expense' if amount < 0 else 'income'
+            amount = abs(amount)
+        else:
+            # Statements with debit and credit columns leave the unused one blank or put 0.00 in it.
+            # The column says which way the money went, so some banks write debits as negative.
+            debit = abs(self._parse_amount(cell('debit'))) if cell('debit') else 0
+            credit = abs(self._parse_amount(cell('credit'))) if cell('credit') else 0
+            if debit and credit:
+                raise ValueError('Both debit and credit are filled in.')
+            if debit:
+                amount = debit
+                transaction_type = transaction_type or 'expense'
+            elif credit:
+                amount = credit
+                transaction_type = transaction_type or 'income'
+            else:
+                raise ValueError('Amount is empty.')
+
+        return Transaction(
+            user=self.user,
+            category_id=self.category_ids.get(cell('category').lower()),
+            amount=amount,
+            transaction_type=transaction_type,
+            description=description,
+            date=date,
+        )
+
+    def _parse_date(self, value):
+        # Fast path for ISO dates, which is what most exports use
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        else:
+            return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, self.timezone)
+
+        for date_format in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            return timezone.make_aware(parsed, self.timezone)
+        raise ValueError(f"Unrecognised date '{value}'.")
+
+    def _parse_amount(self, value):
+        cleaned = value.replace(',', '').replace('₹', '').replace(' ', '')
+        try:
+            amount = Decimal(cleaned).quantize(Decimal('0.01'))
+            if not amount.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount '{value}'.")
+        if abs(amount) > MAX_AMOUNT:
+            raise ValueError(f"Amount '{value}' is too large.")
+        return amount
+
+    def _fingerprint(self, date, amount, description):
+        return date.astimezone(self.timezone).date(), amount, description
+
+    def _write_chunk(self, chunk, result):
+        with transaction.atomic():
+            fresh = self._drop_duplicates(chunk, result)
+
+            uncategorized = [t for t in fresh if t.category_id is None]
+            if uncategorized:
+                suggestions = self.categorizer.suggest_categories([t.description for t in uncategorized])
+                for t, category_id in zip(uncategorized, suggestions):
+                    t.category_id = category_id
+                    t.category_source = 'auto'
+
+            Transaction.objects.bulk_create(fresh)
+            add_transactions(fresh)
+            if classifier.enabled():
+                classifier.learn_transactions(self.user.pk, fresh)
+        result.created += len(fresh)
+        if self.progress:
+            self.progress(result)
+
+    def _drop_duplicates(self, chunk, result):
+        """
+        Removes rows already in the database, or repeated earlier in the chunk. Earlier chunks
+        are already written by the time this runs, so one query per chunk covers the whole file.
+        """
+        days = [t.date.astimezone(self.timezone).date() for t in chunk]
+        start = timezone.make_aware(datetime.combine(min(days), time.min), self.timezone)
+        end = timezone.make_aware(datetime.combine(max(days) + timedelta(days=1), time.min), self.timezone)
+        existing = Transaction.objects.filter(
+            user=self.user, date__gte=start, date__lt=end,
+            description__in={t.description for t in chunk},
+        ).values_list('date', 'amount', 'description')
+        seen = {self._fingerprint(*values) for values in existing}
+
+        fresh = []
+        for t in chunk:
+            key = self._fingerprint(t.date, t.amount, t.description)
+            if key in seen:
+                result.duplicates += 1
+                continue
+            seen.add(key)
+            fresh.append(t)
+        return fresh
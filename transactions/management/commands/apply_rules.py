@@ -0,0 +1,53 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.models import Category
+from transactions.recategorize import RuleApplier
+
+
+class Command(BaseCommand):
+    help = ("Applies a user's Smart Rules to their existing transactions, moving every transaction a keyword "
+            "matches into that keyword's category. Only uncategorized transactions are changed unless "
+            "--include-categorized is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Transactions read and written per database transaction')
+        parser.add_argument('--include-categorized', action='store_true',
+                            help='Also move transactions that already have a category when a rule says otherwise')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would change')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        start = time.perf_counter()
+
+        def progress(result):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'  {result.scanned:,} transactions scanned, {result.matched:,} matched, {result.updated:,} updated '
+                f'({result.scanned / elapsed:,.0f} rows/s)'
+            )
+
+        result = RuleApplier(
+            user,
+            chunk_size=options['chunk_size'],
+            keep_existing=not options['include_categorized'],
+            dry_run=options['dry_run'],
+            progress=progress,
+        ).run()
+
+        names = dict(Category.objects.filter(user=user).values_list('id', 'name'))
+        for category_id, count in result.by_category.most_common():
+            self.stdout.write(f'  {names.get(category_id, category_id)}: {count:,}')
+        if options['dry_run']:
+            summary = f'{result.matched:,} of {result.scanned:,} transactions would be recategorized (dry run, nothing changed).'
+        else:
+            summary = f'Recategorized {result.updated:,} of {result.scanned:,} transactions'
+            summary += f' in {time.perf_counter() - start:.1f}s.'
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,190 @@
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import timedelta
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from finsight_project.metrics import RequestMetrics
+from transactions.forecaster import SpendingForecaster, invalidate_forecast
+from transactions.models import Budget, DailySpend, Transaction
+from transactions.synthetic import SYNTHETIC_MERCHANTS, description_for, generate_user
+
+USERNAME_PREFIX = 'bench-app-'
+# Settings the measurements run under. The manifest storage needs collectstatic, and the forecast
+# is computed inline so that the dashboard's cold-cache cost is measured rather than queued.
+BENCH_SETTINGS = {
+    'ALLOWED_HOSTS': ['testserver'],
+    'FORECAST_WORKER': False,
+    'STORAGES': {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+}
+SUGGEST_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('End-to-end benchmark of the dashboard, category suggestions, CSV export, budgets page and '
+            'forecaster, on synthetic accounts of each --scales size. Accounts are generated on first use and '
+            'reused afterwards. Write results with --output and compare two runs with --compare. '
+            'Run it against a scratch database (set DATABASE_URL).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,100000,1000000', help='Comma-separated transaction counts')
+        parser.add_argument('--days', type=int, default=730, help='Days of history per account')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement; median and p95 are reported')
+        parser.add_argument('--output', help='Write the results as JSON to this path')
+        parser.add_argument('--compare', help='A JSON file from an earlier run to compare the medians against')
+        parser.add_argument('--drop', action='store_true', help='Delete the benchmark accounts, then exit')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['drop']:
+            deleted, _ = User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted the benchmark accounts ({deleted} rows).'))
+            return
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales must be comma-separated integers.')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'forecast_engine': SpendingForecaster().engine,
+            'repeat': options['repeat'],
+            'scales': {},
+        }
+        rng = random.Random(options['seed'])
+        with override_settings(**BENCH_SETTINGS):
+            for rows in scales:
+                user, generate_seconds = self._account(rows, options['days'], rng)
+                self.stdout.write(f'{rows:,} transactions ({user.username}):')
+                measurements = {}
+                for name, measure in self._measurements(user, rng).items():
+                    measurements[name] = self._time(measure, options['repeat'])
+                    self._report(name, measurements[name], baseline, rows)
+                results['scales'][str(rows)] = {
+                    'rows': Transaction.objects.filter(user=user).count(),
+                    'generate_seconds': generate_seconds,
+                    'measurements': measurements,
+                }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _account(self, rows, days, rng):
+        """The benchmark account with `rows` transactions, generated if it doesn't exist yet."""
+        username = f'{USERNAME_PREFIX}{rows}'
+        user = User.objects.filter(username=username).first()
+        if user is not None:
+            return user, None
+        self.stdout.write(f'Generating {rows:,} transactions for {username}...')
+        started = time.perf_counter()
+        user = generate_user(username, rows, days, rng, progress=self.stdout.write)
+        return user, round(time.perf_counter() - started, 3)
+
+    def _measurements(self, user, rng):
+        """{name: (setup, run)}. setup() runs untimed before each run(); run() returns the HTTP status or None."""
+        client = Client()
+        client.force_login(user)
+        descriptions = [
+            description_for(rng, rng.choice(SYNTHETIC_MERCHANTS[name]))
+            for name in rng.choices(list(SYNTHETIC_MERCHANTS), k=SUGGEST_BATCH_SIZE)
+        ]
+        budgets = {f'budget_{category_id}': str(amount)
+                   for category_id, amount in Budget.objects.filter(user=user).values_list('category_id', 'amount')}
+
+        def get(name, **params):
+            return lambda: client.get(reverse(name), params).status_code
+
+        def export(**params):
+            def run():
+                response = client.get(reverse('export_transactions_csv'), params)
+                # Streaming: the work happens as the body is consumed
+                for _ in response.streaming_content:
+                    pass
+                return response.status_code
+            return run
+
+        def suggest(payload):
+            return lambda: client.post(reverse('suggest_category'), json.dumps(payload),
+                                       content_type='application/json').status_code
+
+        def forecast(engine):
+            return lambda: SpendingForecaster(DailySpend.objects.filter(user=user), engine=engine).forecast_next_30_days()
+
+        def cold():
+            # As after any change to the user's transactions; the saved SARIMAX state is kept
+            invalidate_forecast(user.pk)
+
+        return {
+            'dashboard_cold': (cold, get('dashboard')),
+            'dashboard_warm': (None, get('dashboard')),
+            'suggest_category': (None, suggest({'description': descriptions[0]})),
+            f'suggest_category_batch_{SUGGEST_BATCH_SIZE}': (None, suggest({'descriptions': descriptions})),
+            'export_csv': (None, export()),
+            'export_csv_gzip_last_90_days': (None, export(gzip=1, start=(timezone.localdate() - timedelta(days=90)).isoformat())),
+            'manage_budgets_get': (None, get('manage_budgets')),
+            'manage_budgets_post': (None, lambda: client.post(reverse('manage_budgets'), budgets).status_code),
+            'history_first_page': (None, get('transaction_history')),
+            'forecaster_fast': (None, forecast('fast')),
+            'forecaster_sarimax': (None, forecast('sarimax')),
+        }
+
+    def _time(self, measure, repeat):
+        setup, run = measure
+        # One untimed run warms caches and connections
+        if setup:
+            setup()
+        outcome = run()
+        if isinstance(outcome, int) and outcome >= 400:
+            raise CommandError(f'The request failed with status {outcome}.')
+        timings, db_timings, queries = [], [], 0
+        for _ in range(repeat):
+            if setup:
+                setup()
+            # The metrics middleware's query counter; it works outside a request too
+            metrics = RequestMetrics(capture_sql=False)
+            with connection.execute_wrapper(metrics):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            db_timings.append(metrics.db_seconds * 1000)
+            queries = metrics.queries
+        timings.sort()
+        return {
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[int(0.95 * (len(timings) - 1))], 3),
+            'min_ms': round(timings[0], 3),
+            'db_median_ms': round(statistics.median(db_timings), 3),
+            'queries': queries,
+        }
+
+    def _report(self, name, result, baseline, rows):
+        line = (f'  {name:32} {result["median_ms"]:10.2f} ms median  {result["p95_ms"]:10.2f} ms p95  '
+                f'{result["db_median_ms"]:9.2f} ms SQL  {result["queries"]:>4} queries')
+        previous = (baseline or {}).get('scales', {}).get(str(rows), {}).get('measurements', {}).get(name)
+        if previous and previous['median_ms']:
+            ratio = result['median_ms'] / previous['median_ms']
+            change = f'  {ratio:5.2f}x vs. baseline'
+            style = self.style.ERROR if ratio > 1.1 else self.style.SUCCESS if ratio < 0.9 else str
+            line += style(change)
+        self.stdout.write(line)
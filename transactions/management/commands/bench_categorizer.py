@@ -0,0 +1,73 @@
+import json
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from transactions.categorizer import DEFAULT_KEYWORD_TO_CATEGORY, _categorizer_cache
+from transactions.models import Category, Keyword
+from transactions.views import SuggestCategoryView
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks category suggestion throughput: one description per request vs. batch requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--descriptions', type=int, default=5000, help='Number of descriptions to categorize')
+        parser.add_argument('--keywords', type=int, default=300, help='Number of custom keyword rules for the test user')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        view = SuggestCategoryView.as_view()
+        factory = RequestFactory()
+
+        def post(user, payload):
+            request = factory.post('/transactions/suggest_category/', json.dumps(payload), content_type='application/json')
+            request.user = user
+            return view(request)
+
+        # Everything below runs in a transaction that is rolled back, so the database is left untouched
+        with transaction.atomic():
+            user = User.objects.create(username=f'bench-categorizer-{rng.getrandbits(32):08x}')
+            categories = [
+                Category.objects.create(user=user, name=name)
+                for name in sorted(set(DEFAULT_KEYWORD_TO_CATEGORY.values()))
+            ]
+            for i in range(options['keywords']):
+                Keyword.objects.create(user=user, category=rng.choice(categories), text=f'merchant{i:05d}')
+
+            vocabulary = list(DEFAULT_KEYWORD_TO_CATEGORY) + [f'merchant{i:05d}' for i in range(options['keywords'])]
+            filler = ['payment', 'upi', 'ref', 'debit', 'card', 'online', 'txn', 'pos']
+            descriptions = [
+                ' '.join(rng.choice(filler if rng.random() < 0.7 else vocabulary) for _ in range(rng.randint(3, 8)))
+                for _ in range(options['descriptions'])
+            ]
+
+            _categorizer_cache.clear()
+            start = time.perf_counter()
+            single = [json.loads(post(user, {'description': d}).content).get('category_id') for d in descriptions]
+            single_seconds = time.perf_counter() - start
+
+            _categorizer_cache.clear()
+            start = time.perf_counter()
+            batch = []
+            for offset in range(0, len(descriptions), SuggestCategoryView.max_batch_size):
+                chunk = descriptions[offset:offset + SuggestCategoryView.max_batch_size]
+                batch.extend(json.loads(post(user, {'descriptions': chunk}).content)['category_ids'])
+            batch_seconds = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+        _categorizer_cache.clear()
+
+        if single != batch:
+            self.stdout.write(self.style.ERROR('Batch results differ from single-item results!'))
+
+        count = len(descriptions)
+        self.stdout.write(f'{count} descriptions, {options["keywords"]} custom keywords')
+        self.stdout.write(f'  single-item: {single_seconds:8.3f}s  {count / single_seconds:12,.0f} descriptions/s')
+        self.stdout.write(f'  batch:       {batch_seconds:8.3f}s  {count / batch_seconds:12,.0f} descriptions/s')
+        self.stdout.write(self.style.SUCCESS(f'Batch speedup: {single_seconds / batch_seconds:.1f}x'))
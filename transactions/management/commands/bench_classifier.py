@@ -0,0 +1,96 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from transactions.classifier import (
+    DEFAULT_CLASSIFIER_FOLD_CHANGES, NaiveBayesClassifier, learn_change, learn_transactions, load_classifier,
+)
+from transactions.models import Category, Transaction
+from transactions.synthetic import synthetic_transactions
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the learned categorizer: training time, model size, prediction latency, and '
+            'accuracy on held-out transactions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Use this user's categorized transactions instead of synthetic ones")
+        parser.add_argument('--transactions', type=int, default=20_000, help='Synthetic transactions to generate')
+        parser.add_argument('--holdout', type=float, default=0.2, help='Share of transactions held out for testing')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['user']:
+            labeled = list(
+                Transaction.objects.filter(user__username=options['user'], category__isnull=False)
+                .values_list('description', 'category_id')
+            )
+            if not labeled:
+                raise CommandError(f'User "{options["user"]}" has no categorized transactions.')
+        else:
+            labeled = list(synthetic_transactions(rng, options['transactions']))
+        rng.shuffle(labeled)
+        split = int(len(labeled) * (1 - options['holdout']))
+        train, test = labeled[:split], labeled[split:]
+
+        # --- Training ---
+        classifier = NaiveBayesClassifier()
+        start = time.perf_counter()
+        for description, category in train:
+            classifier.learn(description, category)
+        train_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data = classifier.to_bytes()
+        save_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        classifier = NaiveBayesClassifier.from_bytes(data)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        # --- Prediction ---
+        timings = []
+        correct = predicted = 0
+        for description, category in test:
+            start = time.perf_counter()
+            guess = classifier.predict(description)
+            timings.append(time.perf_counter() - start)
+            if guess is not None:
+                predicted += 1
+                correct += guess == category
+        timings.sort()
+
+        # --- Incremental update, as a transaction save queues it, then the batch fold (rolled back) ---
+        with transaction.atomic():
+            user = User.objects.create(username=f'bench-classifier-{rng.getrandbits(32):08x}')
+            categories = [Category.objects.create(user=user, name=f'Category {i}').pk for i in range(10)]
+            learn_transactions(user.pk, [Transaction(description=d, category_id=categories[i % 10]) for i, (d, _) in enumerate(train)])
+            update_timings = []
+            for description, _ in test[:DEFAULT_CLASSIFIER_FOLD_CHANGES - 1]:
+                start = time.perf_counter()
+                learn_change(None, {'user_id': user.pk, 'description': description, 'category_id': categories[0]})
+                update_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            load_classifier(user.pk)
+            queued_load_ms = (time.perf_counter() - start) * 1000
+            learn_change(None, {'user_id': user.pk, 'description': 'one more', 'category_id': categories[0]})
+            start = time.perf_counter()
+            load_classifier(user.pk)
+            fold_ms = (time.perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{len(train):,} training and {len(test):,} test transactions, {len(classifier.counts)} categories')
+        self.stdout.write(f'  training:          {train_seconds:8.3f}s  ({len(train) / train_seconds:,.0f} transactions/s)')
+        self.stdout.write(f'  model size:        {len(data) / 1024:8.1f} KB stored, {len(classifier) * 4 / 1024:,.0f} KB in memory')
+        self.stdout.write(f'  serialize / load:  {save_ms:8.2f} / {load_ms:.2f} ms')
+        self.stdout.write(f'  prediction:        {statistics.median(timings) * 1e6:8.0f} us median, '
+                          f'{timings[int(0.99 * (len(timings) - 1))] * 1e6:.0f} us p99')
+        self.stdout.write(f'  queued update:     {statistics.median(update_timings) * 1000:8.2f} ms median per saved transaction')
+        self.stdout.write(f'  load with queue:   {queued_load_ms:8.2f} ms with {len(update_timings)} changes queued, '
+                          f'{fold_ms:.2f} ms to fold {DEFAULT_CLASSIFIER_FOLD_CHANGES}')
+        self.stdout.write(f'  coverage:          {predicted / len(test):8.1%} of test transactions get a suggestion')
+        self.stdout.write(self.style.SUCCESS(f'Accuracy of suggestions: {correct / predicted if predicted else 0:.1%}'))
@@ -0,0 +1,113 @@
+import itertools
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from transactions.forecaster import SpendingForecaster, daily_series
+from transactions.models import DailySpend
+
+HOLDOUT_DAYS = 30
+# Series lengths (in days, before the holdout) that results are broken down by
+LENGTH_BUCKETS = ((30, 90), (90, 180), (180, 365), (365, 730), (730, None))
+
+
+def synthetic_series(rng, days):
+    """A made-up spending history: a weekly pattern, a monthly bill, noisy purchases, days with none, and drift."""
+    base = rng.lognormvariate(6, 0.8)
+    weekly = [rng.uniform(0.5, 1.6) for _ in range(7)]
+    drift = rng.uniform(-0.4, 0.6) / 365
+    start = date(2022, 1, 1)
+    dates, totals = [], []
+    for day in range(days):
+        current = start + timedelta(days=day)
+        spend = 0.0
+        if rng.random() < 0.75:
+            spend = base * weekly[current.weekday()] * (1 + drift * day) * rng.lognormvariate(0, 0.5)
+        if current.day == 1:
+            spend += base * 8
+        dates.append(current)
+        totals.append(max(spend, 0.0))
+    return dates, totals
+
+
+class Command(BaseCommand):
+    help = ('Compares the forecasting engines: fit latency, and the error of the 30-day total on the last '
+            f'{HOLDOUT_DAYS} days of each series, which are held out from the fit')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', type=int, default=200, help='Number of series to evaluate')
+        parser.add_argument('--from-db', action='store_true',
+                            help="Use users' stored daily spending instead of synthetic series")
+        parser.add_argument('--engines', default='sarimax,fast,auto', help='Comma-separated engines to compare')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        engines = options['engines'].split(',')
+        forecasters = {}
+        for engine in engines:
+            try:
+                forecasters[engine] = SpendingForecaster(engine=engine)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        series = list(self._series(options))
+        if not series:
+            raise CommandError(f'No series with at least {30 + HOLDOUT_DAYS} days of data.')
+        self.stdout.write(f'{len(series)} series, last {HOLDOUT_DAYS} days held out')
+
+        # (length bucket, engine) -> [(seconds, absolute percentage error of the 30-day total)]
+        results = {}
+        for dates, totals in series:
+            history = daily_series(dates, totals)
+            train, actual = history[:-HOLDOUT_DAYS], history[-HOLDOUT_DAYS:].sum()
+            bucket = next(b for b in LENGTH_BUCKETS if len(train) >= b[0] and (b[1] is None or len(train) < b[1]))
+            for engine, forecaster in forecasters.items():
+                start = time.perf_counter()
+                forecast = forecaster.forecast_series(train)
+                seconds = time.perf_counter() - start
+                error = abs(float(forecast or 0) - actual) / actual if actual else None
+                results.setdefault((bucket, engine), []).append((seconds, error))
+
+        self.stdout.write(f'{"days":>10} {"engine":>8} {"series":>7} {"median ms":>10} {"p95 ms":>9} '
+                          f'{"median APE":>11} {"mean APE":>9}')
+        for bucket, engine in itertools.product([None] + list(LENGTH_BUCKETS), engines):
+            if bucket is None:
+                rows = [row for (_, e), values in results.items() if e == engine for row in values]
+                label = 'all'
+            else:
+                rows = results.get((bucket, engine), [])
+                label = f'{bucket[0]}-{bucket[1] or ""}'
+            if not rows:
+                continue
+            times = sorted(seconds for seconds, _ in rows)
+            errors = [error for _, error in rows if error is not None]
+            self.stdout.write(
+                f'{label:>10} {engine:>8} {len(rows):>7} {statistics.median(times) * 1000:>10.1f} '
+                f'{times[int(0.95 * (len(times) - 1))] * 1000:>9.1f} '
+                f'{statistics.median(errors) if errors else 0:>11.1%} {statistics.mean(errors) if errors else 0:>9.1%}'
+            )
+
+    def _series(self, options):
+        if not options['from_db']:
+            rng = random.Random(options['seed'])
+            for _ in range(options['series']):
+                yield synthetic_series(rng, rng.randint(30 + HOLDOUT_DAYS, 1100))
+            return
+
+        rows = (
+            DailySpend.objects.values('user_id', 'date').annotate(day_total=Sum('total'))
+            .order_by('user_id', 'date').values_list('user_id', 'date', 'day_total').iterator(chunk_size=10_000)
+        )
+        found = 0
+        for _, group in itertools.groupby(rows, key=lambda row: row[0]):
+            dates, totals = zip(*((day, float(total)) for _, day, total in group))
+            if (dates[-1] - dates[0]).days + 1 < 30 + HOLDOUT_DAYS:
+                continue
+            yield dates, totals
+            found += 1
+            if found == options['series']:
+                return
@@ -0,0 +1,139 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+DEFAULT_PATHS = '/,/transactions/history/,/transactions/budgets/history/'
+
+
+class Command(BaseCommand):
+    help = ('Load test of a running server: --concurrency clients, each with a keep-alive connection, request '
+            '--paths round-robin for --duration seconds as --user, and the throughput and latency are reported per '
+            'concurrency level. Run it with the same settings and database as the server, which it logs the user '
+            'into. Compare deployments, e.g. gunicorn WSGI and uvicorn ASGI, with --output and --compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='The server to load')
+        parser.add_argument('--user', required=True, help='Username the requests are made as')
+        parser.add_argument('--paths', default=DEFAULT_PATHS, help='Comma-separated paths to request in turn')
+        parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated numbers of concurrent clients')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+        parser.add_argument('--warmup', type=float, default=5.0,
+                            help='Untimed seconds at the highest concurrency first, so every worker has warm caches')
+        parser.add_argument('--label', default='', help='Name of the deployment under test, stored with --output')
+        parser.add_argument('--output', help='Write the results as JSON to this path')
+        parser.add_argument('--compare', help='A JSON file from an earlier run to compare throughput against')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise CommandError('--url must be an http:// or https:// URL.')
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be comma-separated integers.')
+        paths = [path for path in options['paths'].split(',') if path]
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"There is no user '{options['user']}'.")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        # A session the server accepts, as it shares the database and SECRET_KEY
+        client = Client()
+        client.force_login(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+        if options['warmup'] > 0:
+            self._run_level(url, cookie, paths, max(levels), options['warmup'])
+        results = {'label': options['label'], 'url': options['url'], 'paths': paths, 'levels': {}}
+        for concurrency in levels:
+            result = self._run_level(url, cookie, paths, concurrency, options['duration'])
+            results['levels'][str(concurrency)] = result
+            self._report(concurrency, result, baseline)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _run_level(self, url, cookie, paths, concurrency, duration):
+        latencies, errors = [], []
+        lock = threading.Lock()
+        # Every client connects first, so that connection setup isn't timed
+        barrier = threading.Barrier(concurrency + 1)
+        deadline = [None]
+
+        def client(offset):
+            connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(url.hostname, url.port, timeout=60)
+            headers = {'Cookie': cookie, 'Accept': 'application/json, text/html'}
+            mine, failed = [], []
+            connection.connect()
+            barrier.wait()
+            i = offset
+            while time.perf_counter() < deadline[0]:
+                path = paths[i % len(paths)]
+                i += 1
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    failed.append(type(e).__name__)
+                    continue
+                mine.append((time.perf_counter() - started) * 1000)
+                if status >= 400 or status in (301, 302):
+                    failed.append(f'{path} -> {status}')
+            connection.close()
+            with lock:
+                latencies.extend(mine)
+                errors.extend(failed)
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        deadline[0] = time.perf_counter() + duration
+        started = time.perf_counter()
+        barrier.wait()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if errors:
+            self.stderr.write(f'  {len(errors)} failed requests, e.g. {errors[0]}')
+        latencies.sort()
+        if not latencies:
+            raise CommandError('No request completed.')
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': round(len(latencies) / elapsed, 2),
+            'median_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+            'p99_ms': round(latencies[int(0.99 * (len(latencies) - 1))], 2),
+        }
+
+    def _report(self, concurrency, result, baseline):
+        line = (f'  {concurrency:4} clients  {result["requests_per_second"]:8.1f} req/s  '
+                f'{result["median_ms"]:9.1f} ms median  {result["p95_ms"]:9.1f} ms p95  '
+                f'{result["p99_ms"]:9.1f} ms p99  {result["errors"]:>4} errors')
+        previous = (baseline or {}).get('levels', {}).get(str(concurrency))
+        if previous and previous['requests_per_second']:
+            ratio = result['requests_per_second'] / previous['requests_per_second']
+            change = f'  {ratio:5.2f}x throughput vs. {baseline.get("label") or "baseline"}'
+            style = self.style.SUCCESS if ratio > 1.1 else self.style.ERROR if ratio < 0.9 else str
+            line += style(change)
+        self.stdout.write(line)
@@ -0,0 +1,215 @@
+import itertools
+import json
+import random
+import re
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from transactions.budgets import budgets_with_spending
+from transactions.forecaster import rollup_checksum
+from transactions.models import Budget, Category, DailySpend, Transaction
+from transactions.pagination import encode_cursor, seek
+from transactions.rollups import month_start, rebuild_daily_spend
+from transactions.search import TransactionSearch
+
+USERNAME_PREFIX = 'bench-queries-'
+
+# Plan fragments that mean a whole table is read. Anything else (index searches, sorts) is fine.
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (transactions_transaction|transactions_dailyspend|transactions_monthlyspend)\b'),
+    'postgresql': re.compile(r'\bSeq Scan on (transactions_transaction|transactions_dailyspend|transactions_monthlyspend)\b'),
+}
+
+# Queries whose plan has to go through a particular index, e.g. so that a lookup Django compiles
+# differently on PostgreSQL still uses it. The search terms only occur in a few descriptions.
+REQUIRED_INDEXES = {
+    'search_rare_word': {'sqlite': 'transaction_search', 'postgresql': 'txn_user_description_trgm'},
+    'search_rare_word_older': {'sqlite': 'transaction_search', 'postgresql': 'txn_user_description_trgm'},
+}
+
+
+class RawQuery:
+    """A hot query that is raw SQL, with the explain() and iteration of a queryset."""
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+
+    def explain(self):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + self.sql, self.params)
+            # The plan's text is the last column on both databases
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def __iter__(self):
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql, self.params)
+            return iter(cursor.fetchall())
+
+
+def hot_queries(user):
+    """
+    The queries our hot paths run, as {name: callable returning a list}. Keep this in step with
+    the dashboard, forecaster, history, export and importer when they change.
+    """
+    today = timezone.now()
+    transactions = Transaction.objects.filter(user=user)
+    daily_spend = DailySpend.objects.filter(user=user)
+    history = transactions.values('id', 'date', 'description', 'amount', 'transaction_type', 'category__name')
+    # A page about a year back, where OFFSET pagination would have to skip most of the history
+    deep_cursor = encode_cursor(today - timedelta(days=365), 0)
+    category_id = Category.objects.filter(user=user).values_list('id', flat=True).first()
+    # Seeded descriptions are 'merchant <0-5000>', so this matches about one in 5,000
+    search = TransactionSearch(user, {'q': '4242'})
+    newest_id = transactions.aggregate(Max('id'))['id__max'] or 0
+    return {
+        'dashboard_recent_transactions': lambda: transactions.select_related('category').order_by('-date', '-id')[:10],
+        'dashboard_chart': lambda: daily_spend.values('category__name').annotate(total=Sum('total')).order_by('-total'),
+        'dashboard_budgets': lambda: budgets_with_spending(user, month_start(timezone.localdate())),
+        'forecaster_daily_series': lambda: daily_spend.values('date').annotate(day_total=Sum('total')).order_by('date'),
+        'forecast_fingerprint': lambda: daily_spend.values('user').annotate(
+            buckets=Count('id'), count=Sum('count'), spent=Sum('total'), last_date=Max('date'),
+            checksum=rollup_checksum()),
+        'history_deep_page': lambda: seek(history, deep_cursor)[:51],
+        'history_category_deep_page': lambda: seek(history.filter(category_id=category_id), deep_cursor)[:51],
+        'export_all': lambda: transactions.order_by('date').values_list(
+            'date', 'description', 'category__name', 'transaction_type', 'amount'),
+        'export_expenses_last_90_days': lambda: transactions.filter(
+            transaction_type='expense', date__gte=today - timedelta(days=90)).order_by('date').values_list(
+            'date', 'description', 'category__name', 'transaction_type', 'amount'),
+        'import_duplicate_check': lambda: transactions.filter(
+            date__gte=today - timedelta(days=7), date__lt=today,
+            description__in=[f'merchant {i}' for i in range(200)]).values_list('date', 'amount', 'description'),
+        'search_rare_word': lambda: RawQuery(*search.ranked_ids_query()),
+        'search_rare_word_older': lambda: search.older_matches(newest_id)[:51],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Seeds synthetic transactions and records EXPLAIN output and timings for the hot queries. '
+            'Run it against a scratch database (set DATABASE_URL), e.g. once on SQLite and once on Postgres.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Transactions to seed, spread over --users')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query; the median is reported')
+        parser.add_argument('--output', help='Also write the results as JSON to this path')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if any hot query plan scans a whole table or misses its required index')
+        parser.add_argument('--drop', action='store_true', help='Delete the seeded users and their data, then exit')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        bench_users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        if options['drop']:
+            deleted = bench_users.count()
+            bench_users.delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} benchmark users.'))
+            return
+
+        if not bench_users.exists():
+            self._seed(options['rows'], options['users'], random.Random(options['seed']))
+        else:
+            self.stdout.write('Reusing the existing benchmark users (run with --drop to start over).')
+
+        # Measure the account with the most history, since that is where plans matter
+        user = bench_users.annotate(n=Count('transactions')).order_by('-n').first()
+        # Fresh planner statistics, as a production database would have
+        if connection.vendor in FULL_SCAN_PATTERNS:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        results = {
+            'vendor': connection.vendor,
+            'user_rows': Transaction.objects.filter(user=user).count(),
+            'total_rows': Transaction.objects.count(),
+            'queries': {},
+        }
+        full_scans = []
+        missed_indexes = []
+        for name, query in hot_queries(user).items():
+            plan = query().explain()
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                rows = len(list(query()))
+                timings.append((time.perf_counter() - start) * 1000)
+            results['queries'][name] = {'median_ms': round(statistics.median(timings), 3), 'rows': rows, 'plan': plan}
+
+            scans = FULL_SCAN_PATTERNS.get(connection.vendor)
+            if scans and scans.search(plan):
+                full_scans.append(name)
+            required = REQUIRED_INDEXES.get(name, {}).get(connection.vendor)
+            if required and required not in plan:
+                missed_indexes.append(f'{name} ({required})')
+            self.stdout.write(f'{name:32} {statistics.median(timings):10.2f} ms  {rows:>8} rows')
+            for line in plan.splitlines():
+                self.stdout.write(f'    {line}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['check'] and full_scans:
+            raise CommandError(f'Full table scans in: {", ".join(full_scans)}')
+        if options['check'] and missed_indexes:
+            raise CommandError(f'Required indexes not used by: {", ".join(missed_indexes)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{results["total_rows"]:,} rows seeded, measured a user with {results["user_rows"]:,} rows on {connection.vendor}.'
+        ))
+
+    def _seed(self, rows, user_count, rng):
+        self.stdout.write(f'Seeding {rows:,} transactions over {user_count:,} users...')
+        started = time.perf_counter()
+        User.objects.bulk_create(User(username=f'{USERNAME_PREFIX}{i:06d}') for i in range(user_count))
+        user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk').values_list('pk', flat=True))
+        Category.objects.bulk_create(
+            Category(user_id=user_id, name=name) for user_id in user_ids for name in ('Food', 'Bills', 'Shopping', 'Transport')
+        )
+        categories = {}
+        for category_id, user_id in Category.objects.filter(user_id__in=user_ids).values_list('pk', 'user_id'):
+            categories.setdefault(user_id, []).append(category_id)
+
+        # A skewed spread, so one account is much larger than the rest, as on a real install
+        cumulative_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(user_ids))))
+        now = timezone.now()
+        batch = []
+        for i in range(rows):
+            user_id = rng.choices(user_ids, cum_weights=cumulative_weights)[0] if i % 10 else user_ids[0]
+            batch.append(Transaction(
+                user_id=user_id,
+                category_id=rng.choice(categories[user_id] + [None]),
+                amount=Decimal(rng.randint(100, 500000)) / 100,
+                transaction_type='expense' if rng.random() < 0.9 else 'income',
+                description=f'merchant {rng.randint(0, 5000)}',
+                date=now - timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60)),
+            ))
+            if len(batch) == 10_000:
+                with transaction.atomic():
+                    Transaction.objects.bulk_create(batch)
+                batch = []
+                self.stdout.write(f'  {i + 1:,} rows')
+        if batch:
+            Transaction.objects.bulk_create(batch)
+
+        # A standing budget for every category, and this month's own budget for half of them
+        this_month = month_start(timezone.localdate())
+        Budget.objects.bulk_create(
+            Budget(user_id=user_id, category_id=category_id, month=month, amount=Decimal(rng.randint(100, 5000)))
+            for user_id, category_ids in categories.items() for i, category_id in enumerate(category_ids)
+            for month in ((None, this_month) if i % 2 else (None,))
+        )
+
+        # bulk_create skips the signals that maintain the rollups, so build them directly
+        for user_id in user_ids:
+            rebuild_daily_spend(user_id)
+        self.stdout.write(f'Seeded in {time.perf_counter() - started:.1f}s.')
@@ -0,0 +1,153 @@
+import csv
+import itertools
+import os
+import statistics
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from finsight_project.db_routing import primary_reads
+from transactions.forecaster import FORECAST_ENGINES, SMOOTHING_HISTORY_DAYS, fit_forecasts, preload_forecasting
+from transactions.models import DailySpend, DataVersion, ForecastModelState, ForecastResult
+
+
+def _init_worker():
+    # Workers only fit models, but with the spawn/forkserver start methods they still need Django
+    # set up to import the forecaster. Forked workers inherit it.
+    if not django.apps.apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = ("Forecasts every user's spending and month-end projections in a process pool and stores the "
+            "results, e.g. nightly. Reads all the daily series in one grouped query, streamed so only a "
+            "bounded number of users are held in memory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes (default: one per core)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Users sent to a worker at a time')
+        parser.add_argument('--max-pending', type=int, default=None,
+                            help='Batches queued or running at once, which bounds memory (default: 2 per worker)')
+        parser.add_argument('--engine', choices=FORECAST_ENGINES, help='Forecast engine (default: the FORECAST_ENGINE setting)')
+        parser.add_argument('--limit', type=int, help='Only forecast the first N users, e.g. for a trial run')
+        parser.add_argument('--report', help='Write per-user fit times and errors to this CSV file')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'] or 1)
+        max_pending = options['max_pending'] or 2 * workers
+        report = None
+        if options['report']:
+            report_file = open(options['report'], 'w', newline='')
+            report = csv.writer(report_file)
+            report.writerow(['user_id', 'forecast', 'fit_seconds', 'error'])
+
+        self.fit_times = []
+        self.failures = 0
+        started = time.perf_counter()
+        self.today = today = timezone.localdate()
+        # Loaded once here, so forked workers share it instead of each importing it
+        preload_forecasting()
+        # Children must not share the parent's database connections
+        connections.close_all()
+        try:
+            # The series are read from the primary, as the results are stored as current (see store_forecast)
+            with primary_reads(), ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+                # Start the workers now, before the streaming query opens a connection they would inherit
+                pool.submit(_init_worker).result()
+                pending = set()
+                for batch in self._batches(options['batch_size'], options['limit']):
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._store(done, report)
+                    user_ids = [user_id for user_id, _, _ in batch]
+                    # Saved SARIMAX models, so refits only process the days added since
+                    states = dict(ForecastModelState.objects.filter(user_id__in=user_ids).values_list('user_id', 'state'))
+                    recent = self._recent_rows(user_ids, today)
+                    batch = [(user_id, dates, totals, states.get(user_id), recent.get(user_id, []))
+                             for user_id, dates, totals in batch]
+                    pending.add(pool.submit(fit_forecasts, batch, options['engine'], today))
+                self._store(wait(pending).done, report)
+        finally:
+            if report:
+                report_file.close()
+
+        elapsed = time.perf_counter() - started
+        users = len(self.fit_times)
+        if not users:
+            self.stdout.write('No spending data to forecast.')
+            return
+        fit_times = sorted(self.fit_times)
+        self.stdout.write(
+            f'{users:,} users in {elapsed:.1f}s with {workers} worker(s): {users / elapsed:,.1f} users/s, '
+            f'{self.failures} failure(s)'
+        )
+        self.stdout.write(
+            f'  fit time per user: median {statistics.median(fit_times) * 1000:.1f} ms, '
+            f'p95 {fit_times[int(0.95 * (users - 1))] * 1000:.1f} ms, max {fit_times[-1] * 1000:.1f} ms'
+        )
+        # Close to the worker count when the pool is kept busy
+        self.stdout.write(f'  parallel efficiency: {sum(fit_times) / elapsed:.2f} cores busy on average')
+        self.stdout.write(self.style.SUCCESS('Forecasts stored.'))
+
+    def _batches(self, batch_size, limit=None):
+        """Yields [(user_id, dates, totals)] batches from one grouped query, streamed in user order."""
+        rows = (
+            DailySpend.objects.values('user_id', 'date').annotate(day_total=Sum('total'))
+            .order_by('user_id', 'date').values_list('user_id', 'date', 'day_total')
+            .iterator(chunk_size=10_000)
+        )
+        users = (
+            (user_id, *map(list, zip(*((date, total) for _, date, total in group))))
+            for user_id, group in itertools.groupby(rows, key=lambda row: row[0])
+        )
+        if limit is not None:
+            users = itertools.islice(users, limit)
+        while batch := list(itertools.islice(users, batch_size)):
+            yield batch
+
+    def _recent_rows(self, user_ids, today):
+        """The month-end projection rows (see project_month_end) of each of the users, from one query."""
+        rows = (
+            DailySpend.objects.filter(user_id__in=user_ids, date__gt=today - timedelta(days=SMOOTHING_HISTORY_DAYS),
+                                      date__lte=today)
+            .values_list('user_id', 'category_id', 'date', 'total')
+        )
+        recent = {}
+        for user_id, category_id, date, total in rows:
+            recent.setdefault(user_id, []).append((category_id, date, total))
+        return recent
+
+    def _store(self, futures, report):
+        now = timezone.now()
+        results = []
+        states = []
+        for future in futures:
+            for user_id, forecast, fit_seconds, error, model_state, projections in future.result():
+                self.fit_times.append(fit_seconds)
+                if report:
+                    report.writerow([user_id, forecast, f'{fit_seconds:.4f}', error or ''])
+                if error:
+                    # Keep the user's previous forecast rather than replacing it with nothing
+                    self.failures += 1
+                    self.stderr.write(f'Forecast for user {user_id} failed: {error}')
+                    continue
+                results.append(ForecastResult(
+                    user_id=user_id, amount=forecast, computed_at=now, fit_seconds=fit_seconds,
+                    projections=ForecastResult.pack_projections(projections), projected_on=self.today,
+                ))
+                if model_state is not None:
+                    states.append(ForecastModelState(user_id=user_id, state=model_state, updated_at=now))
+        ForecastResult.objects.bulk_create(
+            results, update_conflicts=True, unique_fields=['user'], update_fields=['amount', 'computed_at', 'fit_seconds', 'projections', 'projected_on'],
+        )
+        ForecastModelState.objects.bulk_create(
+            states, update_conflicts=True, unique_fields=['user'], update_fields=['state', 'updated_at'],
+        )
+        # The dashboards showing the old forecasts are out of date
+        DataVersion.bump(*(result.user_id for result in results))
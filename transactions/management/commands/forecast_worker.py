@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from transactions.forecaster import store_forecast
+from transactions.models import ForecastJob, RulesJob
+from transactions.recategorize import run_rules_job
+
+
+class Command(BaseCommand):
+    help = ('Recomputes spending forecasts queued by transaction changes, and runs Smart Rules queued from the '
+            'Smart Rules page, off the request path')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit instead of polling forever')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which a job claimed by a worker that died is retried')
+        parser.add_argument('--max-attempts', type=int, default=5,
+                            help='Runs of a job before it is left alone until it is queued again')
+        parser.add_argument('--retry-after', type=float, default=60.0,
+                            help='Seconds before a failed job is retried, doubled after every further failure')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options['stale_after'])
+        self.max_attempts = options['max_attempts']
+        self.retry_after = timedelta(seconds=options['retry_after'])
+        self.stdout.write('Forecast worker started.')
+        try:
+            while True:
+                close_old_connections()
+                rules_job = RulesJob.claim_next(stale_after, self.max_attempts)
+                if rules_job is not None:
+                    self._run_rules(rules_job)
+                    continue
+                job = ForecastJob.claim_next(stale_after, self.max_attempts)
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                self._run(job)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Forecast worker stopped.')
+
+    def _run(self, job):
+        try:
+            result = store_forecast(job.user_id)
+        except Exception as e:
+            self._failed(job, f'Forecast for user {job.user_id}', e)
+            return
+        job.finish()
+        self.stdout.write(f'Forecast for user {job.user_id}: {result.amount} ({result.fit_seconds:.2f}s)')
+
+    def _run_rules(self, job):
+        try:
+            result = run_rules_job(job)
+        except Exception as e:
+            self._failed(job, f'Smart Rules for user {job.user_id}', e)
+            return
+        self.stdout.write(f'Smart Rules for user {job.user_id}: {result.updated} of {result.scanned} recategorized'
+                          f'{" (dry run)" if job.dry_run else ""}')
+
+    def _failed(self, job, name, error):
+        if job.attempts >= self.max_attempts:
+            job.give_up()
+            self.stderr.write(f'{name} failed {job.attempts} times, giving up until it is queued again: {error}')
+        else:
+            job.retry_later(self.retry_after)
+            self.stderr.write(f'{name} failed (attempt {job.attempts} of {self.max_attempts}), will retry: {error}')
@@ -0,0 +1,44 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.synthetic import generate_user
+
+
+class Command(BaseCommand):
+    help = ('Generates synthetic users with categories, keyword rules, budgets and realistic transactions '
+            '(weekly and yearly seasonality, recurring bills, a monthly salary). Use it to fill a scratch '
+            'database (set DATABASE_URL) for benchmarks and demos.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--transactions', type=int, default=10_000, help='Transactions per user')
+        parser.add_argument('--days', type=int, default=730, help='Days of history per user')
+        parser.add_argument('--prefix', default='synthetic-', help='Username prefix; users are numbered after it')
+        parser.add_argument('--password', help='Password for the generated users, so they can log in (default: none)')
+        parser.add_argument('--no-classifier', action='store_true', help="Don't train the users' learned categorizers")
+        parser.add_argument('--drop', action='store_true', help='Delete the users with this prefix, then exit')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        existing = User.objects.filter(username__startswith=options['prefix'])
+        if options['drop']:
+            deleted = existing.count()
+            existing.delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} users.'))
+            return
+        if existing.exists():
+            raise CommandError(f'Users starting with "{options["prefix"]}" already exist; use --drop or another --prefix.')
+        if options['days'] < 1 or options['transactions'] < 0:
+            raise CommandError('--days must be positive and --transactions non-negative.')
+
+        rng = random.Random(options['seed'])
+        for i in range(options['users']):
+            generate_user(
+                f'{options["prefix"]}{i:04d}', options['transactions'], options['days'], rng,
+                password=options['password'], train=not options['no_classifier'], progress=self.stdout.write,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {options["users"]} users with {options["transactions"]:,} transactions each.'
+        ))
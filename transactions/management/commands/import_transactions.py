@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.importer import CSVImportError, TransactionImporter
+
+
+class Command(BaseCommand):
+    help = 'Imports transactions for a user from a bank statement CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('csv_path')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows validated and written per database transaction')
+        parser.add_argument('--encoding', default='utf-8-sig')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        start = time.perf_counter()
+
+        def progress(result):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'  {result.rows:,} rows read, {result.created:,} imported, {result.duplicates:,} duplicates, '
+                f'{result.invalid:,} invalid ({result.rows / elapsed:,.0f} rows/s)'
+            )
+
+        importer = TransactionImporter(user, chunk_size=options['chunk_size'], progress=progress)
+        try:
+            with open(options['csv_path'], 'rb') as csv_file:
+                result = importer.import_file(csv_file, encoding=options['encoding'])
+        except (OSError, CSVImportError) as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors:
+            self.stdout.write(self.style.WARNING(f'Line {line}: {message}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.created:,} of {result.rows:,} rows in {time.perf_counter() - start:.1f}s '
+            f'({result.duplicates:,} duplicates skipped, {result.invalid:,} invalid).'
+        ))
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.rollups import rebuild_daily_spend, verify_daily_spend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the DailySpend rollup and MonthlySpend counters from transactions, or checks them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only this username (default: every user)')
+        parser.add_argument('--verify', action='store_true', help='Report differences without changing anything')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'User "{options["user"]}" does not exist.')
+
+        # One user at a time, so memory use is bounded by the largest single account
+        mismatched_users = 0
+        for user_id, username in users.values_list('pk', 'username').iterator():
+            if options['verify']:
+                differences = verify_daily_spend(user_id)
+                if differences:
+                    mismatched_users += 1
+                    self.stdout.write(self.style.WARNING(f'{username}: {len(differences)} bucket(s) differ'))
+                    for (rollup, category_id, day), (stored, expected) in sorted(differences.items(), key=lambda item: str(item[0]))[:10]:
+                        self.stdout.write(f'  {rollup} category={category_id} date={day}: stored={stored} expected={expected}')
+            else:
+                buckets = rebuild_daily_spend(user_id)
+                self.stdout.write(f'{username}: {buckets} bucket(s)')
+
+        if options['verify']:
+            if mismatched_users:
+                raise CommandError(f'{mismatched_users} user(s) have an out-of-date rollup. Run rebuild_daily_spend to fix.')
+            self.stdout.write(self.style.SUCCESS('Rollup matches the transactions.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Rollup rebuilt.'))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from transactions.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the SQLite full-text index of transaction descriptions and recreates the triggers that keep it '
+            'current, e.g. after a migration rebuilt the transaction table. Nothing to do on PostgreSQL.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if rebuild_index():
+            self.stdout.write(self.style.SUCCESS(f'Search index rebuilt in {time.perf_counter() - start:.1f}s.'))
+        else:
+            self.stdout.write('This database keeps its search index current itself; nothing to rebuild.')
@@ -0,0 +1,81 @@
+import json
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter, so nothing this command has already imported skews the numbers
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
+application = get_wsgi_application()
+# Import every view, as serving the first request would
+get_resolver().url_patterns
+boot = {'seconds': time.perf_counter() - start, 'rss_kb': rss_kb(),
+        'heavy_modules': [name for name in ('numpy', 'pandas', 'statsmodels') if name in sys.modules]}
+
+start = time.perf_counter()
+from transactions.forecaster import preload_forecasting
+preload_forecasting()
+forecasting = {'seconds': time.perf_counter() - start, 'rss_kb': rss_kb()}
+print(json.dumps({'boot': boot, 'forecasting': forecasting}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Reports how long a web worker takes to boot and how much memory it uses, and what loading '
+            'the forecasting libraries adds, with the slowest imports. Use --output to track it over time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help='Number of slowest top-level imports to list')
+        parser.add_argument('--output', help='Also write the results as JSON to this path')
+
+    def handle(self, *args, **options):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE],
+            capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            raise CommandError(f'The probe failed:\n{process.stderr[-2000:]}')
+        results = json.loads(process.stdout.strip().splitlines()[-1])
+        results['slowest_imports'] = self._slowest_imports(process.stderr, options['top'])
+
+        boot, forecasting = results['boot'], results['forecasting']
+        self.stdout.write(f'Boot (settings, apps, URLconf and views): {boot["seconds"] * 1000:8.0f} ms  '
+                          f'{boot["rss_kb"] / 1024:6.1f} MB RSS')
+        self.stdout.write(f'Loading the forecasting libraries adds:   {forecasting["seconds"] * 1000:8.0f} ms  '
+                          f'{(forecasting["rss_kb"] - boot["rss_kb"]) / 1024:6.1f} MB RSS')
+        if boot['heavy_modules']:
+            self.stdout.write(self.style.WARNING(f'Imported at boot: {", ".join(boot["heavy_modules"])}'))
+        self.stdout.write('Slowest top-level imports (cumulative):')
+        for name, microseconds in results['slowest_imports']:
+            self.stdout.write(f'  {microseconds / 1000:8.1f} ms  {name}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _slowest_imports(self, importtime_output, top):
+        """Parses `python -X importtime` output, keeping the modules imported at the top level."""
+        imports = []
+        for line in importtime_output.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            # Nested imports are indented under the module that imported them
+            if name.startswith('  ') or not cumulative.strip().isdigit():
+                continue
+            imports.append((name.strip(), int(cumulative)))
+        return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
@@ -0,0 +1,41 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from finsight_project.db_routing import REPLICA, replica_configured
+
+
+class Command(BaseCommand):
+    help = ('Copies a SQLite primary database to the SQLite replica (DATABASE_REPLICA_URL), once or every --interval '
+            'seconds, so two files can stand in for a replicated database locally. Each copy is a consistent snapshot '
+            'made with SQLite\'s backup API while the server keeps running. Real replicas are kept up to date by the '
+            'database server itself.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep copying, this many seconds apart, which is the replica lag')
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError('No replica is configured. Set DATABASE_REPLICA_URL.')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[REPLICA]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica only copies SQLite databases.')
+        if primary.settings_dict['NAME'] == replica.settings_dict['NAME']:
+            raise CommandError('The primary and the replica are the same file.')
+
+        while True:
+            started = time.perf_counter()
+            source = sqlite3.connect(primary.settings_dict['NAME'])
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                # In one step: a backup made in steps starts over whenever another connection writes
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            self.stdout.write(f'Replica updated in {time.perf_counter() - started:.2f}s.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions.classifier import train_classifier
+
+
+class Command(BaseCommand):
+    help = ("Trains each user's category classifier from scratch on their categorized transactions. "
+            'Saves keep it up to date afterwards; run this once to start, or to rebuild it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only this username (default: every user)')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f'User "{options["user"]}" does not exist.')
+
+        for user_id, username in users.values_list('pk', 'username').iterator():
+            classifier = train_classifier(user_id)
+            self.stdout.write(f'{username}: {classifier.examples} transaction(s), {len(classifier.counts)} categories')
+        self.stdout.write(self.style.SUCCESS('Classifiers trained.'))
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_spend(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    DailySpend = apps.get_model('transactions', 'DailySpend')
+    rows = (
+        Transaction.objects.filter(transaction_type='expense')
+        .annotate(day=TruncDate('date'))
+        .values('user_id', 'category_id', 'day')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    DailySpend.objects.bulk_create(
+        (DailySpend(user_id=row['user_id'], category_id=row['category_id'], date=row['day'],
+                    total=row['total'], count=row['count']) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0005_forecast_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_spend', to='transactions.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_spend', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='daily_spend_user_date')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyspend',
+            constraint=models.UniqueConstraint(fields=('user', 'category', 'date'), name='unique_daily_spend'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyspend',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'date'), name='unique_uncategorized_daily_spend'),
+        ),
+        migrations.RunPython(backfill_daily_spend, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0007_transaction_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Add the composite index first, so category lookups stay indexed while the FK index is dropped
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', '-date', '-id'], name='txn_category_date'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='transactions.category'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_monthly_spend(apps, schema_editor):
+    DailySpend = apps.get_model('transactions', 'DailySpend')
+    MonthlySpend = apps.get_model('transactions', 'MonthlySpend')
+    rows = (
+        DailySpend.objects.annotate(month=TruncMonth('date'))
+        .values('user_id', 'category_id', 'month')
+        .annotate(total=Sum('total'), count=Sum('count'))
+        .order_by()
+    )
+    MonthlySpend.objects.bulk_create(
+        (MonthlySpend(user_id=row['user_id'], category_id=row['category_id'], month=row['month'],
+                      total=row['total'], count=row['count']) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0010_category_classifier'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='budget',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='month',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='budget',
+            constraint=models.UniqueConstraint(fields=('user', 'category', 'month'), name='unique_monthly_budget'),
+        ),
+        migrations.AddConstraint(
+            model_name='budget',
+            constraint=models.UniqueConstraint(condition=models.Q(('month__isnull', True)), fields=('user', 'category'), name='unique_standing_budget'),
+        ),
+        migrations.AddField(
+            model_name='monthlyspend',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spend', to='transactions.category'),
+        ),
+        migrations.AddField(
+            model_name='monthlyspend',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spend', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='monthlyspend',
+            index=models.Index(fields=['user', 'month'], name='monthly_spend_user_month'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyspend',
+            constraint=models.UniqueConstraint(fields=('user', 'category', 'month'), name='unique_monthly_spend'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyspend',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'month'), name='unique_uncategorized_monthly_spend'),
+        ),
+        migrations.RunPython(backfill_monthly_spend, migrations.RunPython.noop),
+    ]
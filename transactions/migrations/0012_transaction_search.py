@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# SQLite: an FTS5 index of the descriptions with the trigram tokenizer, so a search matches any
+# part of a description ("swiggy" in "UPI/SWIGGY123@ybl"), not just whole words. Each entry's rowid
+# is (user_id << 32) + id, so one user's entries are a rowid range that a search can seek to. It is
+# contentless, as the descriptions are in the transaction table, and triggers keep it in step.
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE transaction_search USING fts5(description, content='', tokenize='trigram')",
+    """CREATE TRIGGER transaction_search_insert AFTER INSERT ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(rowid, description) VALUES ((new.user_id << 32) + new.id, new.description);
+    END""",
+    """CREATE TRIGGER transaction_search_delete AFTER DELETE ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(transaction_search, rowid, description)
+        VALUES ('delete', (old.user_id << 32) + old.id, old.description);
+    END""",
+    """CREATE TRIGGER transaction_search_update AFTER UPDATE OF user_id, description ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(transaction_search, rowid, description)
+        VALUES ('delete', (old.user_id << 32) + old.id, old.description);
+        INSERT INTO transaction_search(rowid, description) VALUES ((new.user_id << 32) + new.id, new.description);
+    END""",
+    """INSERT INTO transaction_search(rowid, description)
+    SELECT (user_id << 32) + id, description FROM transactions_transaction""",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS transaction_search_insert',
+    'DROP TRIGGER IF EXISTS transaction_search_delete',
+    'DROP TRIGGER IF EXISTS transaction_search_update',
+    'DROP TABLE IF EXISTS transaction_search',
+]
+
+# PostgreSQL: a trigram GIN index on (user_id, description), which serves
+# user_id = ... AND description ILIKE '%...%'
+POSTGRESQL_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE EXTENSION IF NOT EXISTS btree_gin',
+    'CREATE INDEX txn_user_description_trgm ON transactions_transaction USING gin (user_id, description gin_trgm_ops)',
+]
+POSTGRESQL_DROP = ['DROP INDEX IF EXISTS txn_user_description_trgm']
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}.get(schema_editor.connection.vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}.get(schema_editor.connection.vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_monthly_budgets'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
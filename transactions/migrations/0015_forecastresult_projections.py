@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0014_classifierchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecastresult',
+            name='projected_on',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='forecastresult',
+            name='projections',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0016_rulesjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecastjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='forecastjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rulesjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='rulesjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
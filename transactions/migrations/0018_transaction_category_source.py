@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+# SQLite: adding (or removing) the column rebuilds the transaction table, which drops the search
+# index's triggers (see 0012). The index itself stays valid, as rowids and descriptions are kept.
+SQLITE_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS transaction_search_insert',
+    'DROP TRIGGER IF EXISTS transaction_search_delete',
+    'DROP TRIGGER IF EXISTS transaction_search_update',
+    """CREATE TRIGGER transaction_search_insert AFTER INSERT ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(rowid, description) VALUES ((new.user_id << 32) + new.id, new.description);
+    END""",
+    """CREATE TRIGGER transaction_search_delete AFTER DELETE ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(transaction_search, rowid, description)
+        VALUES ('delete', (old.user_id << 32) + old.id, old.description);
+    END""",
+    """CREATE TRIGGER transaction_search_update AFTER UPDATE OF user_id, description ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(transaction_search, rowid, description)
+        VALUES ('delete', (old.user_id << 32) + old.id, old.description);
+        INSERT INTO transaction_search(rowid, description) VALUES ((new.user_id << 32) + new.id, new.description);
+    END""",
+]
+
+
+def recreate_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in SQLITE_TRIGGERS:
+            schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0017_job_attempts'),
+    ]
+
+    operations = [
+        # Reversed, this runs after the column is removed
+        migrations.RunPython(migrations.RunPython.noop, recreate_search_triggers),
+        migrations.AddField(
+            model_name='transaction',
+            name='category_source',
+            field=models.CharField(choices=[('user', 'Chosen by the user'), ('auto', 'Suggested')], default='user', max_length=4),
+        ),
+        migrations.RunPython(recreate_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0018_transaction_category_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecastjob',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rulesjob',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,9 @@
+from decimal import Decimal
+
 # We need to import the built-in User model to link transactions to users
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 
 
@@ -30,13 +33,21 @@ class Transaction(models.Model):
         ('expense', 'Expense'),
         ('income', 'Income'),
     )
+    CATEGORY_SOURCE_CHOICES = (
+        ('user', 'Chosen by the user'),
+        ('auto', 'Suggested'),
+    )
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
-    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    # No single-column index: every index below starts with user, so it already covers user lookups
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions', db_index=False)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions', db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=7, choices=TRANSACTION_TYPE_CHOICES)
     description = models.CharField(max_length=255)
     date = models.DateTimeField(default=timezone.now)
+    # Whether the category was chosen by the user (or came with an import) or suggested by the
+    # rules or the classifier. Only the user's own choices train the classifier.
+    category_source = models.CharField(max_length=4, choices=CATEGORY_SOURCE_CHOICES, default='user')
 
     def __str__(self):
         return f"{self.user.username} - {self.description} ({self.amount})"
@@ -44,6 +55,14 @@ class Transaction(models.Model):
     class Meta:
         # Orders transactions by date, with the most recent ones first
         ordering = ['-date']
+        # Shaped to the hot queries: everything is per user, filtered by a date range and/or
+        # type and ordered by date (id breaks ties for stable paging). Checked by `bench_queries --check`.
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'], name='txn_user_date'),
+            models.Index(fields=['user', 'transaction_type', '-date'], name='txn_user_type_date'),
+            # A category belongs to one user, so this also covers category lookups and history filtered by category
+            models.Index(fields=['category', '-date', '-id'], name='txn_category_date'),
+        ]
 
 class Keyword(models.Model):
         """
@@ -63,15 +82,356 @@ class Keyword(models.Model):
 class Budget(models.Model):
         """
         Represents a user's monthly budget for a specific category.
+        A budget without a month is the standing one, used for every month that has no budget of its own.
         """
         user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budgets')
         category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='budgets')
         amount = models.DecimalField(max_digits=10, decimal_places=2)
-        # We can add month/year fields later, for now, it's a general monthly budget.
+        # The first day of the month this budget is for, or None for the standing budget
+        month = models.DateField(null=True, blank=True)
     
         def __str__(self):
-            return f"{self.user.username}'s budget for {self.category.name}: ₹{self.amount}"
+            period = self.month.strftime('%B %Y') if self.month else 'every month'
+            return f"{self.user.username}'s budget for {self.category.name} ({period}): ₹{self.amount}"
     
         class Meta:
-            # A user can only have one budget per category
-            unique_together = ('user', 'category') 
\ No newline at end of file
+            # A user can only have one budget per category and month, and one standing budget per category
+            constraints = [
+                models.UniqueConstraint(fields=['user', 'category', 'month'], name='unique_monthly_budget'),
+                models.UniqueConstraint(fields=['user', 'category'], condition=models.Q(month__isnull=True),
+                                        name='unique_standing_budget'),
+            ]
+
+
+class RulesVersion(models.Model):
+    """
+    A per-user counter that is bumped whenever the user's categories or keywords change.
+    The categorizer uses it to tell whether a cached, compiled rule set is still current.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='rules_version')
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}'s rules (v{self.version})"
+
+    @classmethod
+    def current(cls, user_id):
+        """Returns the user's current rules version. Users whose rules never changed have no row yet: version 0."""
+        version = cls.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+        return version or 0
+
+    @classmethod
+    def bump(cls, user_id):
+        # The row is only created here, when rules are written, so reads stay reads. A user without
+        # one may have been cached at version 0, so it starts at 1.
+        if not cls.objects.filter(user_id=user_id).update(version=F('version') + 1):
+            _, created = cls.objects.get_or_create(user_id=user_id, defaults={'version': 1})
+            if not created:
+                cls.objects.filter(user_id=user_id).update(version=F('version') + 1)
+
+
+class DataVersion(models.Model):
+    """
+    A per-user counter that is bumped whenever anything the dashboard or the JSON endpoints show
+    changes: transactions, budgets, categories, keywords or the stored forecast. Their ETags and
+    cached template fragments are keyed on it (see transactions/conditional.py).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='data_version')
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user.username}'s data (v{self.version})"
+
+    @classmethod
+    def for_user(cls, user_id):
+        """Returns the user's counter, creating it on first use."""
+        counter, _ = cls.objects.get_or_create(user_id=user_id)
+        return counter
+
+    @classmethod
+    def bump(cls, *user_ids):
+        # A missing row needs no bump: no response can have been keyed on it
+        cls.objects.filter(user_id__in=user_ids).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+class CategoryClassifier(models.Model):
+    """
+    A user's learned categorizer: naive Bayes counts over their categorized transactions, kept up
+    to date as transactions are saved, by way of ClassifierChange (see classifier.py, which owns
+    the `data` format).
+    `version` is bumped on every update so cached copies can tell they are out of date.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='category_classifier')
+    data = models.BinaryField()
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s category classifier (v{self.version})"
+
+
+class ClassifierChange(models.Model):
+    """
+    A transaction change that the user's CategoryClassifier has yet to learn. Saves queue these
+    instead of rewriting the stored model, and they are folded into it in batches (see classifier.py).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='classifier_changes')
+    # A deleted category's changes go with it, as the model forgets the category anyway
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    description = models.CharField(max_length=255)
+    # 1 learns the description, -1 unlearns it
+    weight = models.SmallIntegerField()
+
+    def __str__(self):
+        return f"{self.weight:+d} {self.description} ({self.category_id})"
+
+
+class WorkerJob(models.Model):
+    """
+    A job for the forecast_worker command, at most one per user. Workers claim jobs with
+    claim_next(); a failed run is retried later with retry_later(), and after max_attempts runs
+    the job is marked failed with give_up() until it is queued again.
+    """
+    requested_at = models.DateTimeField(default=timezone.now)
+    # Set while a worker is running it; a job stuck here for too long is picked up again
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Runs started since it was queued, counting ones whose worker died
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not claimed again before this, after a failed run
+    retry_at = models.DateTimeField(null=True, blank=True)
+    # Set when the last allowed run failed; the job isn't run again until it is queued again
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def claimable(cls, now, stale_after):
+        return (
+            (models.Q(started_at__isnull=True) | models.Q(started_at__lt=now - stale_after))
+            & (models.Q(retry_at__isnull=True) | models.Q(retry_at__lte=now))
+            & models.Q(failed_at__isnull=True)
+        )
+
+    @classmethod
+    def claim_next(cls, stale_after, max_attempts=None):
+        """
+        Claims the oldest job that is waiting, or whose worker seems to have died, and has been
+        run fewer than max_attempts times. Returns None when there is none.
+        """
+        now = timezone.now()
+        claimable = cls.claimable(now, stale_after)
+        if max_attempts is not None:
+            # Ones whose last allowed run died with its worker have failed
+            for job in cls.objects.filter(claimable, attempts__gte=max_attempts)[:10]:
+                job.give_up()
+            claimable &= models.Q(attempts__lt=max_attempts)
+        for job in cls.objects.filter(claimable).order_by('requested_at')[:10]:
+            # Only one worker can win the conditional update
+            claimed = cls.objects.filter(claimable, pk=job.pk, started_at=job.started_at).update(
+                started_at=now, attempts=models.F('attempts') + 1)
+            if claimed:
+                job.started_at = now
+                job.attempts += 1
+                return job
+        return None
+
+    def retry_later(self, backoff):
+        """
+        Releases a failed run, to be claimed again after `backoff`, doubled for every earlier
+        attempt. If the job was queued again meanwhile, the new run can start right away.
+        """
+        jobs = type(self).objects.filter(pk=self.pk)
+        retry_at = timezone.now() + backoff * 2 ** (self.attempts - 1)
+        if not jobs.filter(requested_at=self.requested_at).update(started_at=None, retry_at=retry_at):
+            jobs.update(started_at=None)
+
+    def give_up(self):
+        """
+        Marks the job failed after its last allowed run. It waits until it is queued again, unless
+        that has happened already.
+        """
+        jobs = type(self).objects.filter(pk=self.pk)
+        if not jobs.filter(requested_at=self.requested_at).update(started_at=None, failed_at=timezone.now()):
+            jobs.update(started_at=None)
+
+
+class ForecastJob(WorkerJob):
+    """
+    A pending forecast recompute for a user, processed by the forecast_worker command.
+    There is at most one row per user, so any number of writes coalesce into one recompute.
+    requested_at is the last time the user's data changed.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='forecast_job')
+
+    def __str__(self):
+        return f"Forecast job for {self.user.username} (requested {self.requested_at:%Y-%m-%d %H:%M})"
+
+    @classmethod
+    def enqueue(cls, user_id):
+        # New data gets a fresh set of attempts
+        cls.objects.update_or_create(user_id=user_id, defaults={
+            'requested_at': timezone.now(), 'attempts': 0, 'retry_at': None, 'failed_at': None,
+        })
+
+    def finish(self):
+        """
+        Removes the job, unless the user's data changed again while it was running,
+        in which case it goes back in the queue.
+        """
+        if not ForecastJob.objects.filter(pk=self.pk, requested_at=self.requested_at).delete()[0]:
+            ForecastJob.objects.filter(pk=self.pk).update(started_at=None)
+
+
+class RulesJob(WorkerJob):
+    """
+    A run of the user's Smart Rules over their past transactions (see recategorize.py), queued
+    from the Smart Rules page. The row stays after the run to show its progress and result, and
+    there is at most one per user, so a new run replaces the last one.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='rules_job')
+    include_categorized = models.BooleanField(default=False)
+    dry_run = models.BooleanField(default=False)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Progress so far, then the result; by_category is {category id: transactions moved (or to be moved)}
+    scanned = models.PositiveIntegerField(default=0)
+    matched = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    by_category = models.JSONField(default=dict, blank=True)
+    # False when a run in the web request stopped at APPLY_RULES_MAX_SYNC_ROWS
+    complete = models.BooleanField(default=True)
+
+    def __str__(self):
+        state = ('failed' if self.failed_at else 'finished' if self.finished_at
+                 else 'running' if self.started_at else 'queued')
+        return f"Rules job for {self.user.username} ({state}, {self.updated} updated)"
+
+    @classmethod
+    def enqueue(cls, user_id, include_categorized=False, dry_run=False, started=False):
+        """Queues a new run, replacing the last one. With `started`, the caller runs it itself and no worker claims it."""
+        now = timezone.now()
+        job, _ = cls.objects.update_or_create(user_id=user_id, defaults={
+            'include_categorized': include_categorized, 'dry_run': dry_run, 'requested_at': now,
+            'started_at': now if started else None, 'attempts': 0, 'retry_at': None, 'failed_at': None, 'finished_at': None,
+            'scanned': 0, 'matched': 0, 'updated': 0, 'by_category': {}, 'complete': True,
+        })
+        return job
+
+    @classmethod
+    def claimable(cls, now, stale_after):
+        return super().claimable(now, stale_after) & models.Q(finished_at__isnull=True)
+
+    def give_up(self):
+        """Ends the run as it stands, so the page shows it failed rather than in progress."""
+        super().give_up()
+        RulesJob.objects.filter(pk=self.pk, requested_at=self.requested_at).update(
+            finished_at=timezone.now(), complete=False)
+
+    def record(self, result, finished=False):
+        """
+        Saves a RecategorizeResult as this run's progress, or with `finished` as its result.
+        Nothing is saved once the job has been queued again, as the new run owns the row.
+        """
+        RulesJob.objects.filter(pk=self.pk, requested_at=self.requested_at).update(
+            scanned=result.scanned, matched=result.matched, updated=result.updated,
+            by_category={str(category_id): count for category_id, count in result.by_category.items()},
+            finished_at=timezone.now() if finished else None, complete=result.complete,
+        )
+
+
+class ForecastResult(models.Model):
+    """
+    The latest stored 30-day spending forecast for a user, written by the forecast worker.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='forecast_result')
+    # None when there isn't enough data to forecast
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    computed_at = models.DateTimeField()
+    fit_seconds = models.FloatField(default=0)
+    # Month-end spending per category as {category id, or 'none' for uncategorized: amount},
+    # projected on `projected_on`
+    projections = models.JSONField(default=dict, blank=True)
+    projected_on = models.DateField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s forecast: {self.amount} (at {self.computed_at:%Y-%m-%d %H:%M})"
+
+    @staticmethod
+    def pack_projections(projections):
+        """{category_id: Decimal} as stored in `projections`."""
+        return {'none' if category_id is None else str(category_id): str(amount) for category_id, amount in projections.items()}
+
+    def projections_for(self, today):
+        """
+        The stored projections as {category_id: Decimal}, or None if they were made in another month.
+        Ones from earlier in the month are still returned, as the best there is until they are redone.
+        """
+        if self.projected_on is None or (self.projected_on.year, self.projected_on.month) != (today.year, today.month):
+            return None
+        return {None if key == 'none' else int(key): Decimal(amount) for key, amount in self.projections.items()}
+
+
+class ForecastModelState(models.Model):
+    """
+    A user's last fitted SARIMAX model: its parameters and the Kalman filter state at the end of
+    the data it has seen, so the next forecast only has to process the days added since.
+    The layout of `state` is owned by forecaster.py.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='forecast_model_state')
+    state = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s forecast model (updated {self.updated_at:%Y-%m-%d %H:%M})"
+
+
+class DailySpend(models.Model):
+    """
+    Expense totals per user, category and day, kept current as transactions are written
+    (see rollups.py). The dashboard and the forecaster read this instead of every transaction.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_spend')
+    # None holds the uncategorized expenses
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_spend')
+    date = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date} - {self.category or 'Uncategorized'}: {self.total} ({self.count})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category', 'date'], name='unique_daily_spend'),
+            # NULLs never clash in a unique index, so uncategorized days need their own constraint
+            models.UniqueConstraint(fields=['user', 'date'], condition=models.Q(category__isnull=True),
+                                    name='unique_uncategorized_daily_spend'),
+        ]
+        indexes = [models.Index(fields=['user', 'date'], name='daily_spend_user_date')]
+
+
+class MonthlySpend(models.Model):
+    """
+    Expense totals per user, category and calendar month, kept current alongside DailySpend
+    (see rollups.py). Budget progress and budget history read these, so they cost the same
+    however many transactions a month holds.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_spend')
+    # None holds the uncategorized expenses
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='monthly_spend')
+    # The first day of the month
+    month = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.month:%Y-%m} - {self.category or 'Uncategorized'}: {self.total} ({self.count})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category', 'month'], name='unique_monthly_spend'),
+            models.UniqueConstraint(fields=['user', 'month'], condition=models.Q(category__isnull=True),
+                                    name='unique_uncategorized_monthly_spend'),
+        ]
+        indexes = [models.Index(fields=['user', 'month'], name='monthly_spend_user_month')]
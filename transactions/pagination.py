@@ -0,0 +1,52 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .filters import TransactionFilterError
+
+
+def encode_cursor(date, pk):
+    """An opaque cursor pointing just after the row with this (date, id)."""
+    return base64.urlsafe_b64encode(f'{date.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date, pk = raw.split('|')
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        date = None
+    if date is None:
+        raise TransactionFilterError("'cursor' is not valid.")
+    return date, pk
+
+
+def seek(queryset, cursor):
+    """`queryset` ordered newest first, starting just after `cursor` (or at the top if it is empty)."""
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        # Same as (date, id) < (cursor date, cursor id), written so `date <= ?` can drive an index range scan
+        queryset = queryset.filter(Q(date__lte=date) & (Q(date__lt=date) | Q(id__lt=pk)))
+    return queryset
+
+
+def keyset_page(queryset, cursor, limit):
+    """
+    Returns (rows, next_cursor) for one page of `queryset`, newest first, starting after `cursor`.
+
+    Pages are found by seeking on (date, id) rather than with OFFSET, so a page deep in the
+    history costs the same as the first one. `queryset` must be a values() queryset that
+    includes 'date' and 'id'. next_cursor is None on the last page.
+    """
+    # One extra row tells us whether there is a next page
+    rows = list(seek(queryset, cursor)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['date'], rows[-1]['id'])
+    return rows, next_cursor
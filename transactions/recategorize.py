@@ -0,0 +1,140 @@
+"""
+Applies a user's Smart Rules to the transactions they already have, e.g. after adding a keyword,
+which otherwise only affects suggestions for new transactions.
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from . import classifier, rollups
+from .categorizer import TransactionCategorizer
+from .models import Transaction
+from .pagination import encode_cursor, seek
+from .signals import transactions_changed
+
+# Transactions a run in a web request checks at most (see run_rules_job), if APPLY_RULES_MAX_SYNC_ROWS isn't set
+DEFAULT_APPLY_RULES_MAX_SYNC_ROWS = 100_000
+
+
+class RecategorizeResult:
+    """
+    Running totals for a run. Passed to the progress callback after every chunk.
+    """
+    def __init__(self):
+        self.scanned = 0
+        # Transactions a rule puts in another category (the ones a dry run would change)
+        self.matched = 0
+        self.updated = 0
+        # category id -> transactions moved (or, in a dry run, to be moved) into it
+        self.by_category = Counter()
+        # False when the run stopped at max_rows with transactions left to check
+        self.complete = True
+
+
+class RuleApplier:
+    """
+    Runs the user's compiled keyword rules over their existing transactions and moves each one a
+    rule matches into that rule's category. The learned classifier is not used: only rules the
+    user wrote change their history.
+
+    Transactions are read newest first in chunks of `chunk_size`, seeking on (date, id) as the
+    history pages do, so memory use depends on the chunk size and not on the account size. The
+    matches in a chunk are grouped by category and written with one UPDATE ... WHERE id IN (...)
+    per group, in one transaction with the spending rollups and the classifier.
+
+    With keep_existing (the default) only uncategorized transactions are considered; with
+    keep_existing=False, categorized transactions a rule disagrees with are moved too. Moved
+    transactions are marked as suggested (category_source 'auto'), so the classifier forgets the
+    categories the user had chosen for them and doesn't learn the rules' ones. A dry run counts what would change and writes nothing. With max_rows, the run
+    stops once it has checked that many transactions.
+    """
+    def __init__(self, user, chunk_size=5000, keep_existing=True, dry_run=False, progress=None, max_rows=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.keep_existing = keep_existing
+        self.dry_run = dry_run
+        self.progress = progress
+        self.categorizer = TransactionCategorizer.for_user(user)
+
+    def run(self):
+        result = RecategorizeResult()
+        transactions = Transaction.objects.filter(user=self.user)
+        if self.keep_existing:
+            transactions = transactions.filter(category__isnull=True)
+        transactions = transactions.values('id', 'date', 'description', 'category_id')
+
+        cursor = None
+        while True:
+            size = self.chunk_size
+            if self.max_rows is not None:
+                size = min(size, self.max_rows - result.scanned)
+                if size <= 0:
+                    result.complete = not seek(transactions, cursor).exists()
+                    break
+            chunk = list(seek(transactions, cursor)[:size])
+            if not chunk:
+                break
+            cursor = encode_cursor(chunk[-1]['date'], chunk[-1]['id'])
+            self._apply_chunk(chunk, result)
+            if self.progress:
+                self.progress(result)
+            if len(chunk) < size:
+                break
+        if result.updated:
+            # update() sends no signals, so refresh the derived data ourselves
+            transactions_changed(self.user.pk)
+        return result
+
+    def _apply_chunk(self, chunk, result):
+        suggestions = self.categorizer.suggest_categories([row['description'] for row in chunk], use_classifier=False)
+        # id -> (category it had when read, category a rule puts it in)
+        moves = {
+            row['id']: (row['category_id'], category_id)
+            for row, category_id in zip(chunk, suggestions)
+            if category_id is not None and category_id != row['category_id']
+        }
+        result.scanned += len(chunk)
+        result.matched += len(moves)
+        if not moves:
+            return
+        if self.dry_run:
+            result.by_category.update(new for _, new in moves.values())
+            return
+
+        with transaction.atomic():
+            # Re-read under a lock, skipping any transaction edited since the chunk was read
+            current = [
+                row for row in Transaction.objects.select_for_update().filter(user=self.user, id__in=list(moves))
+                .values('id', 'description', 'category_source', *rollups.TRACKED_FIELDS)
+                if row['category_id'] == moves[row['id']][0]
+            ]
+            groups = defaultdict(list)
+            for row in current:
+                groups[moves[row['id']][1]].append(row['id'])
+            for category_id, ids in groups.items():
+                Transaction.objects.filter(id__in=ids).update(category_id=category_id, category_source='auto')
+                result.by_category[category_id] += len(ids)
+
+            rollups.apply_changes((row, {**row, 'category_id': moves[row['id']][1]}) for row in current)
+            if classifier.enabled():
+                # A rule's category is a suggestion, so the classifier only forgets the user's own choices
+                classifier.update_classifier(self.user.pk, (
+                    (row['description'], row['category_id'], -1) for row in current if row['category_source'] == 'user'
+                ))
+        result.updated += len(current)
+
+
+def run_rules_job(job, max_rows=None):
+    """Runs a queued RulesJob, saving its progress after every chunk. Returns the RecategorizeResult."""
+    result = RuleApplier(
+        job.user, keep_existing=not job.include_categorized, dry_run=job.dry_run, progress=job.record, max_rows=max_rows,
+    ).run()
+    job.record(result, finished=True)
+    return result
+
+
+def max_sync_rows():
+    """How many transactions a run in a web request may check, for deployments without a worker."""
+    return getattr(settings, 'APPLY_RULES_MAX_SYNC_ROWS', DEFAULT_APPLY_RULES_MAX_SYNC_ROWS)
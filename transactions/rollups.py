@@ -0,0 +1,233 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySpend, MonthlySpend, Transaction
+
+# The Transaction fields that decide which buckets it counts towards, and by how much
+TRACKED_FIELDS = ('user_id', 'transaction_type', 'category_id', 'date', 'amount')
+CENTS = Decimal('0.01')
+
+
+def month_start(day):
+    """The first day of the month `day` is in; MonthlySpend and Budget rows are keyed on it."""
+    return day.replace(day=1)
+
+
+# The rollups kept current as transactions change: the model, its date field, and the
+# period (from the transaction's local date) a transaction counts towards
+ROLLUPS = (
+    (DailySpend, 'date', lambda day: day),
+    (MonthlySpend, 'month', month_start),
+)
+
+
+def snapshot(t):
+    """The tracked fields of a Transaction instance, as a dict."""
+    return {field: getattr(t, field) for field in TRACKED_FIELDS}
+
+
+def _bucket(values):
+    """The (user, category, day) bucket a transaction counts towards, or None for income."""
+    if values['transaction_type'] != 'expense':
+        return None
+    return values['user_id'], values['category_id'], timezone.localtime(values['date']).date()
+
+
+def _in_period(bucket, period):
+    return None if bucket is None else (bucket[0], bucket[1], period(bucket[2]))
+
+
+def _add(model, field, bucket, amount, count):
+    """Atomically adds to a bucket with an F() update, creating it on first use."""
+    user_id, category_id, period = bucket
+    rows = model.objects.filter(user_id=user_id, category_id=category_id, **{field: period})
+    if rows.update(total=F('total') + amount, count=F('count') + count):
+        if count < 0:
+            rows.filter(count__lte=0).delete()
+        return
+    if count <= 0:
+        # Nothing to take away from; `rebuild_daily_spend` fixes a rollup that got out of sync
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(user_id=user_id, category_id=category_id, total=amount, count=count, **{field: period})
+    except IntegrityError:
+        # Another request created the bucket first
+        rows.update(total=F('total') + amount, count=F('count') + count)
+
+
+def apply_change(old, new):
+    """
+    Moves a transaction's contribution from its old buckets to its new ones.
+    `old` is None for a new transaction and `new` is None for a deleted one.
+    """
+    old_day = _bucket(old) if old else None
+    new_day = _bucket(new) if new else None
+    for model, field, period in ROLLUPS:
+        # An edit that moves a transaction to another day of the same month keeps its monthly bucket
+        old_bucket, new_bucket = _in_period(old_day, period), _in_period(new_day, period)
+        if old_bucket is not None and old_bucket == new_bucket:
+            if old['amount'] != new['amount']:
+                _add(model, field, old_bucket, Decimal(new['amount']) - Decimal(old['amount']), 0)
+            continue
+        if old_bucket is not None:
+            _add(model, field, old_bucket, -Decimal(old['amount']), -1)
+        if new_bucket is not None:
+            _add(model, field, new_bucket, Decimal(new['amount']), 1)
+
+
+def _add_many(model, field, deltas):
+    """
+    _add() for many buckets of one rollup at once, {bucket: (amount, count)}, in a fixed number of
+    queries: the buckets are read and locked in one, then updated, deleted and created in bulk.
+    """
+    categories = {category_id for _, category_id, _ in deltas}
+    in_categories = Q(category_id__in=categories - {None})
+    if None in categories:
+        in_categories |= Q(category__isnull=True)
+    with transaction.atomic():
+        # A superset of the buckets wanted, matched up below
+        rows = {
+            (row.user_id, row.category_id, getattr(row, field)): row
+            for row in model.objects.select_for_update().filter(
+                in_categories, user_id__in={user_id for user_id, _, _ in deltas},
+                **{f'{field}__in': {period for _, _, period in deltas}},
+            )
+        }
+        changed, emptied, created = [], [], []
+        for (user_id, category_id, period), (amount, count) in deltas.items():
+            row = rows.get((user_id, category_id, period))
+            if row is None:
+                # As in _add(), there is nothing to take away from a missing bucket
+                if count > 0:
+                    created.append(model(user_id=user_id, category_id=category_id, total=amount, count=count,
+                                         **{field: period}))
+                continue
+            row.total += amount
+            row.count += count
+            (emptied if row.count <= 0 else changed).append(row)
+        if emptied:
+            model.objects.filter(pk__in=[row.pk for row in emptied]).delete()
+        model.objects.bulk_update(changed, ['total', 'count'])
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(created)
+        except IntegrityError:
+            # Another request created one of the buckets first
+            for row in created:
+                _add(model, field, (row.user_id, row.category_id, getattr(row, field)), row.total, row.count)
+
+
+def apply_changes(changes):
+    """
+    apply_change() for a batch of (old, new) pairs, e.g. after a bulk_create or a queryset
+    update(), in a few queries per rollup however many transactions and buckets it touches.
+    """
+    deltas = {rollup: defaultdict(lambda: [Decimal(0), 0]) for rollup in ROLLUPS}
+    for old, new in changes:
+        for values, sign in ((old, -1), (new, 1)):
+            day = _bucket(values) if values else None
+            if day is not None:
+                for rollup in ROLLUPS:
+                    delta = deltas[rollup][_in_period(day, rollup[2])]
+                    delta[0] += sign * Decimal(values['amount'])
+                    delta[1] += sign
+    for (model, field, _), buckets in deltas.items():
+        # Moves within a bucket cancel out
+        buckets = {bucket: (amount, count) for bucket, (amount, count) in buckets.items() if amount or count}
+        if buckets:
+            _add_many(model, field, buckets)
+
+
+def add_transactions(transactions):
+    """Adds a batch of new transactions, e.g. from bulk_create, with one update per bucket."""
+    apply_changes((None, snapshot(t)) for t in transactions)
+
+
+def uncategorize(category):
+    """
+    Moves a category's buckets to the uncategorized ones. Deleting a category sets its
+    transactions' category to NULL with a plain UPDATE, so no Transaction signals are sent.
+    """
+    for model, field, _ in ROLLUPS:
+        for period, total, count in model.objects.filter(category=category).values_list(field, 'total', 'count'):
+            _add(model, field, (category.user_id, None, period), total, count)
+
+
+def expected_daily_spend(user_id):
+    """The rollup for one user, recomputed from their transactions: {(category_id, date): (total, count)}."""
+    rows = (
+        Transaction.objects.filter(user_id=user_id, transaction_type='expense')
+        .annotate(day=TruncDate('date'))
+        .values('category_id', 'day')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by()
+    )
+    # SQLite sums decimals as floats, so round back to cents as the rollup stores them
+    return {(row['category_id'], row['day']): (row['total'].quantize(CENTS), row['count']) for row in rows}
+
+
+def expected_monthly_spend(expected_daily):
+    """The monthly counters that go with a user's expected_daily_spend(): {(category_id, month): (total, count)}."""
+    months = defaultdict(lambda: (Decimal(0), 0))
+    for (category_id, day), (total, count) in expected_daily.items():
+        month_total, month_count = months[category_id, month_start(day)]
+        months[category_id, month_start(day)] = (month_total + total, month_count + count)
+    return dict(months)
+
+
+def stored_daily_spend(user_id):
+    rows = DailySpend.objects.filter(user_id=user_id).values_list('category_id', 'date', 'total', 'count')
+    return {(category_id, day): (total, count) for category_id, day, total, count in rows}
+
+
+def stored_monthly_spend(user_id):
+    rows = MonthlySpend.objects.filter(user_id=user_id).values_list('category_id', 'month', 'total', 'count')
+    return {(category_id, month): (total, count) for category_id, month, total, count in rows}
+
+
+def rebuild_daily_spend(user_id):
+    """Replaces a user's daily rollup and monthly counters with ones recomputed from their transactions."""
+    expected = expected_daily_spend(user_id)
+    months = expected_monthly_spend(expected)
+    with transaction.atomic():
+        DailySpend.objects.filter(user_id=user_id).delete()
+        DailySpend.objects.bulk_create(
+            DailySpend(user_id=user_id, category_id=category_id, date=day, total=total, count=count)
+            for (category_id, day), (total, count) in expected.items()
+        )
+        MonthlySpend.objects.filter(user_id=user_id).delete()
+        MonthlySpend.objects.bulk_create(
+            MonthlySpend(user_id=user_id, category_id=category_id, month=month, total=total, count=count)
+            for (category_id, month), (total, count) in months.items()
+        )
+    return len(expected) + len(months)
+
+
+def _differences(stored, expected):
+    return {
+        key: (stored.get(key), expected.get(key))
+        for key in expected.keys() | stored.keys()
+        if stored.get(key) != expected.get(key)
+    }
+
+
+def verify_daily_spend(user_id):
+    """
+    Returns the buckets whose stored value differs from the recomputed one, as
+    {(model name, category_id, date): (stored, expected)}, for both the daily and the monthly rollup.
+    """
+    expected = expected_daily_spend(user_id)
+    differences = {}
+    for model, stored, recomputed in (
+        (DailySpend, stored_daily_spend(user_id), expected),
+        (MonthlySpend, stored_monthly_spend(user_id), expected_monthly_spend(expected)),
+    ):
+        for (category_id, day), values in _differences(stored, recomputed).items():
+            differences[model.__name__, category_id, day] = values
+    return differences
@@ -0,0 +1,199 @@
+"""
+Full-text search over transaction descriptions, backed by the index from migration 0012: FTS5
+with the trigram tokenizer on SQLite, a pg_trgm GIN index on PostgreSQL, which serves ILIKE (see
+AnyCaseContains). Either way a term matches anywhere in a description, case-insensitively, so
+"swiggy" finds "UPI/SWIGGY123@ybl".
+
+On SQLite each entry's rowid combines the user and transaction ids, so a search seeks straight to
+the user's own entries instead of walking past every other user's matches (transaction ids must
+stay below 2**32 for that). Triggers on the transaction table keep the index in step, so
+bulk_create() and update() keep it current too. Django rebuilds a SQLite table to alter most of
+its columns, which drops those triggers: a later migration that does that to the transaction
+table should recreate them, or run the rebuild_search_index command afterwards.
+"""
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
+from django.db.models.lookups import IContains
+
+from .filters import TransactionFilterError, filter_transactions
+from .models import Transaction
+
+# Trigram indexes can't look up anything shorter
+MIN_TERM_LENGTH = 3
+MAX_QUERY_LENGTH = 200
+MAX_TERMS = 10
+
+# Search ranks at most this many matches, the most recently added; older ones follow, newest first
+MAX_RANKED_MATCHES = 1000
+
+# SQLite: a date range with at most this many of the user's transactions is scanned instead of
+# using the index, which would go through every match newer than the range first
+SCAN_THRESHOLD = 30000
+
+# SQLite: an index entry's rowid is (user_id << 32) + transaction id
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+# The same triggers as migration 0012 creates
+SQLITE_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS transaction_search_insert',
+    'DROP TRIGGER IF EXISTS transaction_search_delete',
+    'DROP TRIGGER IF EXISTS transaction_search_update',
+    """CREATE TRIGGER transaction_search_insert AFTER INSERT ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(rowid, description) VALUES ((new.user_id << 32) + new.id, new.description);
+    END""",
+    """CREATE TRIGGER transaction_search_delete AFTER DELETE ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(transaction_search, rowid, description)
+        VALUES ('delete', (old.user_id << 32) + old.id, old.description);
+    END""",
+    """CREATE TRIGGER transaction_search_update AFTER UPDATE OF user_id, description ON transactions_transaction BEGIN
+        INSERT INTO transaction_search(transaction_search, rowid, description)
+        VALUES ('delete', (old.user_id << 32) + old.id, old.description);
+        INSERT INTO transaction_search(rowid, description) VALUES ((new.user_id << 32) + new.id, new.description);
+    END""",
+]
+
+SEARCH_FIELDS = ('id', 'date', 'description', 'amount', 'transaction_type', 'category_id')
+
+
+def parse_query(query):
+    """The search terms in `query`, split on whitespace. Raises TransactionFilterError if there are none to look up."""
+    query = (query or '').strip()
+    if len(query) > MAX_QUERY_LENGTH:
+        raise TransactionFilterError(f"'q' can be at most {MAX_QUERY_LENGTH} characters.")
+    terms = list(dict.fromkeys(query.split()))[:MAX_TERMS]
+    if not any(len(term) >= MIN_TERM_LENGTH for term in terms):
+        raise TransactionFilterError(f"'q' must contain a word of at least {MIN_TERM_LENGTH} characters.")
+    return terms
+
+
+def _fts5_query(terms):
+    # Each term as a quoted string, so it's matched literally; FTS5 ANDs them together
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _short_date_range(user, params):
+    """Whether `params` limits the search to a date range with few enough transactions to scan."""
+    if not (params.get('start') or params.get('end')):
+        return False
+    in_range = filter_transactions(Transaction.objects.filter(user=user), {'start': params.get('start'), 'end': params.get('end')})
+    # Read through txn_user_date, and bounded however large the range is
+    return not in_range.order_by()[SCAN_THRESHOLD:SCAN_THRESHOLD + 1].exists()
+
+
+class AnyCaseContains(IContains):
+    """
+    icontains, except that PostgreSQL gets description ILIKE '%term%', which the trigram index
+    serves, rather than Django's UPPER(description) LIKE UPPER('%term%'), which it can't.
+    """
+    def as_postgresql(self, compiler, connection):
+        lhs_sql, lhs_params = compiler.compile(self.lhs)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} ILIKE {rhs_sql}', (*lhs_params, *rhs_params)
+
+
+class TransactionSearch:
+    """
+    The user's transactions whose description contains every term of params['q'], filtered with
+    the rest of `params` as filter_transactions() does, best match first. Sliced like a values()
+    queryset of SEARCH_FIELDS plus category_name. Raises TransactionFilterError for invalid parameters.
+
+    A match is better the shorter its description, i.e. the more of it the query covers, so "rent"
+    ranks "RENT" above "NEFT-RENT TRANSFER OCT": for descriptions this short that is what bm25()
+    comes down to, and it ranks the same on both databases. Equally good matches are newest first.
+
+    Only the MAX_RANKED_MATCHES most recently added matches are ranked, so the first pages cost
+    about the same however common the word is and however large the account. Filters apply before
+    that cut. Older matches follow them, newest first.
+    """
+    def __init__(self, user, params):
+        self.user = user
+        terms = parse_query(params.get('q'))
+        transactions = filter_transactions(Transaction.objects.filter(user=user), params)
+        use_fts = connection.vendor == 'sqlite' and not _short_date_range(user, params)
+        indexed = [term for term in terms if use_fts and len(term) >= MIN_TERM_LENGTH]
+        for term in terms:
+            # Shorter terms aren't in the SQLite index, but are checked on the rows it finds
+            if term not in indexed:
+                transactions = transactions.filter(AnyCaseContains(F('description'), term))
+        self.transactions = transactions
+        self.fts_query = _fts5_query(indexed) if indexed else None
+        self._ranked_ids = None
+
+    def ranked_ids_query(self):
+        """(sql, params) of the query for the ids of the MAX_RANKED_MATCHES most recently added matches, newest first."""
+        if self.fts_query is None:
+            query = self.transactions.order_by('-id').values_list('id')[:MAX_RANKED_MATCHES].query
+            return query.get_compiler(self.transactions.db).as_sql()
+        # Going through the FTS5 table newest first within the user's rowid range reads only their
+        # own entries, and stops at the limit; the filters are checked on each entry's transaction
+        matching = self.transactions.filter(id=RawSQL(f'transaction_search.rowid & {ID_MASK}', ()))
+        filters_sql, filters_params = matching.order_by().values('id').query.get_compiler(self.transactions.db).as_sql()
+        sql = (
+            f'SELECT transaction_search.rowid & {ID_MASK} FROM transaction_search '
+            'WHERE transaction_search.rowid BETWEEN %s AND %s AND transaction_search MATCH %s '
+            f'AND EXISTS ({filters_sql}) ORDER BY transaction_search.rowid DESC LIMIT %s'
+        )
+        first = self.user.pk << ID_BITS
+        return sql, (first, first + ID_MASK, self.fts_query, *filters_params, MAX_RANKED_MATCHES)
+
+    def ranked_ids(self):
+        if self._ranked_ids is None:
+            sql, params = self.ranked_ids_query()
+            with connections[self.transactions.db].cursor() as cursor:
+                cursor.execute(sql, params)
+                self._ranked_ids = [row[0] for row in cursor.fetchall()]
+        return self._ranked_ids
+
+    def ranked_matches(self):
+        return (
+            Transaction.objects.filter(id__in=self.ranked_ids())
+            .values(*SEARCH_FIELDS, category_name=F('category__name'))
+            .order_by(Length('description'), '-date', '-id')
+        )
+
+    def older_matches(self, before_id):
+        """The matches added before transaction `before_id`, newest first."""
+        older = self.transactions.filter(id__lt=before_id)
+        if self.fts_query is not None:
+            first = self.user.pk << ID_BITS
+            older = older.filter(id__in=RawSQL(
+                f'SELECT rowid & {ID_MASK} FROM transaction_search WHERE rowid BETWEEN %s AND %s AND transaction_search MATCH %s',
+                (first, first + before_id - 1, self.fts_query),
+            ))
+        return older.values(*SEARCH_FIELDS, category_name=F('category__name')).order_by('-date', '-id')
+
+    def __getitem__(self, window):
+        start, stop = window.start or 0, window.stop
+        ids = self.ranked_ids()
+        rows = list(self.ranked_matches()[start:stop]) if start < len(ids) else []
+        # Fewer than the cut means there are no older matches
+        if len(ids) == MAX_RANKED_MATCHES and stop > len(ids):
+            rows += self.older_matches(min(ids))[max(start - len(ids), 0):stop - len(ids)]
+        return rows
+
+
+def search_transactions(user, params):
+    """The matches of a search as a TransactionSearch. Raises TransactionFilterError for invalid parameters."""
+    return TransactionSearch(user, params)
+
+
+def rebuild_index():
+    """
+    Recreates the SQLite index's triggers and rebuilds it from the transaction table, e.g. after a
+    migration rebuilt that table. Returns False on other databases, which need no rebuilding.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in SQLITE_TRIGGERS:
+            cursor.execute(sql)
+        # A contentless index can't rebuild itself, so it's emptied and refilled
+        cursor.execute("INSERT INTO transaction_search(transaction_search) VALUES ('delete-all')")
+        cursor.execute(
+            'INSERT INTO transaction_search(rowid, description) '
+            'SELECT (user_id << 32) + id, description FROM transactions_transaction'
+        )
+    return True
@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .forecaster import invalidate_forecast
+from . import classifier, rollups
+from .models import Budget, Category, DataVersion, ForecastJob, Keyword, RulesVersion, Transaction
+
+
+# Set while a bulk write is under way that bumps the data version once itself
+_bulk_writes = ContextVar('bulk_writes', default=False)
+
+
+@contextmanager
+def bulk_writes():
+    """Skips the per-row data version bumps of the writes inside; the caller bumps once instead."""
+    token = _bulk_writes.set(True)
+    try:
+        yield
+    finally:
+        _bulk_writes.reset(token)
+
+
+def _deleting_user(origin):
+    """True when a delete cascades from deleting the user, so there's nothing left to refresh."""
+    return isinstance(origin, User) or getattr(origin, 'model', None) is User
+
+
+def transactions_changed(user_id):
+    """
+    Everything that has to happen after a user's transactions change. Code that writes
+    transactions without sending signals (e.g. bulk_create) should call this itself.
+    """
+    invalidate_forecast(user_id)
+    DataVersion.bump(user_id)
+    if settings.FORECAST_WORKER:
+        ForecastJob.enqueue(user_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Keyword)
+def bump_rules_version(sender, instance, **kwargs):
+    """
+    Any change to a user's categories or keywords invalidates their compiled categorizer.
+    Note that queryset.update() and bulk_create() don't send these signals.
+    """
+    RulesVersion.bump(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Keyword)
+@receiver([post_save, post_delete], sender=Budget)
+def bump_data_version(sender, instance, origin=None, **kwargs):
+    # Category names and budgets show on the dashboard and in the JSON; transactions bump it
+    # in transactions_changed()
+    if not _bulk_writes.get() and not _deleting_user(origin):
+        DataVersion.bump(instance.user_id)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_previous_transaction(sender, instance, **kwargs):
+    # The daily rollup and the classifier need the old values to take them out again
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = (
+            Transaction.objects.filter(pk=instance.pk).values(*rollups.TRACKED_FIELDS, 'description', 'category_source').first()
+        )
+
+
+def _classifier_fields(values):
+    """What the classifier learns from a transaction's field values: its category only if the user chose it."""
+    if values is None:
+        return None
+    return {
+        'user_id': values['user_id'], 'description': values['description'],
+        'category_id': values['category_id'] if values['category_source'] == 'user' else None,
+    }
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    rollups.apply_change(previous, rollups.snapshot(instance))
+    if classifier.enabled():
+        classifier.learn_change(_classifier_fields(previous), _classifier_fields(vars(instance)))
+    transactions_changed(instance.user_id)
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleting_user(origin):
+        rollups.apply_change(rollups.snapshot(instance), None)
+        if classifier.enabled():
+            classifier.learn_change(_classifier_fields(vars(instance)), None)
+        transactions_changed(instance.user_id)
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleted(sender, instance, origin=None, **kwargs):
+    if not _deleting_user(origin):
+        rollups.uncategorize(instance)
+        if classifier.enabled():
+            classifier.forget_category(instance)
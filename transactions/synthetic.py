@@ -0,0 +1,200 @@
+"""
+Realistic made-up accounts for benchmarks and demos: categories, keyword rules, budgets, and
+transactions with weekly and yearly seasonality, recurring bills and a monthly salary.
+"""
+import itertools
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import classifier
+from .models import Budget, Category, Keyword, RulesVersion, Transaction
+from .rollups import rebuild_daily_spend
+from .signals import transactions_changed
+
+# Made-up merchants per category for synthetic descriptions
+SYNTHETIC_MERCHANTS = {
+    'Food': ['swiggy', 'zomato', 'dominos', 'starbucks', 'haldiram', 'barbeque nation', 'chaayos', 'faasos'],
+    'Transport': ['uber', 'ola cabs', 'rapido', 'irctc', 'indigo', 'metro card', 'indian oil', 'hp petrol'],
+    'Shopping': ['amazon', 'flipkart', 'myntra', 'ajio', 'nykaa', 'decathlon', 'croma', 'ikea'],
+    'Bills': ['airtel', 'jio prepaid', 'bescom', 'tata power', 'act fibernet', 'mahanagar gas', 'bsnl', 'vi postpaid'],
+    'Entertainment': ['netflix', 'hotstar', 'spotify', 'bookmyshow', 'pvr cinemas', 'sony liv', 'zee5', 'steam'],
+    'Health': ['apollo pharmacy', 'practo', '1mg', 'pharmeasy', 'cult fit', 'medplus', 'netmeds', 'max hospital'],
+}
+PREFIXES = ['UPI/', 'POS ', 'NEFT-', 'IMPS/', 'ACH D- ', '', 'VPS/']
+SUFFIXES = ['/paytm', '@ybl', '@okaxis', ' bangalore', ' mumbai', '/ref', '']
+
+# Day-to-day purchases: (share of purchases, median amount) per category
+PURCHASES = {
+    'Food': (0.45, 350),
+    'Transport': (0.25, 220),
+    'Shopping': (0.15, 1200),
+    'Entertainment': (0.08, 450),
+    'Health': (0.07, 600),
+}
+# Bills paid on the same day every month: (category, description, day of month, amount)
+RECURRING_BILLS = [
+    ('Bills', 'NEFT-RENT TRANSFER', 1, 25000),
+    ('Health', 'CULT FIT MEMBERSHIP', 3, 1500),
+    ('Bills', 'AIRTEL POSTPAID BILL', 5, 799),
+    ('Entertainment', 'NETFLIX SUBSCRIPTION', 12, 649),
+    ('Bills', 'BESCOM ELECTRICITY', 18, 1800),
+    ('Bills', 'ACT FIBERNET BROADBAND', 22, 1178),
+]
+SALARY = ('NEFT-SALARY CREDIT', 1, 85000)
+
+# Purchases are likelier at weekends...
+WEEKDAY_FACTORS = (0.8, 0.85, 0.9, 0.95, 1.2, 1.5, 1.3)
+# ...and in the festive season, and they are larger then, too
+MONTH_FACTORS = {1: 0.85, 2: 0.9, 3: 1.0, 4: 1.0, 5: 1.05, 6: 0.95, 7: 0.9, 8: 1.0, 9: 1.05, 10: 1.4, 11: 1.6, 12: 1.3}
+# Electricity bills follow the summer
+ELECTRICITY_FACTORS = {3: 1.3, 4: 1.6, 5: 1.8, 6: 1.4}
+# Share of purchases left uncategorized, as imported statements are
+UNCATEGORIZED_SHARE = 0.1
+
+BATCH_SIZE = 10_000
+PROGRESS_EVERY = 100_000
+
+
+def description_for(rng, merchant):
+    """A bank-statement style description for a purchase at `merchant`."""
+    if rng.random() < 0.3:
+        # Typos and truncations, as bank statements have
+        cut = rng.randint(max(3, len(merchant) - 3), len(merchant))
+        merchant = merchant[:cut]
+    return f'{rng.choice(PREFIXES)}{merchant.upper()}{rng.randint(10000, 999999)}{rng.choice(SUFFIXES)}'
+
+
+def synthetic_transactions(rng, count):
+    """Yields `count` (description, category name) pairs."""
+    categories = list(SYNTHETIC_MERCHANTS)
+    for _ in range(count):
+        category = rng.choice(categories)
+        yield description_for(rng, rng.choice(SYNTHETIC_MERCHANTS[category])), category
+
+
+def _monthly(start, end, day_of_month):
+    """The days between start and end (both dates) that fall on `day_of_month`."""
+    current = start.replace(day=1)
+    while current <= end:
+        day = current.replace(day=min(day_of_month, 28))
+        if start <= day <= end:
+            yield day
+        current = (current + timedelta(days=32)).replace(day=1)
+
+
+def _transactions(user_id, categories, count, days, rng):
+    """Yields the user's transactions in date order."""
+    now = timezone.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = (midnight - timedelta(days=days - 1)).date()
+    last_day = midnight.date()
+
+    # Fixed monthly entries first, so that small accounts still have their bills
+    fixed = {}
+    for category, description, day_of_month, amount in RECURRING_BILLS:
+        for day in _monthly(first_day, last_day, day_of_month):
+            if 'ELECTRICITY' in description:
+                amount_today = amount * ELECTRICITY_FACTORS.get(day.month, 1.0) * rng.uniform(0.85, 1.15)
+            else:
+                amount_today = amount
+            fixed.setdefault(day, []).append((categories[category], description, amount_today, 'expense'))
+    description, day_of_month, amount = SALARY
+    for day in _monthly(first_day, last_day, day_of_month):
+        fixed.setdefault(day, []).append((None, description, amount, 'income'))
+    fixed_count = sum(len(entries) for entries in fixed.values())
+
+    # Spread the purchases over the days by weekday, season and slow growth
+    all_days = [first_day + timedelta(days=i) for i in range(days)]
+    weights = itertools.accumulate(
+        WEEKDAY_FACTORS[day.weekday()] * MONTH_FACTORS[day.month] * (0.8 + 0.4 * i / days)
+        for i, day in enumerate(all_days)
+    )
+    per_day = Counter(rng.choices(range(days), cum_weights=list(weights), k=max(count - fixed_count, 0)))
+    names = list(PURCHASES)
+    shares = [PURCHASES[name][0] for name in names]
+
+    produced = 0
+    for i, day in enumerate(all_days):
+        entries = list(fixed.get(day, ()))
+        for name in rng.choices(names, weights=shares, k=per_day[i]):
+            median = PURCHASES[name][1]
+            amount = median * rng.lognormvariate(0, 0.6)
+            if name == 'Shopping':
+                amount *= MONTH_FACTORS[day.month]
+            category_id = None if rng.random() < UNCATEGORIZED_SHARE else categories[name]
+            entries.append((category_id, description_for(rng, rng.choice(SYNTHETIC_MERCHANTS[name])), amount, 'expense'))
+        midnight_of_day = midnight - timedelta(days=(last_day - day).days)
+        # Waking hours, and nothing in the future: today's transactions happen before now
+        day_start = midnight_of_day + timedelta(hours=8)
+        if now < day_start:
+            day_start = midnight_of_day
+        day_length = min(timedelta(hours=15), now - day_start)
+        moments = sorted(day_start + day_length * rng.random() for _ in entries)
+        for (category_id, text, amount, transaction_type), moment in zip(entries, moments):
+            if produced == count:
+                return
+            yield Transaction(
+                user_id=user_id,
+                category_id=category_id,
+                amount=Decimal(max(amount, 1)).quantize(Decimal('0.01')),
+                transaction_type=transaction_type,
+                description=text,
+                date=moment,
+            )
+            produced += 1
+
+
+def generate_user(username, transactions, days, rng, password=None, train=True, progress=None):
+    """
+    Creates a user with categories, keyword rules for half of each category's merchants (the
+    classifier learns the rest), monthly budgets and `transactions` transactions over the last
+    `days` days. Rows are written with bulk_create, so the rollup, rules version and classifier
+    that signals would maintain are brought up to date here. Returns the user.
+    """
+    started = time.perf_counter()
+    user = User.objects.create_user(username=username, password=password)
+    categories = {
+        category.name: category.pk
+        for category in Category.objects.bulk_create(Category(user=user, name=name) for name in SYNTHETIC_MERCHANTS)
+    }
+    Keyword.objects.bulk_create(
+        Keyword(user=user, category_id=categories[name], text=merchant)
+        for name, merchants in SYNTHETIC_MERCHANTS.items() for merchant in merchants[::2]
+    )
+
+    # Budgets a little above what a typical month costs, so that some months go over
+    monthly = Counter()
+    for name, (share, median) in PURCHASES.items():
+        monthly[name] += share * median * transactions / (days / 30)
+    for name, _, _, amount in RECURRING_BILLS:
+        monthly[name] += amount
+    Budget.objects.bulk_create(
+        Budget(user=user, category_id=categories[name], amount=Decimal(round(total * 1.1, -2) or 100))
+        for name, total in monthly.items()
+    )
+
+    rows = _transactions(user.pk, categories, transactions, days, rng)
+    written = 0
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        with transaction.atomic():
+            Transaction.objects.bulk_create(batch)
+        written += len(batch)
+        if progress and written % PROGRESS_EVERY == 0:
+            progress(f'  {username}: {written:,} transactions')
+
+    # bulk_create skips the signals that keep these up to date (transactions_changed() bumps the
+    # data version for the budgets too)
+    rebuild_daily_spend(user.pk)
+    RulesVersion.bump(user.pk)
+    if train and classifier.enabled():
+        classifier.train_classifier(user.pk)
+    transactions_changed(user.pk)
+    if progress:
+        progress(f'  {username}: done in {time.perf_counter() - started:.1f}s')
+    return user
@@ -1,3 +1,683 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.tests import TEST_STORAGES
+from .categorizer import TransactionCategorizer, _categorizer_cache
+from .classifier import load_classifier, train_classifier
+from .forecaster import SpendingForecaster, _sarimax, daily_series, seasonal_smoothing_forecast
+from .importer import TransactionImporter
+from .models import (
+    Budget, Category, CategoryClassifier, ClassifierChange, DailySpend, ForecastModelState, ForecastResult, Keyword,
+    RulesJob, RulesVersion, Transaction,
+)
+from .recategorize import RuleApplier
+from .rollups import verify_daily_spend
+
+
+class BudgetPlanTests(TestCase):
+    """Budgets for many categories and months are saved in a fixed number of queries, all or nothing."""
+    # Session, user, categories, savepoint, month upsert, standing select, standing insert, data version, release
+    QUERY_BUDGET = 9
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='carol', password='secret-password')
+        cls.categories = Category.objects.bulk_create(Category(user=cls.user, name=f'Category {i}') for i in range(20))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post_plan(self, budgets):
+        return self.client.post(reverse('budget_plan'), json.dumps({'budgets': budgets}), content_type='application/json')
+
+    def year_plan(self, amount):
+        return [
+            {'category_id': category.pk, 'month': f'2026-{month:02d}', 'amount': amount}
+            for category in self.categories for month in range(1, 13)
+        ] + [{'category_id': category.pk, 'amount': amount} for category in self.categories]
+
+    def test_query_count_does_not_grow_with_the_plan(self):
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.post_plan(self.year_plan('100.00'))
+        self.assertEqual(response.json(), {'status': 'success', 'saved': 260, 'removed': 0})
+        self.assertEqual(Budget.objects.filter(user=self.user).count(), 260)
+
+    def test_plan_updates_and_removes_budgets(self):
+        self.post_plan(self.year_plan('100.00'))
+        category = self.categories[0]
+        response = self.post_plan([
+            {'category_id': category.pk, 'month': '2026-01', 'amount': '250.50'},
+            {'category_id': category.pk, 'month': '2026-02', 'amount': None},
+            {'category_id': category.pk, 'amount': 75},
+        ])
+        self.assertEqual(response.json(), {'status': 'success', 'saved': 2, 'removed': 1})
+        budgets = dict(Budget.objects.filter(user=self.user, category=category).values_list('month', 'amount'))
+        self.assertEqual(budgets[date(2026, 1, 1)], Decimal('250.50'))
+        self.assertNotIn(date(2026, 2, 1), budgets)
+        self.assertEqual(budgets[None], Decimal('75.00'))
+
+    def test_plan_changes_the_budget_history(self):
+        # The first request creates the user's data version
+        self.client.get(reverse('budget_history'))
+        etag = self.client.get(reverse('budget_history'))['ETag']
+        self.assertEqual(self.client.get(reverse('budget_history'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.post_plan([{'category_id': self.categories[0].pk, 'amount': '10'}])
+        response = self.client.get(reverse('budget_history'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_plan_with_another_users_category_saves_nothing(self):
+        other = Category.objects.create(user=User.objects.create_user(username='dave'), name='Theirs')
+        response = self.post_plan([
+            {'category_id': self.categories[0].pk, 'amount': '10'},
+            {'category_id': other.pk, 'amount': '10'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Budget.objects.exists())
+
+    def test_plan_with_an_invalid_amount_saves_nothing(self):
+        for amount in ('NaN', '-Infinity', 'lots', '-1'):
+            response = self.post_plan([{'category_id': self.categories[0].pk, 'amount': amount}])
+            self.assertEqual(response.status_code, 400, amount)
+        self.assertFalse(Budget.objects.exists())
+
+
+class SuggestCategoryTests(TestCase):
+    """Category suggestions take one description or a batch, and reject bodies of any other shape."""
+    def test_bodies_that_are_not_objects_are_rejected(self):
+        # Other tests' users had this id and rules version too, before their rollback
+        _categorizer_cache.clear()
+        user = User.objects.create_user(username='ivan')
+        food = Category.objects.create(user=user, name='Takeaway')
+        Keyword.objects.create(user=user, category=food, text='swiggy')
+        self.client.force_login(user)
+
+        def suggest(body):
+            return self.client.post(reverse('suggest_category'), body, content_type='application/json')
+
+        for body in ('["swiggy"]', '"swiggy"', '42', 'null', '{"description": 42}', '{"descriptions": "swiggy"}', '{'):
+            self.assertEqual(suggest(body).status_code, 400, body)
+        self.assertEqual(suggest('{"description": "SWIGGY 12"}').json(), {'status': 'success', 'category_id': food.pk})
+        self.assertEqual(suggest('{"descriptions": ["SWIGGY 12", "misc"]}').json()['category_ids'], [food.pk, None])
+
+
+class TransactionCategorizerTests(TestCase):
+    """The compiled rules pick the highest-priority keyword, and are rebuilt when the user's rules change."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lena')
+        cls.food = Category.objects.create(user=cls.user, name='Food')
+        cls.transport = Category.objects.create(user=cls.user, name='Transport')
+        cls.shopping = Category.objects.create(user=cls.user, name='Shopping')
+
+    def setUp(self):
+        # Other tests' users had this id and rules version too, before their rollback
+        _categorizer_cache.clear()
+
+    def test_user_keywords_come_before_the_defaults(self):
+        Keyword.objects.create(user=self.user, category=self.food, text='uber eats')
+        Keyword.objects.create(user=self.user, category=self.shopping, text='eats')
+        suggest = TransactionCategorizer.for_user(self.user).suggest_categories
+        self.assertEqual(suggest(['UBER EATS 42', 'UBER TRIP', 'CAFE EATS']),
+                         [self.food.pk, self.transport.pk, self.shopping.pk])
+
+    def test_priority_wins_over_position_and_length(self):
+        # 'fuel' is listed before 'amazon' in the defaults, and 'uber eats' before the shorter 'eats'
+        Keyword.objects.create(user=self.user, category=self.food, text='uber eats')
+        Keyword.objects.create(user=self.user, category=self.shopping, text='eats')
+        suggest = TransactionCategorizer.for_user(self.user).suggest_categories
+        self.assertEqual(suggest(['AMAZON FUEL CARD', 'EATS AT UBER EATS']), [self.transport.pk, self.food.pk])
+
+    def test_cached_until_the_rules_change(self):
+        with self.assertNumQueries(3):
+            categorizer = TransactionCategorizer.for_user(self.user)
+        self.assertEqual(categorizer.suggest_category('NETFLIX'), None)
+        with self.assertNumQueries(1):
+            self.assertIs(TransactionCategorizer.for_user(self.user), categorizer)
+
+        version = RulesVersion.current(self.user.pk)
+        Keyword.objects.create(user=self.user, category=self.shopping, text='netflix')
+        self.assertEqual(RulesVersion.current(self.user.pk), version + 1)
+        rebuilt = TransactionCategorizer.for_user(self.user)
+        self.assertIsNot(rebuilt, categorizer)
+        self.assertEqual(rebuilt.suggest_category('NETFLIX'), self.shopping.pk)
+
+    def test_reading_the_rules_version_writes_nothing(self):
+        user = User.objects.create_user(username='mona')
+        TransactionCategorizer.for_user(user)
+        self.assertFalse(RulesVersion.objects.filter(user=user).exists())
+        # The first rule written starts the counter past the version 0 the read was cached at
+        Category.objects.create(user=user, name='Food')
+        self.assertEqual(RulesVersion.current(user.pk), 1)
+        self.assertEqual(TransactionCategorizer.for_user(user).suggest_category('SWIGGY'), Category.objects.get(user=user).pk)
+
+
+@override_settings(CATEGORIZER_CLASSIFIER=True, CLASSIFIER_FOLD_CHANGES=5, CLASSIFIER_MIN_EXAMPLES=1)
+class ClassifierQueueTests(TestCase):
+    """Saves queue their changes for the learned classifier, which folds them into the stored model in batches."""
+    def test_saves_are_queued_then_folded(self):
+        user = User.objects.create_user(username='heidi')
+        food = Category.objects.create(user=user, name='Food')
+        for i in range(4):
+            Transaction.objects.create(user=user, category=food, amount=Decimal('10.00'),
+                                       transaction_type='expense', description=f'SWIGGY ORDER {i}')
+        self.assertFalse(CategoryClassifier.objects.filter(user=user).exists())
+        self.assertEqual(ClassifierChange.objects.filter(user=user).count(), 4)
+        # Queued changes are learned all the same
+        self.assertEqual(load_classifier(user.pk).predict('swiggy order 9'), food.pk)
+
+        Transaction.objects.create(user=user, category=food, amount=Decimal('10.00'),
+                                   transaction_type='expense', description='SWIGGY ORDER 4')
+        self.assertEqual(load_classifier(user.pk).examples, 5)
+        self.assertFalse(ClassifierChange.objects.filter(user=user).exists())
+        self.assertEqual(load_classifier(user.pk).examples, 5)
+
+    def test_only_categories_the_user_chose_are_learned(self):
+        # Other tests' users had this id and rules version too, before their rollback
+        _categorizer_cache.clear()
+        user = User.objects.create_user(username='judy')
+        takeaway = Category.objects.create(user=user, name='Takeaway')
+        Keyword.objects.create(user=user, category=takeaway, text='swiggy')
+        statement = 'Date,Description,Amount,Category\n2026-10-01,SWIGGY 1,-10,\n2026-10-02,ZOMATO 2,-12,Takeaway\n'
+        TransactionImporter(user).import_rows(csv.reader(io.StringIO(statement)))
+        suggested = Transaction.objects.get(user=user, description='SWIGGY 1')
+        self.assertEqual((suggested.category_id, suggested.category_source), (takeaway.pk, 'auto'))
+        # Only the row the file categorized was learned, and retraining doesn't pick up the suggestion
+        self.assertEqual(load_classifier(user.pk).examples, 1)
+        self.assertEqual(train_classifier(user.pk).examples, 1)
+
+        # Saving it with the form makes the category the user's choice
+        self.client.force_login(user)
+        self.client.post(reverse('edit_transaction', args=[suggested.pk]), {
+            'transaction_type': 'expense', 'amount': '10.00', 'description': 'SWIGGY 1',
+            'category': takeaway.pk, 'date': '2026-10-01T00:00',
+        })
+        suggested.refresh_from_db()
+        self.assertEqual(suggested.category_source, 'user')
+        self.assertEqual(load_classifier(user.pk).examples, 2)
+
+
+@override_settings(CATEGORIZER_CLASSIFIER=True, CLASSIFIER_MIN_EXAMPLES=1)
+class LearnedCategorizerTests(TestCase):
+    """The classifier only answers for descriptions no rule matches, and forgets deleted categories."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='kim')
+        cls.takeaway = Category.objects.create(user=cls.user, name='Takeaway')
+        cls.travel = Category.objects.create(user=cls.user, name='Travel')
+        for i in range(5):
+            for category, description in ((cls.takeaway, 'ZOMATO ORDER'), (cls.travel, 'UBER TRIP')):
+                Transaction.objects.create(user=cls.user, category=category, amount=Decimal('10.00'),
+                                           transaction_type='expense', description=f'{description} {i}')
+        Keyword.objects.create(user=cls.user, category=cls.travel, text='zomato gift card')
+        train_classifier(cls.user.pk)
+
+    def setUp(self):
+        # Other tests' users had this id and rules version too, before their rollback
+        _categorizer_cache.clear()
+
+    def test_rules_come_before_the_classifier(self):
+        categorizer = TransactionCategorizer.for_user(self.user)
+        suggestions = categorizer.suggest_categories(['ZOMATO ORDER 9', 'Zomato Gift Card 9', 'qqqq vvvv'])
+        self.assertEqual(suggestions, [self.takeaway.pk, self.travel.pk, None])
+        self.assertEqual(categorizer.suggest_categories(['ZOMATO ORDER 9'], use_classifier=False), [None])
+
+    def test_deleting_a_category_forgets_it(self):
+        Transaction.objects.create(user=self.user, category=self.travel, amount=Decimal('10.00'),
+                                   transaction_type='expense', description='UBER TRIP 9')
+        self.assertTrue(ClassifierChange.objects.filter(category=self.travel).exists())
+
+        self.travel.delete()
+        self.assertFalse(ClassifierChange.objects.filter(user=self.user).exists())
+        classifier = load_classifier(self.user.pk)
+        self.assertEqual((list(classifier.counts), classifier.examples), ([self.takeaway.pk], 5))
+
+
+class ForecastCacheTests(TestCase):
+    """Forecasts are cached per user until their expense data changes, whichever process changed it."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='olga')
+        cls.food = Category.objects.create(user=cls.user, name='Food')
+        cls.bills = Category.objects.create(user=cls.user, name='Bills')
+        now = timezone.now()
+        for day in range(30):
+            for category in (cls.food, cls.food, cls.bills):
+                Transaction.objects.create(user=cls.user, category=category, amount=Decimal('10.00'),
+                                           transaction_type='expense', description='purchase',
+                                           date=now - timedelta(days=day))
+
+    def setUp(self):
+        cache.clear()
+
+    def fits(self):
+        """How many forecasts forecast_for_user() fitted to answer."""
+        with mock.patch.object(SpendingForecaster, 'forecast_next_30_days', return_value=Decimal('300')) as fit:
+            self.assertEqual(SpendingForecaster.forecast_for_user(self.user), 300.0)
+        return fit.call_count
+
+    def test_hits_until_the_data_changes(self):
+        self.assertEqual(self.fits(), 1)
+        self.assertEqual(self.fits(), 0)
+        Transaction.objects.create(user=self.user, amount=Decimal('5.00'), transaction_type='expense', description='new')
+        self.assertEqual(self.fits(), 1)
+        self.assertEqual(self.fits(), 0)
+
+    def test_changes_made_in_another_process_are_seen(self):
+        self.assertEqual(self.fits(), 1)
+        moved = Transaction.objects.filter(user=self.user, category=self.food).order_by('-date')[2]
+        # No invalidation reaches this process's cache: only the data can tell
+        with mock.patch('transactions.signals.invalidate_forecast'):
+            # To a day that already has spending, so the totals, counts and dates stay the same
+            moved.date -= timedelta(days=1)
+            moved.save()
+            self.assertEqual(self.fits(), 1)
+            moved.category = self.bills
+            moved.save()
+            self.assertEqual(self.fits(), 1)
+        self.assertEqual(self.fits(), 0)
+
+
+class ForecastEngineTests(TestCase):
+    """The fast engine forecasts one or many series, and 'auto' only picks SARIMAX for long histories."""
+    WEEK = [10.0, 0.0, 0.0, 20.0, 0.0, 5.0, 40.0]
+
+    def test_fast_engine_shape(self):
+        weeks = np.array([self.WEEK * 20, [x * 2 for x in self.WEEK] * 20, [3.0] * 140])
+        self.assertEqual(seasonal_smoothing_forecast(weeks[0], steps=30).shape, (30,))
+        forecast = seasonal_smoothing_forecast(weeks, steps=30)
+        self.assertEqual(forecast.shape, (3, 30))
+        # Each series' weekly pattern carries on from where its history stopped
+        expected = np.array([self.WEEK * 5, [x * 2 for x in self.WEEK] * 5, [3.0] * 35])[:, :30]
+        np.testing.assert_allclose(forecast, expected, atol=1e-6)
+
+    def test_fast_engine_never_forecasts_negative_spending(self):
+        falling = np.linspace(100, 0, 60) - np.tile([0, 30, 0, 0, 0, 0, 0], 9)[:60]
+        self.assertGreaterEqual(seasonal_smoothing_forecast(falling, steps=30).min(), 0)
+
+    def test_auto_switches_to_sarimax_at_the_minimum_history(self):
+        forecaster = SpendingForecaster(engine='auto')
+        self.assertEqual((forecaster.engine_for(729), forecaster.engine_for(730)), ('fast', 'sarimax'))
+        with override_settings(FORECAST_AUTO_SARIMAX_MIN_DAYS=60):
+            self.assertEqual((forecaster.engine_for(59), forecaster.engine_for(60)), ('fast', 'sarimax'))
+        self.assertEqual(SpendingForecaster(engine='fast').engine_for(5000), 'fast')
+        with self.assertRaises(ValueError):
+            SpendingForecaster(engine='prophet')
+
+    def test_auto_forecasts_a_short_history_without_sarimax(self):
+        series = daily_series([date(2026, 1, 1) + timedelta(days=i) for i in range(70)], self.WEEK * 10)
+        with mock.patch('transactions.forecaster._sarimax') as sarimax:
+            forecast = SpendingForecaster(engine='auto').forecast_series(series, raise_errors=True)
+        sarimax.assert_not_called()
+        self.assertAlmostEqual(forecast, sum((self.WEEK * 5)[:30]), places=4)
+
+
+@override_settings(FORECAST_ENGINE='sarimax')
+class SarimaxWarmStartTests(TestCase):
+    """Refits continue from the user's saved SARIMAX model, unless it no longer matches or is due for a full fit."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='pia')
+        rng = np.random.default_rng(14)
+        cls.start = date(2026, 1, 1)
+        DailySpend.objects.bulk_create(
+            DailySpend(user=cls.user, date=cls.start + timedelta(days=day), count=1,
+                       total=Decimal(f'{10 + 20 * (day % 7 == 5) + rng.uniform(0, 5):.2f}'))
+            for day in range(90)
+        )
+
+    def forecast(self):
+        """Forecasts the user, returning how _sarimax() was called: (continued from a state, fitted from scratch)."""
+        with mock.patch('transactions.forecaster._sarimax', wraps=_sarimax) as sarimax:
+            forecast = SpendingForecaster(DailySpend.objects.filter(user=self.user), user_id=self.user.pk).forecast_next_30_days()
+        self.assertIsNotNone(forecast)
+        continued = sum('initial_state' in call.kwargs for call in sarimax.call_args_list)
+        return continued, sarimax.call_count - continued
+
+    def add_day(self):
+        last = DailySpend.objects.filter(user=self.user).latest('date').date
+        DailySpend.objects.create(user=self.user, date=last + timedelta(days=1), total=Decimal('12.00'), count=1)
+
+    def saved_state(self):
+        return ForecastModelState.objects.get(user=self.user).state
+
+    def test_refits_continue_from_the_saved_state(self):
+        self.assertEqual(self.forecast(), (0, 1))
+        full_fit_at = self.saved_state()['full_fit_at']
+        self.add_day()
+        self.assertEqual(self.forecast(), (1, 0))
+        state = self.saved_state()
+        self.assertEqual((state['history_days'], state['full_fit_at']), (90, full_fit_at))
+
+    def test_states_from_another_model_are_ignored(self):
+        self.forecast()
+        self.add_day()
+        state = self.saved_state()
+        ForecastModelState.objects.filter(user=self.user).update(
+            state={**state, 'version': state['version'] - 1, 'params': state['params'][:-1]},
+        )
+        self.assertEqual(self.forecast(), (0, 1))
+        self.assertEqual(self.saved_state()['version'], state['version'])
+
+    def test_stale_states_and_edited_histories_are_refitted(self):
+        self.forecast()
+        self.add_day()
+        state = self.saved_state()
+        stale = (timezone.now() - timedelta(days=8)).isoformat()
+        ForecastModelState.objects.filter(user=self.user).update(state={**state, 'full_fit_at': stale})
+        self.assertEqual(self.forecast(), (0, 1))
+        self.assertNotEqual(self.saved_state()['full_fit_at'], stale)
+
+        self.add_day()
+        DailySpend.objects.filter(user=self.user, date=self.start).update(total=Decimal('99.00'))
+        self.assertEqual(self.forecast(), (0, 1))
+
+
+class ForecastAllTests(TestCase):
+    """forecast_all stores a forecast and month-end projections for every user with spending."""
+    def test_stores_a_result_per_user(self):
+        today = timezone.localdate()
+        users = [User.objects.create_user(username=f'quinn{i}') for i in range(3)]
+        idle = User.objects.create_user(username='rosa')
+        DailySpend.objects.bulk_create(
+            DailySpend(user=user, date=today - timedelta(days=day), total=Decimal(10 * (i + 1)), count=1)
+            for i, user in enumerate(users) for day in range(60)
+        )
+        out = io.StringIO()
+        call_command('forecast_all', workers=1, batch_size=2, engine='fast', stdout=out, stderr=io.StringIO())
+        self.assertIn('3 users', out.getvalue())
+
+        results = {result.user_id: result for result in ForecastResult.objects.all()}
+        self.assertEqual(set(results), {user.pk for user in users})
+        self.assertNotIn(idle.pk, results)
+        for i, user in enumerate(users):
+            # A flat 10, 20 and 30 a day
+            self.assertAlmostEqual(float(results[user.pk].amount), 300 * (i + 1), places=1)
+            self.assertEqual(results[user.pk].projected_on, today)
+
+
+class TransactionImporterTests(TestCase):
+    """Statements with debit and credit columns import each row on the side that has its amount."""
+    def test_zero_in_the_other_column_counts_as_empty(self):
+        user = User.objects.create_user(username='heidi')
+        statement = (
+            'Date,Narration,Debit,Credit\n'
+            '2026-10-01,SALARY,0.00,500.00\n'
+            '2026-10-02,GROCERIES,120.50,0.00\n'
+            '2026-10-03,REFUND,,75\n'
+            '2026-10-04,BOTH,10.00,20.00\n'
+            '2026-10-05,NEITHER,0.00,0.00\n'
+        )
+        result = TransactionImporter(user).import_rows(csv.reader(io.StringIO(statement)))
+        self.assertEqual((result.created, result.invalid), (3, 2))
+        imported = dict(Transaction.objects.filter(user=user).values_list('description', 'transaction_type'))
+        self.assertEqual(imported, {'SALARY': 'income', 'GROCERIES': 'expense', 'REFUND': 'income'})
+        self.assertEqual(Transaction.objects.get(user=user, description='SALARY').amount, Decimal('500.00'))
+
+    def test_negative_debits_and_credits_are_stored_as_positive_amounts(self):
+        user = User.objects.create_user(username='nina')
+        statement = 'Date,Narration,Debit,Credit\n2026-10-01,GROCERIES,-50.00,\n2026-10-02,REFUND,,-20.00\n'
+        result = TransactionImporter(user).import_rows(csv.reader(io.StringIO(statement)))
+        self.assertEqual(result.created, 2)
+        imported = {t.description: (t.transaction_type, t.amount) for t in Transaction.objects.filter(user=user)}
+        self.assertEqual(imported, {'GROCERIES': ('expense', Decimal('50.00')), 'REFUND': ('income', Decimal('20.00'))})
+
+
+class ExportTransactionsCSVTests(TestCase):
+    """The CSV export streams the user's own transactions, filtered like the history, optionally gzipped."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='liam', password='secret-password')
+        cls.food = Category.objects.create(user=cls.user, name='Food')
+        other = User.objects.create_user(username='mia')
+        day = timezone.make_aware(datetime(2026, 9, 1, 12))
+        for i, (category, amount, transaction_type, description) in enumerate([
+            (cls.food, '250.00', 'expense', 'SWIGGY'),
+            (None, '5000.00', 'income', 'SALARY'),
+            (cls.food, '40.00', 'expense', 'CHAI, SAMOSA'),
+            (None, '1200.00', 'expense', 'RENT'),
+        ]):
+            Transaction.objects.create(user=cls.user, category=category, amount=Decimal(amount),
+                                       transaction_type=transaction_type, description=description,
+                                       date=day + timedelta(days=i))
+        Transaction.objects.create(user=other, amount=Decimal('1.00'), transaction_type='expense',
+                                   description='NOT MINE', date=day)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_transactions_csv'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def rows(self, **params):
+        return list(csv.reader(io.StringIO(self.export(**params).decode())))
+
+    def test_streams_every_transaction_oldest_first(self):
+        self.assertEqual(self.rows(), [
+            ['Date', 'Description', 'Category', 'Type', 'Amount'],
+            ['2026-09-01', 'SWIGGY', 'Food', 'expense', '250.00'],
+            ['2026-09-02', 'SALARY', 'N/A', 'income', '5000.00'],
+            ['2026-09-03', 'CHAI, SAMOSA', 'Food', 'expense', '40.00'],
+            ['2026-09-04', 'RENT', 'N/A', 'expense', '1200.00'],
+        ])
+
+    def test_filters(self):
+        def descriptions(**params):
+            return [row[1] for row in self.rows(**params)[1:]]
+
+        self.assertEqual(descriptions(start='2026-09-02', end='2026-09-03'), ['SALARY', 'CHAI, SAMOSA'])
+        self.assertEqual(descriptions(type='income'), ['SALARY'])
+        self.assertEqual(descriptions(category=self.food.pk), ['SWIGGY', 'CHAI, SAMOSA'])
+        self.assertEqual(descriptions(category='none', type='expense'), ['RENT'])
+        self.assertEqual(descriptions(min_amount='250', max_amount='1200'), ['SWIGGY', 'RENT'])
+
+    def test_gzip_round_trip(self):
+        response = self.client.get(reverse('export_transactions_csv'), {'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('transactions.csv.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.export())
+        for value in ('0', 'false', 'False'):
+            self.assertTrue(self.export(gzip=value).startswith(b'Date,'), value)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'start': '2026-13-01'}, {'end': 'yesterday'}, {'type': 'refund'}, {'gzip': 'maybe'}):
+            self.assertEqual(self.client.get(reverse('export_transactions_csv'), params).status_code, 400, params)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class RuleApplierTests(TestCase):
+    """Rules applied to past transactions move them in bulk and keep the rollups in step."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='erin', password='secret-password')
+        cls.rent = Category.objects.create(user=cls.user, name='Rent')
+        cls.food = Category.objects.create(user=cls.user, name='Food')
+        now = timezone.now()
+        for i in range(12):
+            Transaction.objects.create(user=cls.user, amount=Decimal('1000.00') + i, transaction_type='expense',
+                                       description=f'NEFT RENT {i}', date=now - timedelta(days=20 * i))
+        cls.by_hand = Transaction.objects.create(user=cls.user, category=cls.food, amount=Decimal('40.00'),
+                                                 transaction_type='expense', description='rent-a-bike snacks')
+        Transaction.objects.create(user=cls.user, amount=Decimal('5.00'), transaction_type='expense', description='misc')
+        Keyword.objects.create(user=cls.user, category=cls.rent, text='rent')
+
+    def setUp(self):
+        # Other tests' users had this id and rules version too, before their rollback
+        _categorizer_cache.clear()
+        self.client.force_login(self.user)
+
+    def test_dry_run_changes_nothing(self):
+        result = RuleApplier(self.user, chunk_size=5, dry_run=True).run()
+        self.assertEqual((result.scanned, result.matched, result.updated), (13, 12, 0))
+        self.assertEqual(result.by_category, {self.rent.pk: 12})
+        self.assertEqual(Transaction.objects.filter(category=self.rent).count(), 0)
+
+    def test_only_uncategorized_transactions_change_by_default(self):
+        result = RuleApplier(self.user, chunk_size=5).run()
+        self.assertEqual(result.updated, 12)
+        self.assertEqual(Transaction.objects.filter(category=self.rent).count(), 12)
+        self.by_hand.refresh_from_db()
+        self.assertEqual(self.by_hand.category, self.food)
+        self.assertEqual(verify_daily_spend(self.user.pk), {})
+
+    def test_including_categorized_transactions(self):
+        response = self.client.post(reverse('manage_rules'), {'action': 'apply_rules', 'include_categorized': '1'})
+        self.assertRedirects(response, reverse('manage_rules'))
+        job = self.client.get(reverse('manage_rules')).context['rules_job']
+        self.assertEqual((job.updated, job.complete), (13, True))
+        self.assertIsNotNone(job.finished_at)
+        self.by_hand.refresh_from_db()
+        self.assertEqual(self.by_hand.category, self.rent)
+        self.assertEqual(verify_daily_spend(self.user.pk), {})
+
+    @override_settings(APPLY_RULES_MAX_SYNC_ROWS=5)
+    def test_runs_in_the_request_stop_at_the_row_cap(self):
+        self.client.post(reverse('manage_rules'), {'action': 'apply_rules', 'preview': '1'})
+        job = RulesJob.objects.get(user=self.user)
+        self.assertEqual((job.scanned, job.complete, job.dry_run), (5, False, True))
+        self.assertContains(self.client.get(reverse('manage_rules')), 'python manage.py apply_rules erin')
+
+    @override_settings(FORECAST_WORKER=True)
+    def test_the_worker_runs_queued_rules(self):
+        self.client.post(reverse('manage_rules'), {'action': 'apply_rules'})
+        self.assertEqual(Transaction.objects.filter(category=self.rent).count(), 0)
+        self.assertContains(self.client.get(reverse('manage_rules')), 'Queued')
+
+        call_command('forecast_worker', '--once', stdout=io.StringIO())
+        job = RulesJob.objects.get(user=self.user)
+        self.assertEqual((job.updated, job.by_category), (12, {str(self.rent.pk): 12}))
+        self.assertEqual(Transaction.objects.filter(category=self.rent).count(), 12)
+        self.assertContains(self.client.get(reverse('manage_rules')), 'Rent: 12.')
+
+
+class TransactionHistoryTests(TestCase):
+    """The history pages through the user's transactions newest first, seeking on (date, id)."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='nadia')
+        other = User.objects.create_user(username='oscar')
+        now = timezone.now().replace(microsecond=0)
+        # Most rows share a date, so the pages have to be told apart by id
+        Transaction.objects.bulk_create(
+            [Transaction(user=cls.user, amount=Decimal('10.00'), transaction_type='expense',
+                         description=f'TIED {i}', date=now - timedelta(days=1)) for i in range(55)]
+            + [Transaction(user=cls.user, amount=Decimal('10.00'), transaction_type='expense',
+                           description=f'OLDER {i}', date=now - timedelta(days=2 + i)) for i in range(5)]
+            + [Transaction(user=other, amount=Decimal('10.00'), transaction_type='expense',
+                           description='THEIRS', date=now - timedelta(days=1))]
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def history(self, **params):
+        return self.client.get(reverse('transaction_history'), params)
+
+    def test_cursors_walk_every_row_once_across_tied_dates(self):
+        expected = list(Transaction.objects.filter(user=self.user).order_by('-date', '-id').values_list('id', flat=True))
+        seen, cursor = [], ''
+        while True:
+            page = self.history(limit=7, cursor=cursor).json()
+            self.assertLessEqual(len(page['transactions']), 7)
+            seen += [row['id'] for row in page['transactions']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_page_size(self):
+        self.assertEqual(len(self.history().json()['transactions']), 50)
+        self.assertEqual(len(self.history(limit=200).json()['transactions']), 60)
+        page = self.history(limit=60).json()
+        self.assertEqual((len(page['transactions']), page['next_cursor']), (60, None))
+        for limit in ('0', '201', '-1', 'ten'):
+            self.assertEqual(self.history(limit=limit).status_code, 400, limit)
+
+    def test_malformed_cursors_are_rejected(self):
+        for text in ('not a date|1', '2026-10-01T00:00:00|one', '2026-10-01T00:00:00', '\xff'):
+            cursor = base64.urlsafe_b64encode(text.encode('latin-1')).decode()
+            self.assertEqual(self.history(cursor=cursor).status_code, 400, text)
+        self.assertEqual(self.history(cursor='%%%').status_code, 400)
+
+
+class TransactionSearchTests(TestCase):
+    """Search finds words anywhere in the user's own descriptions, through an index kept current on write."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frank', password='secret-password')
+        other = User.objects.create_user(username='grace')
+        now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(user=cls.user, amount=Decimal('250.00'), transaction_type='expense',
+                        description='UPI/SWIGGY123@ybl', date=now - timedelta(days=40)),
+            Transaction(user=cls.user, amount=Decimal('99.00'), transaction_type='expense',
+                        description='Swiggy', date=now - timedelta(days=2)),
+            Transaction(user=cls.user, amount=Decimal('1200.00'), transaction_type='expense',
+                        description='NEFT-RENT TRANSFER', date=now - timedelta(days=1)),
+            Transaction(user=other, amount=Decimal('10.00'), transaction_type='expense', description='swiggy', date=now),
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, **params):
+        return self.client.get(reverse('transaction_search'), params)
+
+    def descriptions(self, **params):
+        response = self.search(**params)
+        self.assertEqual(response.status_code, 200)
+        return [row['description'] for row in response.json()['transactions']]
+
+    def test_matches_part_of_a_description_best_first(self):
+        self.assertEqual(self.descriptions(q='swiggy'), ['Swiggy', 'UPI/SWIGGY123@ybl'])
+        self.assertEqual(self.descriptions(q='rent xfer'), [])
+        self.assertEqual(self.descriptions(q='transfer rent'), ['NEFT-RENT TRANSFER'])
+
+    def test_filters_and_pages(self):
+        self.assertEqual(self.descriptions(q='swiggy', min_amount='100'), ['UPI/SWIGGY123@ybl'])
+        start = (timezone.localdate() - timedelta(days=7)).isoformat()
+        self.assertEqual(self.descriptions(q='swiggy', start=start), ['Swiggy'])
+        first = self.search(q='swiggy', limit=1).json()
+        self.assertEqual(first['next_page'], 2)
+        second = self.search(q='swiggy', limit=1, page=2).json()
+        self.assertEqual(([row['description'] for row in second['transactions']], second['next_page']),
+                         (['UPI/SWIGGY123@ybl'], None))
+        self.assertEqual(self.search(q='ab').status_code, 400)
+        self.assertEqual(self.search(q='swiggy', max_amount='lots').status_code, 400)
+
+    def test_numbers_other_than_ascii_digits_are_rejected(self):
+        for params in ({'page': '²'}, {'limit': '١٠'}, {'category': '²'}, {'page': '9' * 5000}):
+            self.assertEqual(self.search(q='swiggy', **params).status_code, 400, params)
+        self.assertEqual(self.client.get(reverse('budget_history'), {'months': '³'}).status_code, 400)
+
+    def test_matches_past_the_ranked_ones_follow_newest_first(self):
+        with mock.patch('transactions.search.MAX_RANKED_MATCHES', 1):
+            self.assertEqual(self.descriptions(q='swiggy'), ['Swiggy', 'UPI/SWIGGY123@ybl'])
+            second = self.search(q='swiggy', limit=1, page=2).json()
+            self.assertEqual(([row['description'] for row in second['transactions']], second['next_page']),
+                             (['UPI/SWIGGY123@ybl'], None))
+            self.assertEqual(self.descriptions(q='swiggy', max_amount='100'), ['Swiggy'])
+
+    def test_index_follows_edits_and_deletes(self):
+        Transaction.objects.filter(description='Swiggy').update(description='Zomato')
+        Transaction.objects.filter(description='NEFT-RENT TRANSFER').delete()
+        self.assertEqual(self.descriptions(q='swiggy'), ['UPI/SWIGGY123@ybl'])
+        self.assertEqual(self.descriptions(q='zomato'), ['Zomato'])
+        self.assertEqual(self.descriptions(q='rent'), [])
@@ -1,13 +1,20 @@
 from django.urls import path
-from .views import AddTransactionView, AddCategoryView, SuggestCategoryView, ManageRulesView, UpdateTransactionView, DeleteTransactionView, ExportTransactionsCSVView, ManageBudgetsView
+from finsight_project.async_views import choose_view
+from .views import AddTransactionView, AddCategoryView, SuggestCategoryView, ManageRulesView, UpdateTransactionView, DeleteTransactionView, ExportTransactionsCSVView, ManageBudgetsView, ImportTransactionsView, TransactionHistoryView, TransactionSearchView, BudgetHistoryView, BudgetPlanView
+from .views import AsyncSuggestCategoryView, AsyncTransactionHistoryView, AsyncTransactionSearchView, AsyncBudgetHistoryView, AsyncBudgetPlanView
 
 urlpatterns = [
         path('add/', AddTransactionView.as_view(), name='add_transaction'),
         path('add_category/', AddCategoryView.as_view(), name='add_category'),
-        path('suggest_category/', SuggestCategoryView.as_view(), name='suggest_category'),
+        path('suggest_category/', choose_view(SuggestCategoryView, AsyncSuggestCategoryView), name='suggest_category'),
         path('rules/', ManageRulesView.as_view(), name='manage_rules'),
         path('edit/<int:pk>/', UpdateTransactionView.as_view(), name='edit_transaction'),
         path('delete/<int:pk>/', DeleteTransactionView.as_view(), name='delete_transaction'),
+        path('history/', choose_view(TransactionHistoryView, AsyncTransactionHistoryView), name='transaction_history'),
+        path('search/', choose_view(TransactionSearchView, AsyncTransactionSearchView), name='transaction_search'),
         path('export/csv/', ExportTransactionsCSVView.as_view(), name='export_transactions_csv'),
+        path('import/csv/', ImportTransactionsView.as_view(), name='import_transactions_csv'),
         path('budgets/', ManageBudgetsView.as_view(), name='manage_budgets'),
+        path('budgets/history/', choose_view(BudgetHistoryView, AsyncBudgetHistoryView), name='budget_history'),
+        path('budgets/plan/', choose_view(BudgetPlanView, AsyncBudgetPlanView), name='budget_plan'),
     ]
\ No newline at end of file
@@ -5,15 +5,32 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import JsonResponse
 from django.urls import reverse
 import json
+from decimal import Decimal
 
-from .forms import TransactionForm, CategoryForm
-from .models import Transaction, Category, Keyword, Budget 
+from .forms import TransactionForm, CategoryForm, ImportTransactionsForm
+from .models import Transaction, Category, Keyword, Budget, RulesJob
 from .categorizer import TransactionCategorizer
+from .conditional import ConditionalGetMixin
+from .filters import TransactionFilterError, filter_transactions, parse_bool, parse_int
+from .pagination import keyset_page
+from .budgets import (
+    DEFAULT_HISTORY_MONTHS, MAX_HISTORY_MONTHS, BudgetPlanError, budget_history, parse_amount, parse_month, save_budgets,
+)
+from .importer import CSVImportError, TransactionImporter
+from .recategorize import max_sync_rows, run_rules_job
+from .search import search_transactions
 from django.views.generic.edit import UpdateView, DeleteView
 from django.urls import reverse_lazy
 
 import csv
-from django.http import HttpResponse
+import io
+import zlib
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.conf import settings
+from django.db import router
+from django.db.models import F, Q
+from finsight_project.async_views import AsyncLoginRequiredMixin, run_query
+from finsight_project.db_routing import ReplicaReadsMixin
 
 # This view is for the modal form to add a category inline
 class AddCategoryView(LoginRequiredMixin, View):
@@ -46,33 +63,72 @@ class AddTransactionView(LoginRequiredMixin, View):
             return redirect('dashboard')
         return render(request, 'transactions/add_transaction.html', {'form': form})
 
+# This view imports a bank statement CSV in bulk
+class ImportTransactionsView(LoginRequiredMixin, View):
+    template_name = 'transactions/import_transactions.html'
+
+    def get(self, request):
+        return render(request, self.template_name, {'form': ImportTransactionsForm()})
+
+    def post(self, request):
+        form = ImportTransactionsForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                # Large uploads are spooled to a temporary file, and the importer streams it in chunks
+                result = TransactionImporter(request.user).import_file(form.cleaned_data['csv_file'].file)
+            except CSVImportError as e:
+                form.add_error('csv_file', str(e))
+            else:
+                return render(request, self.template_name, {'form': ImportTransactionsForm(), 'result': result})
+        return render(request, self.template_name, {'form': form})
+
 # ===============================================================
 # ===         THIS IS THE VIEW THAT WAS UPDATED             ===
 # ===============================================================
 class SuggestCategoryView(LoginRequiredMixin, View):
+    # Upper bound on the number of descriptions accepted in one batch request
+    max_batch_size = 5000
+
     def post(self, request):
         try:
             data = json.loads(request.body)
+            if not isinstance(data, dict):
+                return JsonResponse({'status': 'error', 'message': 'The request body must be a JSON object.'}, status=400)
+            if 'descriptions' in data:
+                return self.post_batch(request, data['descriptions'])
+
             description = data.get('description', '')
+            if not isinstance(description, str):
+                return JsonResponse({'status': 'error', 'message': 'Description must be a string.'}, status=400)
             if not description:
                 return JsonResponse({'status': 'error', 'message': 'Description is empty.'}, status=400)
 
-            # 1. Fetch the user's categories
-            user_categories = Category.objects.filter(user=request.user)
-            # 2. Fetch the user's custom keywords (the new line)
-            user_keywords = Keyword.objects.filter(user=request.user)
-            
-            # 3. Initialize our smarter categorizer with both sets of data
-            categorizer = TransactionCategorizer(user_categories, user_keywords)
+            # The compiled categorizer is cached per user and only rebuilt when their rules change
+            categorizer = TransactionCategorizer.for_user(request.user)
             suggested_category_id = categorizer.suggest_category(description)
 
             if suggested_category_id:
                 return JsonResponse({'status': 'success', 'category_id': suggested_category_id})
             else:
                 return JsonResponse({'status': 'no_suggestion'})
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'The request body is not valid JSON.'}, status=400)
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+    def post_batch(self, request, descriptions):
+        """
+        Batch mode: {"descriptions": [...]} returns {"category_ids": [...]}, one entry per
+        description (null where there is no suggestion), using the user's rules loaded once.
+        """
+        if not isinstance(descriptions, list) or not all(isinstance(d, str) for d in descriptions):
+            return JsonResponse({'status': 'error', 'message': 'Descriptions must be a list of strings.'}, status=400)
+        if len(descriptions) > self.max_batch_size:
+            return JsonResponse({'status': 'error', 'message': f'At most {self.max_batch_size} descriptions per request.'}, status=400)
+
+        categorizer = TransactionCategorizer.for_user(request.user)
+        return JsonResponse({'status': 'success', 'category_ids': categorizer.suggest_categories(descriptions)})
+
 # This is the new view for the "Manage Smart Rules" page
 class ManageRulesView(LoginRequiredMixin, ListView):
     model = Category
@@ -96,6 +152,36 @@ class ManageRulesView(LoginRequiredMixin, ListView):
             keyword_id = request.POST.get('keyword_id')
             keyword = get_object_or_404(Keyword, id=keyword_id, user=request.user)
             keyword.delete()
+        elif action == 'apply_rules':
+            return self.apply_rules(request)
+        return redirect(reverse('manage_rules'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        job = RulesJob.objects.filter(user=self.request.user).first()
+        if job is not None:
+            names = {category.id: category.name for category in context['categories']}
+            by_category = sorted(job.by_category.items(), key=lambda item: -item[1])
+            context.update(
+                rules_job=job,
+                include_categorized=job.include_categorized,
+                rules_by_category=[(names.get(int(category_id)), count) for category_id, count in by_category],
+            )
+        return context
+
+    def apply_rules(self, request):
+        """
+        Queues a run of the rules over past transactions, or with 'preview' one that only counts
+        what would change. The forecast worker runs it; without one, it runs here, up to
+        APPLY_RULES_MAX_SYNC_ROWS transactions.
+        """
+        run_here = not settings.FORECAST_WORKER
+        job = RulesJob.enqueue(
+            request.user.pk, include_categorized=bool(request.POST.get('include_categorized')),
+            dry_run='preview' in request.POST, started=run_here,
+        )
+        if run_here:
+            run_rules_job(job, max_rows=max_sync_rows())
         return redirect(reverse('manage_rules'))
 
 class UpdateTransactionView(LoginRequiredMixin, UpdateView):
@@ -123,69 +209,285 @@ class DeleteTransactionView(LoginRequiredMixin, DeleteView):
         """Ensure users can only delete their own transactions."""
         return Transaction.objects.filter(user=self.request.user)
 
-class ExportTransactionsCSVView(LoginRequiredMixin, View):
-    def get(self, request, *args, **kwargs):
-        # 1. Create the HttpResponse object with the appropriate CSV header.
-        response = HttpResponse(content_type='text/csv')
-        # This header tells the browser to treat the response as a file attachment
-        response['Content-Disposition'] = 'attachment; filename="transactions.csv"'
+class TransactionHistoryView(LoginRequiredMixin, ConditionalGetMixin, View):
+    """
+    Returns the user's transactions as JSON, newest first, one page at a time, or 304 Not Modified
+    if nothing has changed since the copy the client has (see conditional.py).
 
-        # 2. Create a CSV writer object
-        writer = csv.writer(response)
+    Optional query parameters: the same filters as the CSV export, limit (page size) and
+    cursor (the next_cursor of the previous page). Pages are keyset-paginated on (date, id),
+    so any page is read straight from an index, however deep into the history it is.
+    """
+    default_page_size = 50
+    max_page_size = 200
 
-        # 3. Write the header row for the CSV file
-        writer.writerow(['Date', 'Description', 'Category', 'Type', 'Amount'])
+    def get(self, request):
+        try:
+            transactions = filter_transactions(Transaction.objects.filter(user=request.user), request.GET)
+            limit = self._page_size(request.GET.get('limit'))
+            rows, next_cursor = keyset_page(
+                transactions.values('id', 'date', 'description', 'amount', 'transaction_type', 'category_id',
+                                    category_name=F('category__name')),
+                request.GET.get('cursor'), limit,
+            )
+        except TransactionFilterError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        for row in rows:
+            row['date'] = row['date'].isoformat()
+            # As a string, so no precision is lost in the JSON
+            row['amount'] = str(row['amount'])
+        return JsonResponse({'status': 'success', 'transactions': rows, 'next_cursor': next_cursor})
+
+    def _page_size(self, value):
+        if not value:
+            return self.default_page_size
+        return parse_int(value, f"'limit' must be between 1 and {self.max_page_size}.", 1, self.max_page_size)
+
+class TransactionSearchView(ReplicaReadsMixin, TransactionHistoryView):
+    """
+    Searches the user's transaction descriptions and returns the matches as JSON, best match first.
+
+    Query parameters: q (words that must all appear in the description, anywhere and in any case),
+    the same filters as the history, limit (page size) and page (from 1). The matches are ranked
+    together (see TransactionSearch), so pages are numbered rather than keyset-paginated.
+    """
+    def get(self, request):
+        try:
+            matches = search_transactions(request.user, request.GET)
+            limit = self._page_size(request.GET.get('limit'))
+            page = self._page(request.GET.get('page'))
+        except TransactionFilterError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        # One extra row tells us whether there is a next page
+        offset = (page - 1) * limit
+        rows = list(matches[offset:offset + limit + 1])
+        next_page = page + 1 if len(rows) > limit else None
+        rows = rows[:limit]
+        for row in rows:
+            row['date'] = row['date'].isoformat()
+            row['amount'] = str(row['amount'])
+        return JsonResponse({'status': 'success', 'transactions': rows, 'page': page, 'next_page': next_page})
+
+    def _page(self, value):
+        if not value:
+            return 1
+        return parse_int(value, "'page' must be a positive number.", 1)
+
+class ExportTransactionsCSVView(ReplicaReadsMixin, LoginRequiredMixin, View):
+    """
+    Streams the user's transactions as CSV, optionally gzip-compressed.
+
+    Optional query parameters: start/end (YYYY-MM-DD, inclusive), type (expense/income),
+    category (an id, or 'none'), min_amount/max_amount (inclusive) and gzip (1/true or 0/false).
+    Rows are read with a server-side cursor and written out in small batches, so memory use and
+    query count stay the same however many rows are exported.
+    """
+    chunk_size = 2000
+    rows_per_write = 500
+
+    def get(self, request, *args, **kwargs):
+        # 1. Build the filtered queryset, fetching only the columns we write
+        try:
+            transactions = filter_transactions(Transaction.objects.filter(user=request.user), request.GET)
+            compress = parse_bool(request.GET.get('gzip', ''), "'gzip' must be 1 or 0.")
+        except TransactionFilterError as e:
+            return HttpResponseBadRequest(str(e))
 
-        # 4. Get all transactions for the current user, ordered by date
-        transactions = Transaction.objects.filter(user=request.user).order_by('date')
+        # The rows are read as the response streams, after dispatch() has returned, so the database is picked now
+        transactions = transactions.using(router.db_for_read(Transaction))
+        rows = transactions.order_by('date').values_list(
+            'date', 'description', 'category__name', 'transaction_type', 'amount'
+        ).iterator(chunk_size=self.chunk_size)
 
-        # 5. Loop through the transactions and write each one to a row in the CSV
-        for transaction in transactions:
-            writer.writerow([
-                transaction.date.strftime('%Y-%m-%d'),
-                transaction.description,
-                transaction.category.name if transaction.category else 'N/A',
-                transaction.transaction_type,
-                transaction.amount
-            ])
+        # 2. Stream the CSV, compressing it on the fly if asked to
+        filename = 'transactions.csv'
+        content_type = 'text/csv'
+        content = self._csv_chunks(rows)
+        if compress:
+            filename += '.gz'
+            content_type = 'application/gzip'
+            content = self._gzip_chunks(content)
 
-        # 6. Return the response to the user
+        response = StreamingHttpResponse(content, content_type=content_type)
+        # This header tells the browser to treat the response as a file attachment
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
+
+    def _csv_chunks(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Date', 'Description', 'Category', 'Type', 'Amount'])
+        for count, (date, description, category_name, transaction_type, amount) in enumerate(rows, start=1):
+            writer.writerow([date.strftime('%Y-%m-%d'), description, category_name or 'N/A', transaction_type, amount])
+            if count % self.rows_per_write == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def _gzip_chunks(self, chunks):
+        # wbits=31 makes zlib write a gzip header and trailer
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk.encode('utf-8'))
+            if compressed:
+                yield compressed
+        yield compressor.flush()
     
 class ManageBudgetsView(LoginRequiredMixin, View):
+        """
+        Edits the standing monthly budgets, or with ?month=YYYY-MM the budgets for one month,
+        which take the standing ones' place for that month.
+        """
         template_name = 'transactions/manage_budgets.html'
 
+        def _month(self, value):
+            # None selects the standing budgets
+            if not value:
+                return None
+            try:
+                return parse_month(value)
+            except ValueError:
+                return None
+
         def get(self, request, *args, **kwargs):
+            return self._render(request, self._month(request.GET.get('month')))
+
+        def _render(self, request, month, error=None):
             # Get all of the user's categories
             categories = Category.objects.filter(user=request.user)
-            # Get all of the user's existing budgets
-            budgets = Budget.objects.filter(user=request.user)
+            # The standing budgets, and the month's own ones if a month is selected
+            budgets = Budget.objects.filter(user=request.user).filter(Q(month__isnull=True) | Q(month=month))
             
-            # Create a dictionary to easily look up the budget amount for a category
-            budget_map = {budget.category.id: budget.amount for budget in budgets}
+            # Dictionaries to easily look up the budget amount for a category
+            budget_map = {budget.category_id: budget.amount for budget in budgets if budget.month == month}
+            standing_map = {budget.category_id: budget.amount for budget in budgets if budget.month is None}
             
             context = {
                 'categories': categories,
                 'budget_map': budget_map,
+                'standing_map': standing_map,
+                'month': month,
+                'error': error,
             }
             return render(request, self.template_name, context)
 
         def post(self, request, *args, **kwargs):
-            # Loop through all the data sent from the form
-            for key, value in request.POST.items():
-                if key.startswith('budget_'):
-                    category_id = key.split('_')[1]
-                    try:
-                        category = Category.objects.get(id=category_id, user=request.user)
-                        amount = value if value else 0 # Default to 0 if empty
-                        
-                        # Update the budget if it exists, otherwise create a new one
-                        Budget.objects.update_or_create(
-                            user=request.user,
-                            category=category,
-                            defaults={'amount': amount}
-                        )
-                    except (Category.DoesNotExist, ValueError):
-                        # Ignore if category doesn't exist or amount is invalid
+            month = self._month(request.POST.get('month'))
+            # Collect every budget sent from the form, then save them all at once
+            plan = []
+            try:
+                for key, value in request.POST.items():
+                    if not key.startswith('budget_'):
                         continue
-            return redirect('manage_budgets')
\ No newline at end of file
+                    category_id = parse_int(key.removeprefix('budget_'), 'The form has an unknown budget in it.')
+                    if not value:
+                        # A month left blank goes back to the standing budget; a standing one left blank is 0
+                        plan.append((category_id, month, None if month is not None else Decimal(0)))
+                    else:
+                        plan.append((category_id, month, parse_amount(value)))
+                save_budgets(request.user, plan)
+            except (BudgetPlanError, TransactionFilterError) as e:
+                return self._render(request, month, error=str(e))
+            if month is not None:
+                return redirect(f"{reverse('manage_budgets')}?month={month:%Y-%m}")
+            return redirect('manage_budgets')
+
+
+class BudgetPlanView(LoginRequiredMixin, View):
+    """
+    Sets many budgets in one request, for any number of categories and months:
+    POST {"budgets": [{"category_id": 3, "month": "2026-11", "amount": "1200.00"}, ...]}.
+    "month" is "YYYY-MM", or null (or left out) for the standing budget, and an "amount" of
+    null removes the budget. Every entry is checked before anything is saved, and all of
+    them are saved in one transaction.
+    """
+    # Upper bound on the number of budgets accepted in one request
+    max_entries = 5000
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            entries = data.get('budgets') if isinstance(data, dict) else None
+            if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+                raise BudgetPlanError("'budgets' must be a list of objects.")
+            if len(entries) > self.max_entries:
+                raise BudgetPlanError(f'At most {self.max_entries} budgets per request.')
+            saved, removed = save_budgets(request.user, [self._entry(entry) for entry in entries])
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'The request body is not valid JSON.'}, status=400)
+        except BudgetPlanError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        return JsonResponse({'status': 'success', 'saved': saved, 'removed': removed})
+
+    def _entry(self, entry):
+        category_id = entry.get('category_id')
+        if not isinstance(category_id, int) or isinstance(category_id, bool):
+            raise BudgetPlanError("Every budget needs an integer 'category_id'.")
+        if 'amount' not in entry:
+            raise BudgetPlanError("Every budget needs an 'amount' (null removes the budget).")
+        month = entry.get('month')
+        if month is not None:
+            try:
+                month = parse_month(month)
+            except (TypeError, ValueError):
+                raise BudgetPlanError(f"'{month}' is not a month; use YYYY-MM.")
+        amount = entry['amount']
+        return category_id, month, None if amount is None else parse_amount(amount)
+
+
+class BudgetHistoryView(LoginRequiredMixin, ConditionalGetMixin, View):
+    """
+    Returns budget versus actual spending per category for the last `months` months
+    (default 12) as JSON, oldest month first. Read from the monthly spending counters.
+    Conditional on the user's data version, like the transaction history.
+    """
+    def get(self, request):
+        try:
+            months = self._months(request.GET.get('months'))
+        except TransactionFilterError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        history = budget_history(request.user, months)
+        for entry in history:
+            entry['month'] = entry['month'].strftime('%Y-%m')
+            for row in entry['categories']:
+                # As strings, so no precision is lost in the JSON
+                row['budget'] = None if row['budget'] is None else str(row['budget'])
+                row['spent'] = str(row['spent'])
+        return JsonResponse({'status': 'success', 'history': history})
+
+    def _months(self, value):
+        if not value:
+            return DEFAULT_HISTORY_MONTHS
+        return parse_int(value, f"'months' must be between 1 and {MAX_HISTORY_MONTHS}.", 1, MAX_HISTORY_MONTHS)
+
+
+# --- Async versions, for ASGI deployments (ASYNC_VIEWS=True) ---
+# Each runs the sync view's handler on the query pool, so the event loop stays free while it waits
+# on the database; the categorizer's and classifier's CPU work happens there too.
+class AsyncSuggestCategoryView(AsyncLoginRequiredMixin, SuggestCategoryView):
+    async def post(self, request):
+        return await run_query(super().post, request)
+
+
+class AsyncTransactionHistoryView(AsyncLoginRequiredMixin, TransactionHistoryView):
+    async def get(self, request):
+        return await run_query(super().get, request)
+
+
+class AsyncTransactionSearchView(AsyncLoginRequiredMixin, TransactionSearchView):
+    async def get(self, request):
+        return await run_query(super().get, request)
+
+
+class AsyncBudgetHistoryView(AsyncLoginRequiredMixin, BudgetHistoryView):
+    async def get(self, request):
+        return await run_query(super().get, request)
+
+
+class AsyncBudgetPlanView(AsyncLoginRequiredMixin, BudgetPlanView):
+    async def post(self, request):
+        return await run_query(super().post, request)